@@ -0,0 +1,249 @@
+"""
+End-to-end benchmark of the agent pipeline against a simulated streaming backend.
+
+The benchmark builds the real agents with config.create_coloragents and runs the
+shared phase loop (pipeline.run_phases) with a MockBackend, for every shipped
+configuration and a range of synthetic story sizes. It reports:
+
+    - wall time per scenario, per phase and per agent,
+    - time to first token of every call,
+    - Python-side overhead per streamed chunk (time spent outside the backend),
+    - prompt size (characters and tokens) of every call,
+    - peak traced memory per scenario.
+
+Results are written as JSON so runs can be compared across commits.
+
+Usage:
+    python benchmarks/bench_pipeline.py --output bench_results.json
+    python benchmarks/bench_pipeline.py --sizes 1024 65536 --ttft 0.2
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+# pylint: disable=wrong-import-position
+from backends import Backend, MockBackend
+from cancellation import CancellationToken
+import config
+from events import Event, EventBus
+import pipeline
+from printer import ConsoleSubscriber
+import tokens
+
+DEFAULT_CONFIGS = [
+    os.path.join(ROOT, "config", "testv1.json"),
+    os.path.join(ROOT, "config", "testv2.json"),
+]
+DEFAULT_SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024]
+
+STORY_SENTENCE = (
+    "As a registered customer I want to track my order in real time "
+    "so that I know when it will arrive. "
+)
+
+
+class InstrumentedBackend(Backend):
+    """
+    Wraps a backend and records timings and prompt sizes of every call.
+
+    The time spent inside the wrapped backend's iterator is attributed to the
+    backend; the time between two chunks spent by the consumer (agent, console
+    output) is the Python-side overhead.
+
+    Every call is labelled with the phase and agent of the agent_start event
+    that preceded it on the same thread; observe must be subscribed to the bus
+    of the agents.
+    """
+
+    def __init__(self, backend: Backend, model: str) -> None:
+        self._backend = backend
+        self._model = model
+        self._current = threading.local()
+        self.calls: list[dict[str, typing.Any]] = []
+
+    def observe(self, event: Event) -> None:
+        """
+        Remember the phase and agent of an agent_start event for the call the
+        agent makes next, on the thread that emitted it.
+        """
+        if event.type == "agent_start":
+            self._current.labels = {"phase": event.phase, "agent": event.agent}
+
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Iterator[str]:
+        messages = request["messages"]
+        call = {
+            **getattr(self._current, "labels", {"phase": None, "agent": None}),
+            "prompt_chars": sum(len(message["content"]) for message in messages),
+            "prompt_tokens": sum(
+                tokens.count_message_tokens(message, self._model)
+                for message in messages
+            ),
+            "chunks": 0,
+        }
+        start = time.perf_counter()
+        backend_time = 0.0
+        overhead = 0.0
+        iterator = self._backend.stream(request, cancel)
+        while True:
+            before = time.perf_counter()
+            try:
+                piece = next(iterator)
+            except StopIteration:
+                backend_time += time.perf_counter() - before
+                break
+            after = time.perf_counter()
+            backend_time += after - before
+            if not call["chunks"]:
+                call["ttft"] = after - start
+            call["chunks"] += 1
+            yield piece
+            overhead += time.perf_counter() - after
+        call["wall_time"] = time.perf_counter() - start
+        call["backend_time"] = backend_time
+        call["overhead_per_chunk"] = overhead / call["chunks"] if call["chunks"] else 0
+        self.calls.append(call)
+
+    def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncIterator[str]:
+        raise NotImplementedError("The benchmark drives the synchronous pipeline")
+
+
+def make_story(size: int) -> str:
+    """
+    Build a synthetic user story of the given size in bytes.
+    """
+    repeats = size // len(STORY_SENTENCE) + 1
+    return (STORY_SENTENCE * repeats)[:size]
+
+
+def run_scenario(
+    config_path: str, story_size: int, mock_options: dict[str, typing.Any]
+) -> dict[str, typing.Any]:
+    """
+    Run the pipeline once and collect its measurements.
+    """
+    plan = config.compile_plan(config.read_json(config_path))
+    backend = InstrumentedBackend(
+        MockBackend(**mock_options), plan.config["openai_model"]
+    )
+    story = make_story(story_size)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            events = EventBus(subscribers=[backend.observe, ConsoleSubscriber()])
+            agents = config.create_coloragents(
+                plan.config, backend=backend, events=events
+            )
+            pipeline.run_phases(plan, agents, story, events=events)
+    wall_time = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    calls = backend.calls
+    phases: dict[str, float] = {}
+    per_agent: dict[str, float] = {}
+    for call in calls:
+        phases[str(call["phase"])] = (
+            phases.get(str(call["phase"]), 0.0) + call["wall_time"]
+        )
+        per_agent[call["agent"]] = per_agent.get(call["agent"], 0.0) + call["wall_time"]
+    total_chunks = sum(call["chunks"] for call in calls)
+    return {
+        "config": os.path.basename(config_path),
+        "story_bytes": story_size,
+        "wall_time": wall_time,
+        "peak_memory_bytes": peak_memory,
+        "phase_wall_time": phases,
+        "agent_wall_time": per_agent,
+        "mean_ttft": sum(call.get("ttft", 0) for call in calls) / max(len(calls), 1),
+        "overhead_per_chunk": (
+            sum(call["overhead_per_chunk"] * call["chunks"] for call in calls)
+            / total_chunks
+            if total_chunks
+            else 0.0
+        ),
+        "calls": calls,
+    }
+
+
+def git_revision() -> str | None:
+    """
+    Return the current commit hash, if the benchmark runs in a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    """
+    Run the benchmark from the command line.
+    """
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark.")
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS)
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="Story bytes."
+    )
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--response-tokens", type=int, default=300)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    mock_options = {
+        "ttft": args.ttft,
+        "tokens_per_second": args.tokens_per_second,
+        "response_tokens": args.response_tokens,
+    }
+    scenarios = []
+    for config_path in args.configs:
+        for size in args.sizes:
+            result = run_scenario(config_path, size, mock_options)
+            scenarios.append(result)
+            print(
+                f"{result['config']:<14} {size:>9} B  "
+                f"wall {result['wall_time']:7.3f} s  "
+                f"ttft {result['mean_ttft'] * 1000:7.1f} ms  "
+                f"overhead/chunk {result['overhead_per_chunk'] * 1e6:7.1f} us  "
+                f"peak {result['peak_memory_bytes'] / 1e6:7.1f} MB"
+            )
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "mock_backend": mock_options,
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Cold-start benchmark of the command line interface.
+
+Every scenario starts a fresh interpreter running src/main.py, so module
+imports are measured as a user experiences them. It reports:
+
+    - wall time of `main.py --help`,
+    - wall time until a configuration is read, validated and rejected,
+    - time from process start to the first streamed token of a run against
+      the mock backend, and the wall time of that run,
+    - the import time of every scenario (python -X importtime) and which heavy
+      modules, such as the HTTP clients and the tokenizer, it imported.
+
+Results are written as JSON so runs can be compared across commits.
+
+Usage:
+    python benchmarks/bench_startup.py --output startup_results.json
+    python benchmarks/bench_startup.py --repeat 20
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "src", "main.py")
+DEFAULT_CONFIG = os.path.join(ROOT, "config", "testv1.json")
+
+# Modules that should only be imported once the first request is sent.
+HEAVY_MODULES = ["aiohttp", "requests", "tiktoken", "colorama", "asyncio"]
+
+
+def scenarios(directory: str, config_path: str) -> dict[str, list[str]]:
+    """
+    Write the input files of the scenarios and return their arguments.
+    """
+    with open(config_path, "r", encoding="utf-8") as file:
+        config_file = json.load(file)
+    # Passes the required-field checks of config.validate and is then rejected.
+    invalid_path = os.path.join(directory, "invalid.json")
+    with open(invalid_path, "w", encoding="utf-8") as file:
+        json.dump({**config_file, "convergence_threshold": 0}, file)
+    story_path = os.path.join(directory, "story.txt")
+    with open(story_path, "w", encoding="utf-8") as file:
+        file.write("As a customer I want to track my order.")
+    mvp_path = os.path.join(directory, "mvp.txt")
+    with open(mvp_path, "w", encoding="utf-8") as file:
+        file.write("Order tracking page.")
+    return {
+        "help": ["--help"],
+        "validate": [invalid_path],
+        "first_request": [
+            config_path,
+            "--input",
+            story_path,
+            "--mvp",
+            mvp_path,
+            "--backend",
+            "mock",
+            "--events",
+            os.path.join(directory, "events.jsonl"),
+            "--checkpoint-dir",
+            os.path.join(directory, "checkpoints"),
+        ],
+    }
+
+
+def run_once(arguments: list[str], events_path: str | None) -> dict[str, float]:
+    """
+    Run the command line interface once and measure it.
+    """
+    if events_path and os.path.exists(events_path):
+        os.remove(events_path)
+    started = time.time()
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, MAIN, *arguments],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=False,
+    )
+    result = {"wall_time": time.perf_counter() - start}
+    if events_path:
+        with open(events_path, "r", encoding="utf-8") as file:
+            first_token = next(
+                event for event in map(json.loads, file) if event["type"] == "token"
+            )
+        result["time_to_first_token"] = first_token["time"] - started
+    return result
+
+
+def import_profile(arguments: list[str]) -> dict[str, typing.Any]:
+    """
+    Run the command line interface with -X importtime and summarize its imports.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", MAIN, *arguments],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=False,
+    ).stderr
+    cumulative: dict[str, int] = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, microseconds, name = line.split("|")
+        if not microseconds.strip().isdigit():
+            continue
+        cumulative[name.strip()] = int(microseconds)
+        # Modules imported by the program itself, not by another module.
+        if not name.startswith("  "):
+            total += int(microseconds)
+    return {
+        "import_time": total / 1e6,
+        "modules": len(cumulative),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in cumulative],
+    }
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """
+    Return the minimum and median of repeated measurements.
+    """
+    return {"min": min(values), "median": statistics.median(values)}
+
+
+def git_revision() -> str | None:
+    """
+    Return the current commit hash, if the benchmark runs in a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    """
+    Run the benchmark from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Cold-start benchmark of the CLI.")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="startup_results.json")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, arguments in scenarios(directory, args.config).items():
+            events_path = (
+                arguments[arguments.index("--events") + 1]
+                if "--events" in arguments
+                else None
+            )
+            runs = [run_once(arguments, events_path) for _ in range(args.repeat)]
+            result: dict[str, typing.Any] = {
+                metric: summarize([run[metric] for run in runs]) for metric in runs[0]
+            }
+            result.update(import_profile(arguments))
+            results[name] = result
+            first_token = (
+                f"first token {result['time_to_first_token']['median'] * 1000:7.1f} ms  "
+                if "time_to_first_token" in result
+                else ""
+            )
+            print(
+                f"{name:<14} wall {result['wall_time']['median'] * 1000:7.1f} ms  "
+                f"{first_token}"
+                f"imports {result['import_time'] * 1000:7.1f} ms  "
+                f"heavy {', '.join(result['heavy_modules']) or '-'}"
+            )
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "repeat": args.repeat,
+        "scenarios": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
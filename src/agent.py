@@ -2,14 +2,32 @@
 This module contains classes and functions to interact with the OpenAI API.
 
 Classes:
+    Message: A chat message whose content is assembled from streamed chunks.
     Agent: Manages communication with the OpenAI API and stores a history of messages.
     ColorAgent: A subclass of Agent that provides colored console output.
+    AsyncAgent: An asyncio-native counterpart of Agent.
+    AsyncColorAgent: A subclass of AsyncAgent that provides colored console output.
 
 Functions:
     make_message: Constructs a message in the appropriate dictionary format.
 
 Configuration:
-    The OpenAI API key is expected to be set via environment variables. 
+    The OpenAI API key is expected to be set via environment variables. The
+    completions are streamed from a backend, see the backends module.
+
+Events:
+    Agents report their calls as agent_start, token, agent_end and error events
+    on an event bus, see the events module. They do not print themselves;
+    ColorAgent subscribes a console printer by default.
+
+Cancellation:
+    A call can be passed a cancellation token, which is checked on every
+    streamed chunk; see the cancellation module.
+
+Budgets:
+    A call can be passed its own max_tokens, chosen by the run's budget; see
+    the budget module. The streamed part of a call that failed or was cut off
+    counts as usage, as it is billed.
 
 Example Usage:
     >>> from agent import Agent
@@ -19,13 +37,16 @@ Example Usage:
 """
 
 from collections import deque
-import os
+import itertools
 import typing
-import openai
 
-from printer import COLORS, ColorPrinter
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from backends import Backend, OpenAIBackend
+from cache import CompletionCache
+from cancellation import CancellationToken, Cancelled
+import compaction
+from events import EventBus
+from printer import COLORS, ConsoleSubscriber
+import tokens
 
 
 def make_message(
@@ -52,27 +73,105 @@ def make_message(
     return {"role": role, "content": content}
 
 
-class Agent:
+class Message:
     """
-    Represents an agent that interacts with the OpenAI API.
+    A chat message whose content may be assembled from streamed chunks.
 
-    This agent maintains a message history for a continuous interaction
-    with the OpenAI API.
+    Appending a chunk does not copy the content; the chunks are joined once, when
+    the content is read, and the joined text replaces them. The token count of
+    the content is kept until a chunk is appended, so a message is tokenized once.
 
     Attributes:
-        _history (deque[dict[str, str]]): The message history with ChatGPT.
-        _messages (list[dict[str, str]]): Permanent messages that precede user messages.
-        _openai_kwargs (dict): Additional parameters for the OpenAI API call.
+        role (str): The sender's role.
+    """
 
-    Example:
-        >>> agent = Agent(
-                openai_model="gpt-4",
-                max_tokens_per_call=3000,
-                max_history=0,
-                top_p=0.2,
-            )
-        >>> agent.get_full_response("Hi!")
-        "Hi! How are you?"
+    __slots__ = ("role", "_chunks", "_tokens")
+
+    def __init__(
+        self, role: typing.Literal["system", "user", "assistant"], content: str = ""
+    ) -> None:
+        """
+        Initialize the message.
+
+        Args:
+            role (typing.Literal["system", "user", "assistant"]): The sender's role.
+            content (str, optional): The initial content. Defaults to "".
+
+        Raises:
+            ValueError: If the role is not one of "system", "user", or "assistant".
+        """
+        if role not in ("system", "user", "assistant"):
+            raise ValueError(f"Invalid role: {role}")
+        self.role = role
+        self._chunks = [content] if content else []
+        # The model and the token count of the content, once counted
+        self._tokens: tuple[str, int] | None = None
+
+    @property
+    def content(self) -> str:
+        """
+        The message text.
+        """
+        if len(self._chunks) > 1:
+            self._chunks[:] = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def append(self, chunk: str) -> None:
+        """
+        Add a chunk to the end of the content.
+
+        Args:
+            chunk (str): The text to add.
+        """
+        self._chunks.append(chunk)
+        self._tokens = None
+
+    def tokens(self, model: str) -> int:
+        """
+        Count the tokens the message occupies in the prompt, see
+        tokens.count_message_tokens.
+
+        Args:
+            model (str): The OpenAI model whose tokenizer is used.
+
+        Returns:
+            int: The number of tokens, including the chat format overhead.
+        """
+        if self._tokens is None or self._tokens[0] != model:
+            self._tokens = (model, tokens.count_message_tokens(self.to_dict(), model))
+        return self._tokens[1]
+
+    def to_dict(self) -> dict[str, str]:
+        """
+        Convert the message to the dictionary format of the API, see make_message.
+
+        Returns:
+            dict[str, str]: A dictionary representing the message.
+        """
+        return {"role": self.role, "content": self.content}
+
+
+class _BaseAgent:
+    """
+    State and request bookkeeping shared by the synchronous and asynchronous agents.
+
+    Attributes:
+        _history (deque[Message]): The message history with ChatGPT.
+        _pinned (list[Message]): Permanent messages that are never trimmed,
+        such as the persona prompts. They precede all other messages.
+        _digest (Message | None): Compact digest of earlier phase turns,
+        sent right after the pinned messages.
+        _messages (list[Message]): Permanent messages that precede user messages.
+        _openai_kwargs (dict): Additional parameters for the OpenAI API call.
+        _cache (CompletionCache | None): Optional cache of previous completions.
+        _max_context_tokens (int | None): Token budget of prompt plus completion.
+        _backend (Backend): The backend the completions are streamed from.
+        _events (EventBus): The bus the agent's calls are reported on.
+        _response (str): The full text of the last complete response.
+        _phase (int | None): The phase of the current call, stamped on its
+        events.
+        usage (dict[str, int]): Number of API calls and the prompt and completion
+        tokens they used.
     """
 
     def __init__(
@@ -80,30 +179,74 @@ class Agent:
         openai_model: str,
         max_tokens_per_call: int,
         max_history: int,
+        cache: CompletionCache | None = None,
+        max_context_tokens: int | None = None,
+        backend: Backend | None = None,
+        name: str = "agent",
+        events: EventBus | None = None,
         **kwargs,
     ) -> None:
         """
-        Initialize the Agent object.
+        Initialize the agent state.
 
         Args:
             openai_model (str): The OpenAI model to use.
             max_tokens_per_call (int, optional): Maximum tokens per API call.
             max_history (int, optional): Maximum messages in history.
+            cache (CompletionCache | None, optional): Replays identical requests
+            from this cache instead of calling the API. Defaults to None.
+            max_context_tokens (int | None, optional): Token budget for the prompt
+            plus max_tokens_per_call. The oldest non-pinned messages are dropped to
+            fit it before each call. Defaults to the model's context size, if known.
+            backend (Backend | None, optional): The backend the completions are
+            streamed from. Defaults to the OpenAI API.
+            name (str, optional): Name of the agent, used to label its events.
+            events (EventBus | None, optional): The bus the agent's calls are
+            reported on. Defaults to a bus without subscribers.
             **kwargs: Additional keyword arguments for the OpenAI API,
             eg. top_p and temperature.
+
+        Raises:
+            ValueError: If max_context_tokens leaves no room for the prompt.
         """
+        self._name = name
         self._openai_model = openai_model
         self._max_tokens = max_tokens_per_call
-        self._history: deque[dict[str, str]] = deque()
+        self._history: deque[Message] = deque()
         self._max_history = max_history
+        self._cache = cache
+        self._backend = backend if backend is not None else OpenAIBackend()
+        self._events = events if events is not None else EventBus()
         self._openai_kwargs = kwargs
-        self._messages: list[dict[str, str]] = []
+        self._pinned: list[Message] = []
+        self._messages: list[Message] = []
+        self._digest_entries: list[str] = []
+        self._digest: Message | None = None
+        self._response = ""
+        self._phase: int | None = None
+        if max_context_tokens is None:
+            max_context_tokens = tokens.context_window(openai_model)
+        if max_context_tokens is not None and max_context_tokens <= max_tokens_per_call:
+            raise ValueError(
+                f"max_context_tokens ({max_context_tokens}) must be larger than "
+                f"max_tokens_per_call ({max_tokens_per_call})"
+            )
+        self._max_context_tokens = max_context_tokens
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    @property
+    def name(self) -> str:
+        """
+        The name of the agent.
+        """
+        return self._name
 
     def append_message(
         self,
         role: typing.Literal["system", "user", "assistant"],
         content: str,
         history: bool = True,
+        pinned: bool = False,
     ) -> None:
         """
         Add a new message to either the agent's history or permanent messages.
@@ -114,13 +257,376 @@ class Agent:
             content (str): Text content of the message.
             history (bool, optional): If True, add the message to the agent's history.
             If False, add to the agent's permanent messages. Defaults to True.
+            pinned (bool, optional): If True, add the message to the pinned messages,
+            which lead every prompt and are never trimmed. Defaults to False.
         """
-        if history:
-            self._history.append(make_message(role, content))
+        if pinned:
+            self._pinned.append(Message(role, content))
+        elif history:
+            self._history.append(Message(role, content))
         else:
-            self._messages.append(make_message(role, content))
+            self._messages.append(Message(role, content))
+
+    def compact(self, entry: str) -> None:
+        """
+        Replace the agent's earlier turns with a digest.
+
+        All non-pinned permanent messages and the history are dropped, and the
+        entry is added to the digest that follows the pinned messages. The digest
+        grows by one entry per call and is rendered once per call, so prompts
+        stay roughly flat across iterations.
+
+        Args:
+            entry (str): Summary of the turns being dropped, see
+            compaction.digest_entry.
+        """
+        self._messages.clear()
+        self._history.clear()
+        self._digest_entries.append(entry)
+        self._render_digest()
+
+    def _render_digest(self) -> None:
+        """
+        Render the digest message from its entries.
+        """
+        self._digest = None
+        if self._digest_entries:
+            self._digest = Message(
+                "user",
+                "\n\n".join([compaction.DIGEST_HEADER, *self._digest_entries]),
+            )
+
+    def state(self) -> dict[str, typing.Any]:
+        """
+        Capture the agent's conversation state and usage for a checkpoint.
+
+        The pinned messages are not part of the state; they are recreated from
+        the configuration.
+
+        Returns:
+            dict[str, typing.Any]: A JSON-serializable copy of the state.
+        """
+        return {
+            "messages": [message.to_dict() for message in self._messages],
+            "history": [message.to_dict() for message in self._history],
+            "digest": list(self._digest_entries),
+            "usage": dict(self.usage),
+        }
+
+    def restore(self, state: dict[str, typing.Any]) -> None:
+        """
+        Replace the agent's conversation state and usage with a captured state.
+
+        Args:
+            state (dict[str, typing.Any]): The output of state.
+        """
+        self._messages = [
+            Message(message["role"], message["content"])
+            for message in state["messages"]
+        ]
+        self._history = deque(
+            Message(message["role"], message["content"]) for message in state["history"]
+        )
+        self._digest_entries = list(state["digest"])
+        self._render_digest()
+        self.usage = dict(state["usage"])
+
+    def _prompt(self) -> typing.Iterator[Message]:
+        """
+        Iterate over the messages the next call sends: pinned messages, digest,
+        permanent messages and history, in that order.
+        """
+        digest = [self._digest] if self._digest is not None else []
+        return itertools.chain(self._pinned, digest, self._messages, self._history)
+
+    def _prompt_messages(self) -> list[dict[str, str]]:
+        """
+        Build the message list the next call sends.
+
+        Returns:
+            list[dict[str, str]]: Pinned messages, digest, permanent messages and
+            history, in that order.
+        """
+        return [message.to_dict() for message in self._prompt()]
+
+    def prompt_tokens(self, pending: str = "") -> int:
+        """
+        Count the tokens of the prompt the next call would send.
+
+        Args:
+            pending (str, optional): A user message to count as if it had been
+            appended, e.g. the next task.
+
+        Returns:
+            int: The number of prompt tokens.
+        """
+        total = tokens.TOKENS_PER_REPLY + sum(
+            message.tokens(self._openai_model) for message in self._prompt()
+        )
+        if pending:
+            total += tokens.count_message_tokens(
+                make_message("user", pending), self._openai_model
+            )
+        return total
+
+    def _fit_context(self, max_tokens: int) -> None:
+        """
+        Drop the oldest non-pinned messages until the prompt fits the token budget.
+
+        Permanent messages are dropped before history messages. The newest
+        permanent message and a pending user message in the history hold the
+        current task and are always kept. Token counts are kept on the messages,
+        so only new messages are tokenized.
+
+        Args:
+            max_tokens (int): The max_tokens of the call.
+        """
+        if self._max_context_tokens is None:
+            return
+        limit = self._max_context_tokens - max_tokens
+        total = self.prompt_tokens()
+        while total > limit:
+            pending = 1 if self._history and self._history[-1].role == "user" else 0
+            if len(self._messages) > 1:
+                dropped = self._messages.pop(0)
+            elif len(self._history) > pending:
+                dropped = self._history.popleft()
+            else:
+                break
+            total -= dropped.tokens(self._openai_model)
+
+    def _prepare_request(
+        self, user_message: str, max_tokens: int | None = None
+    ) -> dict[str, typing.Any]:
+        """
+        Trim the history, append the user message and build the API call arguments.
+
+        Args:
+            user_message (str): The user's message to be sent to the API.
+            max_tokens (int | None, optional): The max_tokens of the call.
+            Defaults to max_tokens_per_call.
+
+        Returns:
+            dict[str, typing.Any]: Keyword arguments for the chat completion call.
+        """
+        while len(self._history) > self._max_history:
+            self._history.popleft()
+
+        if user_message:
+            self._history.append(Message("user", user_message))
+
+        if max_tokens is None:
+            max_tokens = self._max_tokens
+        self._fit_context(max_tokens)
+
+        return {
+            "model": self._openai_model,
+            "max_tokens": max_tokens,
+            "messages": self._prompt_messages(),
+            **self._openai_kwargs,
+        }
+
+    def _open_response(self) -> tuple[Message, int]:
+        """
+        Return the history message the response of the next call is recorded in.
+
+        If the assistant's response is a continuation of the previous message, it
+        is appended to the previous message instead of creating a new one. A new
+        message is added to the history with the first piece of the response.
+
+        Returns:
+            tuple[Message, int]: The message and the length of its content before
+            the response.
+        """
+        if self._history and self._history[-1].role == "assistant":
+            message = self._history[-1]
+            return message, len(message.content)
+        return Message("assistant"), 0
+
+    def _record_message(self, response: Message, message: str) -> None:
+        """
+        Add a piece of the assistant's response to the history.
+
+        Args:
+            response (Message): The message returned by _open_response.
+            message (str): The response text.
+        """
+        if not self._history or self._history[-1] is not response:
+            self._history.append(response)
+        response.append(message)
+
+    def _cache_key(self, request: dict[str, typing.Any]) -> str | None:
+        """
+        Compute the completion cache key of a request.
+
+        Args:
+            request (dict[str, typing.Any]): The chat completion arguments.
+
+        Returns:
+            str | None: The cache key, or None if the agent has no cache.
+        """
+        if self._cache is None:
+            return None
+        return CompletionCache.make_key(request)
+
+    def _cached_response(self, key: str | None, response: Message) -> str | None:
+        """
+        Look up a request in the completion cache and record a hit in the history.
+
+        Args:
+            key (str | None): The key returned by _cache_key.
+            response (Message): The message returned by _open_response.
+
+        Returns:
+            str | None: The cached response, or None on a miss or without a cache.
+        """
+        if self._cache is None or key is None:
+            return None
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._record_message(response, cached)
+        return cached
+
+    def _event_data(self) -> dict[str, typing.Any]:
+        """
+        Describe the agent in its agent_start events.
+
+        Returns:
+            dict[str, typing.Any]: The event data.
+        """
+        return {"model": self._openai_model}
+
+    def _start_call(self, cached: bool) -> int:
+        """
+        Account for a call of the prepared prompt and report its start.
+
+        Calls answered by the completion cache do not count as API usage.
+
+        Args:
+            cached (bool): Whether the response comes from the completion cache.
 
-    def generate_response(self, user_message: str = "") -> typing.Iterator[str]:
+        Returns:
+            int: The prompt tokens of the call.
+        """
+        prompt_tokens = self.prompt_tokens()
+        if not cached:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+        self._events.emit(
+            "agent_start",
+            phase=self._phase,
+            agent=self._name,
+            data={
+                **self._event_data(),
+                "prompt_tokens": prompt_tokens,
+                "cached": cached,
+            },
+        )
+        return prompt_tokens
+
+    def _emit_token(self, message: str) -> None:
+        """
+        Report a piece of the response.
+
+        Args:
+            message (str): The piece.
+        """
+        self._events.emit(
+            "token", phase=self._phase, agent=self._name, text=message
+        )
+
+    def _fail_call(self, err: BaseException, response: str, prompt_tokens: int) -> None:
+        """
+        Account for the streamed part of a call that ended without a complete
+        response, and report it.
+
+        Args:
+            err (BaseException): The error, or the cancellation, that ended it.
+            response (str): The part of the response streamed before.
+            prompt_tokens (int): The value returned by _start_call.
+        """
+        completion_tokens = tokens.count_tokens(response, self._openai_model)
+        self.usage["completion_tokens"] += completion_tokens
+        self._events.emit(
+            "error",
+            phase=self._phase,
+            agent=self._name,
+            text=str(err) or type(err).__name__,
+            data={
+                "type": type(err).__name__,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            },
+        )
+
+    def _finish_call(self, response: str, prompt_tokens: int, cached: bool) -> None:
+        """
+        Account for the response of a call and report its end.
+
+        Args:
+            response (str): The full response text.
+            prompt_tokens (int): The value returned by _start_call.
+            cached (bool): Whether the response came from the completion cache.
+        """
+        self._response = response
+        completion_tokens = tokens.count_tokens(response, self._openai_model)
+        if not cached:
+            self.usage["completion_tokens"] += completion_tokens
+        self._events.emit(
+            "agent_end",
+            phase=self._phase,
+            agent=self._name,
+            text=response,
+            data={
+                "model": self._openai_model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cached": cached,
+            },
+        )
+
+    def _store_response(self, key: str | None, response: str) -> None:
+        """
+        Store a complete response in the completion cache, if there is one.
+
+        Args:
+            key (str | None): The key returned by _cache_key.
+            response (str): The full response text.
+        """
+        if self._cache is not None and key is not None:
+            self._cache.put(key, response)
+
+
+class Agent(_BaseAgent):
+    """
+    Represents an agent that interacts with the OpenAI API.
+
+    This agent maintains a message history for a continuous interaction
+    with the OpenAI API.
+
+    Attributes:
+        _history (deque[Message]): The message history with ChatGPT.
+        _messages (list[Message]): Permanent messages that precede user messages.
+        _openai_kwargs (dict): Additional parameters for the OpenAI API call.
+
+    Example:
+        >>> agent = Agent(
+                openai_model="gpt-4",
+                max_tokens_per_call=3000,
+                max_history=0,
+                top_p=0.2,
+            )
+        >>> agent.get_full_response("Hi!")
+        "Hi! How are you?"
+    """
+
+    def generate_response(
+        self,
+        user_message: str = "",
+        cancel: CancellationToken | None = None,
+        max_tokens: int | None = None,
+        phase: int | None = None,
+    ) -> typing.Iterator[str]:
         """
         Sends the accumulated messages (permanent and history) to the OpenAI API and
         yields the assistant's response in an Iterator stream.
@@ -132,39 +638,70 @@ class Agent:
         Args:
             user_message (str, optional): The user's message to be sent to the API.
             Defaults to "".
+            cancel (CancellationToken | None, optional): Checked on every
+            streamed chunk and passed to the backend; once it is cancelled,
+            the stream is closed.
+            max_tokens (int | None, optional): The max_tokens of the call.
+            Defaults to max_tokens_per_call.
+            phase (int | None, optional): The one-based phase the call belongs
+            to, stamped on its events.
 
         Yields:
             typing.Iterator[str]: The assistant's response from the OpenAI API.
-        """
-        while len(self._history) > self._max_history:
-            self._history.popleft()
 
-        if user_message:
-            self._history.append(make_message("user", user_message))
+        Raises:
+            Cancelled: If the token was cancelled before the response was
+            complete.
+        """
+        self._phase = phase
+        request = self._prepare_request(user_message, max_tokens)
+        cache_key = self._cache_key(request)
+        response, start = self._open_response()
+        cached = self._cached_response(cache_key, response)
+        prompt_tokens = self._start_call(cached is not None)
+        if cached is not None:
+            self._emit_token(cached)
+            self._finish_call(cached, prompt_tokens, cached=True)
+            yield cached
+            return
 
         # Create a new completion with the current history and permanent messages.
-        completion_stream = openai.ChatCompletion.create(  # type: ignore
-            model=self._openai_model,
-            max_tokens=self._max_tokens,
-            messages=self._messages + list(self._history),
-            stream=True,
-            **self._openai_kwargs,
-        )
-        for chunk in completion_stream:
-            response = chunk.choices[0]["delta"]  # type: ignore
-            if "content" not in response:
-                continue
-            message = response.content  # type: ignore
-            # If the assistant's response is a continuation of the previous message,
-            # append it to the previous message instead of creating a new one.
-            if self._history and self._history[-1]["role"] == "assistant":
-                self._history[-1]["content"] += message
-            else:
-                self._history.append(make_message("assistant", message))
-
-            yield message
-
-    def get_full_response(self, user_message: str = "") -> str:
+        stream = self._backend.stream(request, cancel)
+        chunks = 0
+        try:
+            try:
+                for message in stream:
+                    if cancel is not None and cancel.cancelled:
+                        raise Cancelled(self._name, chunks)
+                    chunks += 1
+                    self._record_message(response, message)
+                    self._emit_token(message)
+                    yield message
+            except Cancelled as err:
+                # The backend was cut off while waiting or reading.
+                if err.agent is not None:
+                    raise
+                raise Cancelled(self._name, chunks) from err
+        except BaseException as err:
+            # Also reports a caller that stops consuming the stream early.
+            self._fail_call(err, response.content[start:], prompt_tokens)
+            raise
+        finally:
+            # Closes the HTTP response of a cut-off call at once, so the server
+            # stops generating, and billing, the rest.
+            stream.close()
+        # The response is joined once, in the history message it was recorded in.
+        text = response.content[start:]
+        self._finish_call(text, prompt_tokens, cached=False)
+        self._store_response(cache_key, text)
+
+    def get_full_response(
+        self,
+        user_message: str = "",
+        cancel: CancellationToken | None = None,
+        max_tokens: int | None = None,
+        phase: int | None = None,
+    ) -> str:
         """
         Sends the accumulated messages (permanent and history) to the OpenAI API and
         returns the assistant's full response.
@@ -176,12 +713,146 @@ class Agent:
         Args:
             user_message (str, optional): The user's message to be sent to the API.
             Defaults to "".
+            cancel (CancellationToken | None, optional): Checked on every
+            streamed chunk, see generate_response.
+            max_tokens (int | None, optional): The max_tokens of the call.
+            Defaults to max_tokens_per_call.
+            phase (int | None, optional): The one-based phase the call belongs
+            to, stamped on its events.
+
+        Returns:
+            str: The assistant's full response from the OpenAI API.
+
+        Raises:
+            Cancelled: If the token was cancelled before the response was
+            complete.
+        """
+        for _ in self.generate_response(
+            user_message, cancel, max_tokens, phase
+        ):
+            pass
+        return self._response
+
+
+class AsyncAgent(_BaseAgent):
+    """
+    An asyncio-native agent that interacts with the OpenAI API.
+
+    It keeps the same message bookkeeping as Agent, but awaits the network instead
+    of blocking a thread, so many agents can stream on a single event loop.
+
+    Example:
+        >>> agent = AsyncAgent(
+                openai_model="gpt-4",
+                max_tokens_per_call=3000,
+                max_history=0,
+                top_p=0.2,
+            )
+        >>> await agent.get_full_response("Hi!")
+        "Hi! How are you?"
+    """
+
+    async def generate_response(
+        self,
+        user_message: str = "",
+        cancel: CancellationToken | None = None,
+        max_tokens: int | None = None,
+        phase: int | None = None,
+    ) -> typing.AsyncIterator[str]:
+        """
+        Sends the accumulated messages (permanent and history) to the OpenAI API and
+        yields the assistant's response in an asynchronous stream.
+
+        Args:
+            user_message (str, optional): The user's message to be sent to the API.
+            Defaults to "".
+            cancel (CancellationToken | None, optional): Checked on every
+            streamed chunk and passed to the backend; once it is cancelled,
+            the stream is closed.
+            max_tokens (int | None, optional): The max_tokens of the call.
+            Defaults to max_tokens_per_call.
+            phase (int | None, optional): The one-based phase the call belongs
+            to, stamped on its events.
+
+        Yields:
+            typing.AsyncIterator[str]: The assistant's response from the OpenAI API.
+
+        Raises:
+            Cancelled: If the token was cancelled before the response was
+            complete.
+        """
+        self._phase = phase
+        request = self._prepare_request(user_message, max_tokens)
+        cache_key = self._cache_key(request)
+        response, start = self._open_response()
+        cached = self._cached_response(cache_key, response)
+        prompt_tokens = self._start_call(cached is not None)
+        if cached is not None:
+            self._emit_token(cached)
+            self._finish_call(cached, prompt_tokens, cached=True)
+            yield cached
+            return
+
+        stream = self._backend.astream(request, cancel)
+        chunks = 0
+        try:
+            try:
+                async for message in stream:
+                    if cancel is not None and cancel.cancelled:
+                        raise Cancelled(self._name, chunks)
+                    chunks += 1
+                    self._record_message(response, message)
+                    self._emit_token(message)
+                    yield message
+            except Cancelled as err:
+                # The backend was cut off while waiting or reading.
+                if err.agent is not None:
+                    raise
+                raise Cancelled(self._name, chunks) from err
+        except BaseException as err:
+            # Also reports a caller that stops consuming the stream early.
+            self._fail_call(err, response.content[start:], prompt_tokens)
+            raise
+        finally:
+            await stream.aclose()
+        # The response is joined once, in the history message it was recorded in.
+        text = response.content[start:]
+        self._finish_call(text, prompt_tokens, cached=False)
+        self._store_response(cache_key, text)
+
+    async def get_full_response(
+        self,
+        user_message: str = "",
+        cancel: CancellationToken | None = None,
+        max_tokens: int | None = None,
+        phase: int | None = None,
+    ) -> str:
+        """
+        Sends the accumulated messages (permanent and history) to the OpenAI API and
+        returns the assistant's full response.
+
+        Args:
+            user_message (str, optional): The user's message to be sent to the API.
+            Defaults to "".
+            cancel (CancellationToken | None, optional): Checked on every
+            streamed chunk, see generate_response.
+            max_tokens (int | None, optional): The max_tokens of the call.
+            Defaults to max_tokens_per_call.
+            phase (int | None, optional): The one-based phase the call belongs
+            to, stamped on its events.
 
         Returns:
             str: The assistant's full response from the OpenAI API.
+
+        Raises:
+            Cancelled: If the token was cancelled before the response was
+            complete.
         """
-        messages = self.generate_response(user_message)
-        return "".join(messages)
+        async for _ in self.generate_response(
+            user_message, cancel, max_tokens, phase
+        ):
+            pass
+        return self._response
 
 
 class ColorAgent(Agent):
@@ -191,8 +862,11 @@ class ColorAgent(Agent):
     This agent behaves like the base Agent but provides color-coded console outputs to
     differentiate messages visually.
 
+    The agent reports its color in its agent_start events, so a console
+    subscriber (printer.ConsoleSubscriber) prints its responses in that color.
+
     Attributes:
-        color (ColorPrinter): An instance of the ColorPrinter class for colored output.
+        color (str): The name of the agent's console color.
 
     Example:
         >>> colored_agent = ColorAgent(
@@ -215,6 +889,10 @@ class ColorAgent(Agent):
         openai_model: str,
         max_tokens_per_call: int,
         max_history: int,
+        cache: CompletionCache | None = None,
+        max_context_tokens: int | None = None,
+        backend: Backend | None = None,
+        events: EventBus | None = None,
         **kwargs,
     ) -> None:
         """
@@ -226,35 +904,112 @@ class ColorAgent(Agent):
             openai_model (str): The OpenAI model to use.
             max_tokens_per_call (int, optional): Maximum tokens per API call.
             max_history (int, optional): Maximum messages in history.
+            cache (CompletionCache | None, optional): Optional completion cache.
+            max_context_tokens (int | None, optional): Token budget for the prompt
+            plus max_tokens_per_call.
+            backend (Backend | None, optional): The backend the completions are
+            streamed from.
+            events (EventBus | None, optional): The bus the agent's calls are
+            reported on. Defaults to a bus printing them to the console.
             **kwargs: Additional keyword arguments for the OpenAI API.
 
         Raises:
             ValueError: If the provided color is not supported.
         """
+        if color not in COLORS:
+            raise ValueError(f"Agent '{name}' has an invalid color: {color}")
         super().__init__(
             openai_model,
             max_tokens_per_call=max_tokens_per_call,
             max_history=max_history,
+            cache=cache,
+            max_context_tokens=max_context_tokens,
+            backend=backend,
+            name=name,
+            events=(
+                events
+                if events is not None
+                else EventBus(subscribers=[ConsoleSubscriber()])
+            ),
             **kwargs,
         )
-        self._name = name
-        if color not in COLORS:
-            raise ValueError(f"Agent '{name}' has an invalid color: {color}")
-        self._color_printer = ColorPrinter(color)
+        self.color = color
+
+    def _event_data(self) -> dict[str, typing.Any]:
+        return {**super()._event_data(), "color": self.color}
+
+
+class AsyncColorAgent(AsyncAgent):
+    """
+    An AsyncAgent subclass providing colored console output, like ColorAgent.
+
+    Attributes:
+        color (str): The name of the agent's console color.
 
-    def generate_response(self, user_message: str = "") -> typing.Iterator[str]:
+    Example:
+        >>> colored_agent = AsyncColorAgent(
+                name="Alice",
+                color="BLUE",
+                openai_model="gpt-4",
+                max_tokens_per_call=3000,
+                max_history=0,
+                temperature=0.2,
+            )
+        >>> await colored_agent.get_full_response("Tell me a joke.")
+    """
+
+    def __init__(
+        self,
+        name: str,
+        color: str,
+        openai_model: str,
+        max_tokens_per_call: int,
+        max_history: int,
+        cache: CompletionCache | None = None,
+        max_context_tokens: int | None = None,
+        backend: Backend | None = None,
+        events: EventBus | None = None,
+        **kwargs,
+    ) -> None:
         """
-        Sends messages to the OpenAI API, yields the response, and prints the response
-        in the specified color.
+        Initialize the AsyncColorAgent with a specified color.
 
         Args:
-            user_message (str, optional): The user's message to the API. Defaults to "".
+            name (str): Name of the agent for display purposes.
+            color (str): Console output color.
+            openai_model (str): The OpenAI model to use.
+            max_tokens_per_call (int, optional): Maximum tokens per API call.
+            max_history (int, optional): Maximum messages in history.
+            cache (CompletionCache | None, optional): Optional completion cache.
+            max_context_tokens (int | None, optional): Token budget for the prompt
+            plus max_tokens_per_call.
+            backend (Backend | None, optional): The backend the completions are
+            streamed from.
+            events (EventBus | None, optional): The bus the agent's calls are
+            reported on. Defaults to a bus printing them to the console.
+            **kwargs: Additional keyword arguments for the OpenAI API.
 
-        Yields:
-            str: Colored response from the OpenAI API.
+        Raises:
+            ValueError: If the provided color is not supported.
         """
-        self._color_printer(f"### {self._name} ###")
-        for message in super().generate_response(user_message):
-            self._color_printer(message, end="")
-            yield message
-        self._color_printer("\n\n")
+        if color not in COLORS:
+            raise ValueError(f"Agent '{name}' has an invalid color: {color}")
+        super().__init__(
+            openai_model,
+            max_tokens_per_call=max_tokens_per_call,
+            max_history=max_history,
+            cache=cache,
+            max_context_tokens=max_context_tokens,
+            backend=backend,
+            name=name,
+            events=(
+                events
+                if events is not None
+                else EventBus(subscribers=[ConsoleSubscriber()])
+            ),
+            **kwargs,
+        )
+        self.color = color
+
+    def _event_data(self) -> dict[str, typing.Any]:
+        return {**super()._event_data(), "color": self.color}
@@ -1,25 +1,16 @@
 from flask import Flask, render_template, request, Response, jsonify
 import json
-import sys
 import os
-import tempfile
-from datetime import datetime
-import io
-import re
-import threading
-import queue
-import time
 import traceback
-import signal
 
 # Import your existing modules
+from client import shared_client
 import config
-import readinput
-
-# Function to strip ANSI color codes
-def strip_ansi_codes(text):
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+import jobs
+import metrics
+from runs import RunManager
+from store import DEFAULT_RUN_STORE_PATH, RunStore
+from workers import DEFAULT_MAX_QUEUED, QueueFull
 
 # Set OpenAI API key from environment variable
 # Try to get it from .env file if available
@@ -30,54 +21,58 @@ except ImportError:
     # dotenv not installed, continue without it
     pass
 
-# Set the OpenAI API key for your application
-openai_api_key = os.environ.get('OPENAI_API_KEY')
-if openai_api_key:
-    # Set the API key for the OpenAI module
-    import openai
-    openai.api_key = openai_api_key
-    # For older versions of the OpenAI library
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=openai_api_key)
-    except ImportError:
-        pass
+# The client holds the OpenAI API key, read from OPENAI_API_KEY or set with
+# /set_api_key. Runs execute in worker processes and pass the key with every
+# run to the client of their backend options, see jobs.run_pipeline.
+llm_client = shared_client()
 
 app = Flask(__name__)
 
-# Global queue for output messages
-output_queue = queue.Queue()
-# Global variable to store the complete output
-complete_output = ""
-# Flag to indicate if processing is complete
-processing_complete = threading.Event()
-# Flag to indicate if processing should stop
-stop_processing = threading.Event()
-# Current processing thread
-current_thread = None
+# Runs may only use the configuration files shipped in this directory
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), '../config')
+
+# Runs, their transcripts and the outputs of their agents are persisted, so
+# they survive restarts and long transcripts need not be kept in memory
+run_store = RunStore(os.environ.get('RUN_STORE') or DEFAULT_RUN_STORE_PATH)
+
+# Runs are isolated from each other and executed in a pool of worker
+# processes; up to MAX_QUEUED_RUNS more wait for a free worker. The workers
+# inherit the environment, e.g. LLM_BACKEND and the COMPLETION_CACHE path.
+run_manager = RunManager(
+    max_workers=int(os.environ.get('MAX_CONCURRENT_RUNS', 4)),
+    max_queued=int(os.environ.get('MAX_QUEUED_RUNS', DEFAULT_MAX_QUEUED)),
+    store=run_store,
+)
+
+# Seconds a client should wait before submitting again when the queue is full
+RETRY_AFTER = 10
+
+def queue_full_response(error):
+    """Reject a submission while every worker is busy and the queue is full"""
+    response = jsonify({'error': f'The server is busy ({error}), please try again later'})
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response, 429
+
+def config_path_of(config_file):
+    """Return the path of a configuration file of CONFIG_DIR, or None if there is no such file"""
+    if config_file not in config.list_config_files(CONFIG_DIR):
+        return None
+    return os.path.join(CONFIG_DIR, config_file)
+
+def api_key_required():
+    """The OpenAI API key is only needed when running against the OpenAI backend"""
+    return os.environ.get('LLM_BACKEND', 'openai') in ('', 'openai')
 
 @app.route('/', methods=['GET'])
 def home():
     # Check if API key is set
-    if not openai_api_key:
+    if not llm_client.api_key and api_key_required():
         api_warning = "Warning: OpenAI API key not set. Please set the OPENAI_API_KEY environment variable."
     else:
         api_warning = None
 
     # Get available config files
-    config_files = []
-    config_dir = os.path.join(os.path.dirname(__file__), '../config')
-    if os.path.exists(config_dir):
-        config_files = [f for f in os.listdir(config_dir) if f.endswith('.json')]
-    
-    # Reset global variables
-    global complete_output, processing_complete, stop_processing, current_thread
-    complete_output = ""
-    processing_complete.clear()
-    stop_processing.clear()
-    current_thread = None
-    while not output_queue.empty():
-        output_queue.get()
+    config_files = config.list_config_files(CONFIG_DIR)
     
     return render_template('index.html', 
                           config_files=config_files,
@@ -85,15 +80,10 @@ def home():
 
 @app.route('/process', methods=['POST'])
 def process():
-    """Start the processing in a background thread and return immediately"""
+    """Queue the processing on the worker pool and return the run ID immediately"""
     try:
-        global current_thread, stop_processing
-        
-        # Clear the stop flag
-        stop_processing.clear()
-        
         # Check API key
-        if not openai_api_key:
+        if not llm_client.api_key and api_key_required():
             return jsonify({'error': "OpenAI API key not set. Please set the OPENAI_API_KEY environment variable."}), 400
 
         # Get form data
@@ -105,55 +95,81 @@ def process():
         user_story = normalize_text(user_story)
         mvp_text = normalize_text(mvp_text)
         
-        # Save user story and MVP to temporary files using UTF-8 encoding
-        with tempfile.NamedTemporaryFile(mode='w+', encoding='utf-8', delete=False, suffix='.txt') as user_story_file:
-            user_story_file.write(user_story)
-            user_story_path = user_story_file.name
-        
-        with tempfile.NamedTemporaryFile(mode='w+', encoding='utf-8', delete=False, suffix='.txt') as mvp_file:
-            mvp_file.write(mvp_text)
-            mvp_path = mvp_file.name
+        # Set up config path; the name must be one of the listed files, so it
+        # cannot point anywhere else
+        config_path = config_path_of(config_file)
+        if config_path is None:
+            return jsonify({'error': f'Unknown configuration file: {config_file}'}), 400
         
-        # Set up config path
-        config_path = os.path.join(os.path.dirname(__file__), '../config', config_file)
-        
-        # Start processing in a background thread
-        current_thread = threading.Thread(
-            target=run_pipeline_thread, 
-            args=(config_path, user_story_path, mvp_path),
-            daemon=True
-        )
-        current_thread.start()
+        # Queue the run on the worker pool; the texts are passed to the worker
+        try:
+            run = run_manager.submit(
+                config_path,
+                jobs.run_pipeline,
+                (config_path, user_story, mvp_text, llm_client.api_key),
+                subscribers=[metrics.MetricsSubscriber()],
+            )
+        except QueueFull as e:
+            return queue_full_response(e)
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'run_id': run.run_id})
     
     except Exception as e:
-        error_msg = f"Error: {str(e)}\n{traceback.format_exc()}"
-        custom_print(error_msg)
         return jsonify({'error': str(e), 'traceback': traceback.format_exc()}), 500
 
-@app.route('/stop', methods=['POST'])
-def stop():
-    """Stop the processing"""
-    global stop_processing, current_thread, processing_complete
-    
+# Seconds /stop waits for a run to confirm that it has stopped
+STOP_TIMEOUT = 10
+
+@app.route('/stop/<run_id>', methods=['POST'])
+def stop(run_id):
+    """Stop the processing of a run and wait until it has stopped
+
+    Running agent calls are cut off at their next streamed chunk, so the run
+    usually confirms at once; the response names the phase and agents it cut
+    off. A run that has not confirmed within STOP_TIMEOUT is reported with 202.
+    """
     try:
-        # Set the stop flag
-        stop_processing.set()
-        
-        # Wait a bit for the thread to notice the flag
-        time.sleep(0.5)
-        
-        # If thread is still running, try to force it to complete
-        if current_thread and current_thread.is_alive():
-            # Signal that processing is complete (even though it was stopped)
-            processing_complete.set()
-            custom_print("\n*** Processing stopped by user ***\n")
-        
-        return jsonify({'success': True})
+        run = run_manager.stop(run_id)
+        if run is None:
+            return jsonify({'error': 'Unknown run'}), 404
+        if not run.done_event.wait(STOP_TIMEOUT):
+            return jsonify({'success': True, 'status': 'stopping'}), 202
+        return jsonify({'success': True, **run.summary()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/resume/<run_id>', methods=['POST'])
+def resume(run_id):
+    """Continue a stopped, failed or interrupted run from its last completed agent step
+
+    The continuation is a new run; it does not repeat any completed call.
+    """
+    try:
+        summary = run_store.get_run(run_id)
+        if summary is None:
+            return jsonify({'error': 'Unknown run'}), 404
+        previous = run_manager.get(run_id)
+        if summary['status'] in ('queued', 'running') or (previous is not None and not previous.done_event.is_set()):
+            return jsonify({'error': 'The run is still active'}), 409
+        checkpoint = run_store.load_checkpoint(run_id)
+        if checkpoint is None:
+            return jsonify({'error': 'The run has no completed step to resume from'}), 409
+
+        config_path = summary['config_path']
+        if config_path_of(os.path.basename(config_path)) != config_path:
+            return jsonify({'error': f'Unknown configuration file: {config_path}'}), 400
+        run = run_manager.submit(
+            config_path,
+            jobs.resume_pipeline,
+            (config_path, run_id, checkpoint, llm_client.api_key),
+            subscribers=[metrics.MetricsSubscriber()],
+        )
+        return jsonify({'success': True, 'run_id': run.run_id, 'resumed_from': run_id})
+    except QueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e), 'traceback': traceback.format_exc()}), 500
+
 def normalize_text(text):
     """Normalize text to avoid encoding issues"""
     # Replace common problematic characters
@@ -176,24 +192,136 @@ def normalize_text(text):
     
     return text
 
-@app.route('/stream')
-def stream():
-    """Stream the output as it's generated"""
+# Seconds between keep-alive comments while a run produces no output
+STREAM_HEARTBEAT = 15
+
+@app.route('/stream/<run_id>')
+def stream(run_id):
+    """Stream the output of a run as it's generated
+
+    Every frame carries all output produced since the previous frame; its id is
+    the number of output events sent so far. A reconnecting EventSource sends it
+    back as Last-Event-ID and the stream resumes from there. The final frame
+    holds only a summary; the transcript is served by /transcript/<run_id>.
+    """
+    run = run_manager.get(run_id)
+    if run is None:
+        return jsonify({'error': 'Unknown run'}), 404
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '0')
+    try:
+        position = max(0, int(last_event_id))
+    except ValueError:
+        position = 0
+
     def event_stream():
+        nonlocal position
+        # Tell the browser to reconnect quickly if the connection drops
+        yield 'retry: 1000\n\n'
         while True:
-            # Check if there are messages in the queue
-            try:
-                message = output_queue.get(timeout=0.1)
-                yield f"data: {json.dumps({'message': message})}\n\n"
-            except queue.Empty:
-                # If processing is complete and queue is empty, send completion message
-                if processing_complete.is_set():
-                    yield f"data: {json.dumps({'complete': True, 'full_output': complete_output})}\n\n"
-                    break
-                # Otherwise just continue checking
-                pass
-            
-    return Response(event_stream(), mimetype="text/event-stream")
+            # Wake up as soon as there is new output or the run finishes
+            messages, done = run.wait_for_output(position, timeout=STREAM_HEARTBEAT)
+            if messages:
+                position += len(messages)
+                yield f"id: {position}\ndata: {json.dumps({'message': ''.join(messages)})}\n\n"
+            elif done:
+                yield f"id: {position}\ndata: {json.dumps({'complete': True, **run.summary()})}\n\n"
+                break
+            else:
+                yield ': keep-alive\n\n'
+
+    return Response(
+        event_stream(),
+        mimetype="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+# Maximum number of transcript entries per page
+TRANSCRIPT_PAGE_SIZE = 1000
+
+def page_args(default_limit, max_limit):
+    """Read the limit and offset query parameters of a paged endpoint"""
+    try:
+        limit = int(request.args.get('limit', default_limit))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        limit, offset = default_limit, 0
+    return min(max(1, limit), max_limit), max(0, offset)
+
+@app.route('/runs')
+def list_runs():
+    """List the stored runs, newest first"""
+    limit, offset = page_args(50, 500)
+    return jsonify({'runs': run_store.list_runs(limit, offset), 'limit': limit, 'offset': offset})
+
+@app.route('/runs/<run_id>')
+def run_details(run_id):
+    """Return the summary of a run and an overview of its agents' outputs"""
+    summary = run_store.get_run(run_id)
+    if summary is None:
+        return jsonify({'error': 'Unknown run'}), 404
+    run = run_manager.get(run_id)
+    if run is not None:
+        # The live run knows about output not yet written to the store
+        summary.update(run.summary())
+    artifacts = [
+        {key: value for key, value in artifact.items() if key != 'output'}
+        | {'output_chars': len(artifact['output'])}
+        for artifact in run_store.list_artifacts(run_id)
+    ]
+    return jsonify({**summary, 'artifacts': artifacts})
+
+@app.route('/runs/<run_id>/artifacts')
+def run_artifacts(run_id):
+    """Return the output of every agent in every phase of a run"""
+    if run_store.get_run(run_id) is None:
+        return jsonify({'error': 'Unknown run'}), 404
+    artifacts = run_store.list_artifacts(run_id)
+    if request.args.get('phase'):
+        artifacts = [artifact for artifact in artifacts if str(artifact['phase']) == request.args['phase']]
+    return jsonify({'run_id': run_id, 'artifacts': artifacts})
+
+@app.route('/runs/<run_id>/transcript')
+def transcript_page(run_id):
+    """Return a page of a run's transcript
+
+    Pages are counted in output events, like the ids of /stream, so a client can
+    page through a long transcript with next_offset.
+    """
+    limit, offset = page_args(TRANSCRIPT_PAGE_SIZE, TRANSCRIPT_PAGE_SIZE)
+    run = run_manager.get(run_id)
+    if run is not None:
+        entries = run.read_output(offset, limit)
+        complete = run.done_event.is_set()
+    elif run_store.get_run(run_id) is not None:
+        entries = run_store.read_transcript(run_id, offset, limit)
+        complete = True
+    else:
+        return jsonify({'error': 'Unknown run'}), 404
+    return jsonify({
+        'run_id': run_id,
+        'offset': offset,
+        'next_offset': offset + len(entries),
+        'text': ''.join(entries),
+        'complete': complete and len(entries) < limit,
+    })
+
+@app.route('/transcript/<run_id>')
+def transcript(run_id):
+    """Stream the output of a run so far as plain text, page by page"""
+    run = run_manager.get(run_id)
+    if run is not None:
+        pages = run.iter_output()
+    elif run_store.get_run(run_id) is not None:
+        pages = run_store.iter_transcript(run_id, TRANSCRIPT_PAGE_SIZE)
+    else:
+        return jsonify({'error': 'Unknown run'}), 404
+    return Response(pages, mimetype='text/plain; charset=utf-8')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose LLM call and pipeline metrics in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/set_api_key', methods=['POST'])
 def set_api_key():
@@ -207,153 +335,12 @@ def set_api_key():
         if not api_key.startswith('sk-'):
             return jsonify({'success': False, 'error': 'Invalid API key format'}), 400
         
-        # Set the API key in the global variable
-        global openai_api_key
-        openai_api_key = api_key
-        
-        # Set the API key for the OpenAI module
-        import openai
-        openai.api_key = api_key
-        # For newer versions of the OpenAI library
-        try:
-            from openai import OpenAI
-            global client
-            client = OpenAI(api_key=api_key)
-        except ImportError:
-            pass
+        # New runs pass the key on to the worker that executes them
+        llm_client.api_key = api_key
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def custom_print(text):
-    """Custom print function that puts output in the queue and adds to complete output"""
-    global complete_output
-    # Strip ANSI codes
-    clean_text = strip_ansi_codes(text)
-    # Add to queue for streaming
-    output_queue.put(clean_text)
-    # Add to complete output
-    complete_output += clean_text + "\n"
-
-def run_pipeline_thread(config_path, input_path, mvp_path):
-    """Run the pipeline in a thread and capture output for streaming"""
-    try:
-        # Redirect standard output to our custom print function
-        original_print = print
-        
-        def thread_print(*args, **kwargs):
-            # Convert args to string like the print function would
-            message = " ".join(str(arg) for arg in args)
-            if "end" in kwargs:
-                message += kwargs["end"]
-            else:
-                message += "\n"
-            # Use our custom print function
-            custom_print(message)
-        
-        # Replace the global print function with our thread_print
-        import builtins
-        builtins.print = thread_print
-        
-        try:
-            # Run the pipeline
-            run_pipeline(config_path, input_path, mvp_path)
-        except Exception as e:
-            print(f"Error in run_pipeline: {str(e)}")
-            print(traceback.format_exc())
-        finally:
-            # Restore the original print function
-            builtins.print = original_print
-            
-            # Clean up temp files
-            try:
-                os.unlink(input_path)
-                os.unlink(mvp_path)
-            except Exception as e:
-                print(f"Error cleaning up temp files: {str(e)}")
-            
-            # Signal that processing is complete
-            processing_complete.set()
-            
-    except Exception as e:
-        # If an error occurs, add it to the queue
-        error_message = f"Error in thread: {str(e)}"
-        custom_print(error_message)
-        custom_print(traceback.format_exc())
-        # Signal that processing is complete
-        processing_complete.set()
-
-def run_pipeline(config_path, input_path, mvp_path):
-    """Run the pipeline directly, similar to main() in main.py"""
-    # Load configuration file and create agents
-    config_file = config.read_json(config_path)
-    config.validate(config_file)
-    print("Successfully read configuration file")
-    
-    agents = config.create_coloragents(config_file)
-    agent_order = config_file["agent_order"]
-    iterations = config_file.get("iterations", 1)
-
-    # Fetch the initial user story
-    user_story = fetch_task(input_path, mvp_path)
-
-    # Iterate over each step for each agent
-    for iteration in range(iterations):
-        # Check if should stop
-        if stop_processing.is_set():
-            print("Processing stopped by user request.")
-            return
-
-        print(f"--- Phase {iteration + 1} ---")
-
-        for agent_name in agent_order:
-            # Check if should stop
-            if stop_processing.is_set():
-                print("Processing stopped by user request.")
-                return
-                
-            # Find the agent configuration in the list
-            agent_config = next((agent for agent in config_file["agents"] if agent["name"] == agent_name), None)
-            if not agent_config:   
-                continue
-
-            task_info = agent_config["tasks"].get(str(iteration + 1))
-
-            if task_info:
-                if iteration == 0:
-                    task = f"The user story is the following:\n{task_info}\n\nUser Story:\n{user_story}"
-                else:
-                    task = f"The user story is the following:\n{task_info}{user_story}"
-                print("-------------------------------")
-                print(f"Assigning task to {agent_name}: {task_info}")
-                
-                # Check if should stop
-                if stop_processing.is_set():
-                    print("Processing stopped by user request.")
-                    return
-                    
-                agent = agents[agent_name]
-                agent.append_message("user", task, False)
-                
-                # For streaming the response, we'll print each token as it comes
-                print(f"Response from {agent_name}:")
-                response = agent.get_full_response()
-                print(response)
-                
-                user_story = response
-
-def fetch_task(input_path: str, mvp_path: str) -> str:
-    """Load a task from a given file path and MVP file"""
-    print("Reading input file...")
-    task = config.read_file(input_path)
-    print("Successfully read input file")
-    
-    print("Reading MVP file...")
-    mvp = config.read_file(mvp_path)
-    print("Successfully read MVP file")
-    
-    return task + "\n\nMVP:\n" + mvp
-
 if __name__ == '__main__':
     app.run(debug=True, threaded=True)
\ No newline at end of file
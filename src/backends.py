@@ -0,0 +1,243 @@
+"""
+This module contains the LLM backends the agents stream their completions from.
+
+Classes:
+    Backend: Interface of a streaming chat completion backend.
+    OpenAIBackend: Streams completions from the OpenAI API.
+    MockBackend: Streams deterministic, templated completions with simulated
+    latency, for offline runs, CI and load tests.
+
+Functions:
+    create_backend: Creates a backend from a configuration section.
+
+Errors:
+    BackendError: A failed completion, telling whether a retry may succeed.
+    It is defined in the client module and raised by all backends.
+
+Configuration:
+    The OpenAI API key is expected to be set via environment variables.
+"""
+
+import abc
+import hashlib
+import json
+import re
+import typing
+
+import cancellation
+from cancellation import CancellationToken
+from client import BackendError, OpenAIClient, shared_client
+
+BACKEND_TYPES = ("openai", "mock")
+
+
+class Backend(abc.ABC):
+    """
+    Interface of a streaming chat completion backend.
+
+    A request is the keyword arguments of a chat completion call: "model",
+    "max_tokens", "messages" and sampling parameters such as "temperature".
+    Closing a stream before its end aborts the request, and so does cancelling
+    the token of the stream, also while the stream waits or blocks on a read.
+    """
+
+    @abc.abstractmethod
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        """
+        Stream the content of a chat completion.
+
+        Args:
+            request (dict[str, typing.Any]): The chat completion arguments.
+            cancel (CancellationToken | None, optional): Aborts the request once
+            it is cancelled.
+
+        Yields:
+            str: The pieces of the assistant's response.
+
+        Raises:
+            Cancelled: If the token was cancelled before the response was
+            complete.
+        """
+
+    @abc.abstractmethod
+    def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        """
+        Asynchronous counterpart of stream.
+
+        Args:
+            request (dict[str, typing.Any]): The chat completion arguments.
+            cancel (CancellationToken | None, optional): Aborts the request once
+            it is cancelled.
+
+        Yields:
+            str: The pieces of the assistant's response.
+        """
+
+
+class OpenAIBackend(Backend):
+    """
+    Streams completions from the OpenAI API, or from any server implementing
+    the OpenAI chat completions API, such as mock_server.
+
+    Backends created with the same options share a client and its pool of
+    keep-alive connections, see client.shared_client.
+
+    Example:
+        >>> backend = OpenAIBackend(api_base="http://127.0.0.1:8001/v1")
+        >>> "".join(backend.stream({"model": "gpt-4", "messages": [...]}))
+    """
+
+    def __init__(self, client: OpenAIClient | None = None, **options: typing.Any):
+        """
+        Initialize the backend.
+
+        Args:
+            client (OpenAIClient | None, optional): The client to send the requests
+            with. Defaults to the shared client of the options.
+            **options: The keyword arguments of OpenAIClient, e.g. "api_base",
+            "api_key", "pool_size", "connect_timeout" and "read_timeout".
+        """
+        self._client = client if client is not None else shared_client(**options)
+
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        return self._client.stream_chat(request, cancel)
+
+    def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        return self._client.astream_chat(request, cancel)
+
+
+class MockBackend(Backend):
+    """
+    Streams deterministic, templated completions with simulated latency.
+
+    The response is rendered from a template and streamed one word (token) at a
+    time, after a time-to-first-token delay and at a fixed rate. The same request
+    always yields the same response, and the response never exceeds the request's
+    max_tokens words.
+
+    Template placeholders:
+        {model}: The requested model.
+        {request_id}: A short hash of the request.
+        {last_message}: The content of the last message.
+        {filler}: response_tokens filler words.
+
+    Example:
+        >>> backend = MockBackend(ttft=0.2, tokens_per_second=50)
+        >>> "".join(backend.stream({"model": "gpt-4", "messages": [...]}))
+        "Mock response 1a2b3c4d from gpt-4. lorem ipsum ..."
+    """
+
+    DEFAULT_TEMPLATE = "Mock response {request_id} from {model}.\n\n{filler}"
+    FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do".split()
+
+    def __init__(
+        self,
+        template: str = DEFAULT_TEMPLATE,
+        response_tokens: int = 200,
+        ttft: float = 0.0,
+        tokens_per_second: float = 0.0,
+    ) -> None:
+        """
+        Initialize the mock backend.
+
+        Args:
+            template (str, optional): Template of the response.
+            response_tokens (int, optional): Number of filler words.
+            ttft (float, optional): Seconds before the first token. Defaults to 0.
+            tokens_per_second (float, optional): Streaming rate after the first
+            token; 0 streams without delay. Defaults to 0.
+
+        Raises:
+            ValueError: If a delay or rate is negative.
+        """
+        if ttft < 0 or tokens_per_second < 0 or response_tokens < 0:
+            raise ValueError("Mock backend delays and sizes must not be negative")
+        self._template = template
+        self._response_tokens = response_tokens
+        self._ttft = ttft
+        self._token_interval = 1 / tokens_per_second if tokens_per_second else 0.0
+
+    def render(self, request: dict[str, typing.Any]) -> list[str]:
+        """
+        Render the response of a request, split into tokens.
+
+        Args:
+            request (dict[str, typing.Any]): The chat completion arguments.
+
+        Returns:
+            list[str]: The response tokens; joined they form the full response.
+        """
+        messages = request.get("messages", [])
+        encoded = json.dumps(
+            {key: value for key, value in request.items() if key != "stream"},
+            sort_keys=True,
+        )
+        filler = (self.FILLER * (self._response_tokens // len(self.FILLER) + 1))[
+            : self._response_tokens
+        ]
+        text = self._template.format(
+            model=request.get("model", ""),
+            request_id=hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:8],
+            last_message=messages[-1]["content"] if messages else "",
+            filler=" ".join(filler),
+        )
+        pieces = re.findall(r"\S+\s*|\s+", text)
+        max_tokens = request.get("max_tokens")
+        return pieces[:max_tokens] if max_tokens else pieces
+
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        pieces = self.render(request)
+        cancellation.sleep(self._ttft, cancel)
+        for index, piece in enumerate(pieces):
+            if index and self._token_interval:
+                cancellation.sleep(self._token_interval, cancel)
+            yield piece
+
+    async def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        pieces = self.render(request)
+        await cancellation.sleep_async(self._ttft, cancel)
+        for index, piece in enumerate(pieces):
+            if index and self._token_interval:
+                await cancellation.sleep_async(self._token_interval, cancel)
+            yield piece
+
+
+def create_backend(spec: dict[str, typing.Any] | None = None) -> Backend:
+    """
+    Create a backend from a configuration section.
+
+    The section has a "type" ("openai" or "mock", default "openai"); all other
+    keys are passed to the backend, e.g. "api_base" for OpenAIBackend or "ttft"
+    and "tokens_per_second" for MockBackend.
+
+    Args:
+        spec (dict[str, typing.Any] | None, optional): The "backend" section of
+        the configuration.
+
+    Returns:
+        Backend: The backend.
+
+    Raises:
+        ValueError: If the backend type is unknown.
+    """
+    options = dict(spec or {})
+    backend_type = options.pop("type", "openai")
+    if backend_type == "openai":
+        return OpenAIBackend(**options)
+    if backend_type == "mock":
+        return MockBackend(**options)
+    raise ValueError(
+        f"Unknown backend type '{backend_type}', expected one of {BACKEND_TYPES}"
+    )
@@ -0,0 +1,168 @@
+"""
+This module runs the configured pipeline over a JSONL corpus of user stories.
+
+Every story gets fresh agents and runs concurrently with the others on a single
+event loop, bounded by a concurrency limit. Long stories are condensed first,
+see ingest.Ingestor. A result record is appended to the
+output file as soon as its story finishes.
+
+Functions:
+    read_stories: Reads the user stories from a JSONL file.
+    run_batch: Processes all stories and writes one result per story.
+"""
+
+import asyncio
+import json
+import time
+import typing
+
+from cache import CompletionCache
+import config
+from events import EventBus, Subscriber
+from ingest import Ingestor
+import pipeline
+
+STORY_FIELDS = ("user_story", "story", "body")
+ID_FIELDS = ("id", "request_id", "story_id")
+
+
+def read_stories(file_path: str) -> typing.Iterator[dict[str, str]]:
+    """
+    Read the user stories from a JSONL file.
+
+    Each line is a JSON object. The story text is taken from the first of
+    "user_story", "story" or "body"; an optional "title" is put in front of it.
+    The identifier is taken from "id", "request_id" or "story_id", falling back
+    to the line number.
+
+    Args:
+        file_path (str): The path to the JSONL file.
+
+    Yields:
+        dict[str, str]: Records with the keys "id" and "user_story".
+
+    Raises:
+        ValueError: If a line has no story text.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            story = next((record[key] for key in STORY_FIELDS if key in record), None)
+            if story is None:
+                raise ValueError(f"Line {line_number} of '{file_path}' has no story")
+            if record.get("title"):
+                story = f"{record['title']}\n\n{story}"
+            story_id = next(
+                (str(record[key]) for key in ID_FIELDS if key in record),
+                str(line_number),
+            )
+            yield {"id": story_id, "user_story": story}
+
+
+async def _process_story(
+    plan: config.PipelinePlan,
+    story: dict[str, str],
+    mvp: str,
+    semaphore: asyncio.Semaphore,
+    cache: CompletionCache | None,
+    subscribers: typing.Sequence[Subscriber],
+    ingestor: Ingestor | None,
+) -> dict[str, typing.Any]:
+    """
+    Run the pipeline for a single story with its own agents, after condensing
+    the story if it is too long. Its events carry the story identifier as run
+    identifier.
+
+    Returns:
+        dict[str, typing.Any]: The result record of the story.
+    """
+    async with semaphore:
+        print(f"[{story['id']}] started")
+        start = time.perf_counter()
+        events = EventBus(run_id=story["id"], subscribers=subscribers)
+        agents = config.create_async_agents(plan.config, cache, events=events)
+        try:
+            user_story = story["user_story"]
+            if ingestor is not None:
+                # The ingestor blocks while it condenses.
+                user_story = await asyncio.to_thread(
+                    ingestor.condense, user_story, "user story"
+                )
+            if mvp:
+                user_story += "\n\nMVP:\n" + mvp
+            result = await pipeline.run_phases_async(
+                plan, agents, user_story, events=events
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"[{story['id']}] failed: {err}")
+            return {
+                "id": story["id"],
+                "status": "error",
+                "error": f"{type(err).__name__}: {err}",
+                "elapsed": round(time.perf_counter() - start, 3),
+            }
+        print(f"[{story['id']}] complete")
+        return {
+            "id": story["id"],
+            "status": "complete",
+            "user_story": result,
+            "elapsed": round(time.perf_counter() - start, 3),
+        }
+
+
+async def run_batch(
+    config_file: dict[str, typing.Any] | config.PipelinePlan,
+    stories_path: str,
+    output_path: str,
+    concurrency: int,
+    mvp: str = "",
+    cache: CompletionCache | None = None,
+    subscribers: typing.Sequence[Subscriber] = (),
+    ingestor: Ingestor | None = None,
+) -> int:
+    """
+    Process every story of a JSONL file and write one result line per story.
+
+    Results are written in completion order, as each story finishes.
+
+    Args:
+        config_file (dict[str, typing.Any] | config.PipelinePlan): The validated
+        configuration or its compiled plan.
+        stories_path (str): The JSONL file with the user stories.
+        output_path (str): The JSONL file the results are written to.
+        concurrency (int): Maximum number of stories processed at the same time.
+        mvp (str, optional): MVP description appended to every story.
+        cache (CompletionCache | None, optional): Completion cache shared by all
+        stories.
+        subscribers (typing.Sequence[Subscriber], optional): Receive the events
+        of all stories, e.g. an events.FileSubscriber.
+        ingestor (Ingestor | None, optional): Condenses long stories; the MVP
+        description is passed condensed already.
+
+    Returns:
+        int: The number of stories that failed.
+
+    Raises:
+        ValueError: If concurrency is lower than 1.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    plan = config.as_plan(config_file)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.create_task(
+            _process_story(plan, story, mvp, semaphore, cache, subscribers, ingestor)
+        )
+        for story in read_stories(stories_path)
+    ]
+    failures = 0
+    with open(output_path, "w", encoding="utf-8") as output:
+        for finished in asyncio.as_completed(tasks):
+            record = await finished
+            failures += record["status"] != "complete"
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+    print(f"Processed {len(tasks)} stories ({failures} failed) into '{output_path}'")
+    return failures
@@ -0,0 +1,358 @@
+"""
+This module contains the token and cost budget of a run.
+
+The "budget" section of the configuration caps the tokens, prompt plus
+completion, and the cost of a run; the "budget" of an agent caps those of its
+calls. The phase loop settles every call with the usage of its agent,
+including the streamed part of calls that failed or were cut off, and the
+budget gives every call the max_tokens it can afford:
+
+- at most max_tokens_per_call,
+- at most twice the longest response the agent has given to the same task in
+  the run, so a repeated call does not reserve 3000 tokens for a 400-token
+  answer; a task the agent has not answered yet gets what the budget allows,
+- no more than the run and the agent budgets leave after the prompt and the
+  calls already running.
+
+The phase loop logs every call whose max_tokens is lowered, and why.
+
+A call that cannot get min_call_tokens is not made, and the phase loop skips to
+the final phase once the largest phase so far would not fit twice into what is
+left of the run budget, see pipeline.run_phases.
+
+Costs are computed from prices in USD per 1000 tokens: the "prices" of the
+"budget" section, or those of the model in MODEL_PRICES.
+
+Classes:
+    BudgetExhausted: Raised when a budget cannot pay for another call.
+    Budget: The budget of a run and its agents.
+
+Functions:
+    model_prices: Returns the prices of a known model.
+"""
+
+import dataclasses
+import math
+import threading
+import typing
+
+# Prices in USD per 1000 prompt and completion tokens of the models used by the
+# shipped configurations. Longer prefixes take precedence, as in tokens.py.
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+}
+
+DEFAULT_MIN_CALL_TOKENS = 256
+
+# Factor on the longest response to a task that bounds the max_tokens of its
+# next call.
+OUTPUT_HEADROOM = 2
+
+
+def model_prices(model: str) -> tuple[float, float] | None:
+    """
+    Return the prices of a known model.
+
+    Args:
+        model (str): The OpenAI model name.
+
+    Returns:
+        tuple[float, float] | None: USD per 1000 prompt and completion tokens,
+        or None if unknown.
+    """
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not matches:
+        return None
+    return MODEL_PRICES[max(matches, key=len)]
+
+
+class BudgetExhausted(Exception):
+    """
+    Raised when a budget cannot pay for another call.
+    """
+
+
+@dataclasses.dataclass
+class _Account:
+    """
+    The limits, spending and running reservations of the run or an agent.
+    """
+
+    name: str
+    max_tokens: int | None = None
+    max_cost: float | None = None
+    tokens: int = 0
+    cost: float = 0.0
+    reserved_tokens: int = 0
+    reserved_cost: float = 0.0
+
+    def left(self, prompt_tokens: int, prices: tuple[float, float]) -> float:
+        """
+        Return the completion tokens left after a prompt and the reservations.
+        """
+        left = math.inf
+        if self.max_tokens is not None:
+            left = self.max_tokens - self.tokens - self.reserved_tokens - prompt_tokens
+        if self.max_cost is not None and prices[1] > 0:
+            cost = self.max_cost - self.cost - self.reserved_cost
+            left = min(left, (cost * 1000 - prompt_tokens * prices[0]) / prices[1])
+        return left
+
+
+class Budget:
+    """
+    The token and cost budget of a run and its agents.
+
+    A call reserves its prompt and max_tokens until it is settled, so agents of
+    a phase can call concurrently without overdrawing the budget. Settling
+    charges what the agent's usage grew by and teaches the budget the length of
+    the agent's responses to the task.
+
+    Example:
+        >>> budget = Budget.from_config(plan.config)
+        >>> max_tokens, limit = budget.reserve(
+        ...     agent.name, agent.prompt_tokens(prompt), task.task_info
+        ... )
+        >>> agent.get_full_response(max_tokens=max_tokens)
+        >>> budget.settle(agent.name, agent.usage)
+    """
+
+    def __init__(
+        self,
+        max_tokens_per_call: int,
+        prices: tuple[float, float] = (0.0, 0.0),
+        max_tokens: int | None = None,
+        max_cost: float | None = None,
+        agents: typing.Mapping[str, typing.Mapping[str, typing.Any]] | None = None,
+        min_call_tokens: int = DEFAULT_MIN_CALL_TOKENS,
+    ) -> None:
+        """
+        Initialize the budget.
+
+        Args:
+            max_tokens_per_call (int): The max_tokens of a call without a budget.
+            prices (tuple[float, float], optional): USD per 1000 prompt and
+            completion tokens.
+            max_tokens (int | None, optional): Tokens the run may spend.
+            max_cost (float | None, optional): USD the run may spend.
+            agents (typing.Mapping[str, typing.Mapping[str, typing.Any]] | None,
+            optional): The "max_tokens" and "max_cost" of agents, keyed by name.
+            min_call_tokens (int, optional): The smallest max_tokens worth a call.
+        """
+        self._max_tokens_per_call = max_tokens_per_call
+        self._prices = prices
+        self._min_call_tokens = min_call_tokens
+        self._run = _Account("run budget", max_tokens, max_cost)
+        self._agents = {
+            name: _Account(
+                f"budget of {name}", limits.get("max_tokens"), limits.get("max_cost")
+            )
+            for name, limits in (agents or {}).items()
+        }
+        # The prompt tokens, max_tokens and task of the running call of each agent
+        self._reservations: dict[str, tuple[int, int, str]] = {}
+        # The usage of each agent when it was last settled
+        self._usage: dict[str, dict[str, int]] = {}
+        # The longest response of each agent to each task
+        self._longest: dict[tuple[str, str], int] = {}
+        self._phase_start = (0, 0.0)
+        self._largest_phase = (0, 0.0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(
+        cls,
+        config_file: typing.Mapping[str, typing.Any],
+        usage: typing.Mapping[str, typing.Mapping[str, int]] | None = None,
+    ) -> "Budget | None":
+        """
+        Create the budget of a configuration.
+
+        Args:
+            config_file (typing.Mapping[str, typing.Any]): The validated
+            configuration.
+            usage (typing.Mapping[str, typing.Mapping[str, int]] | None,
+            optional): The usage already spent by each agent, e.g. restored from
+            a checkpoint; see agent.Agent.usage.
+
+        Returns:
+            Budget | None: The budget, or None if neither the run nor an agent
+            has one.
+        """
+        section = config_file.get("budget", {})
+        agents = {
+            agent_config["name"]: agent_config["budget"]
+            for agent_config in config_file["agents"]
+            if "budget" in agent_config
+        }
+        if not section and not agents:
+            return None
+        prices = section.get("prices")
+        budget = cls(
+            config_file["max_tokens_per_call"],
+            prices=(
+                (prices["prompt"], prices["completion"])
+                if prices
+                else model_prices(config_file["openai_model"]) or (0.0, 0.0)
+            ),
+            max_tokens=section.get("max_tokens"),
+            max_cost=section.get("max_cost"),
+            agents=agents,
+            min_call_tokens=section.get("min_call_tokens", DEFAULT_MIN_CALL_TOKENS),
+        )
+        for name, spent in (usage or {}).items():
+            budget.settle(name, spent)
+        return budget
+
+    def reserve(
+        self, agent: str, prompt_tokens: int, task: str = ""
+    ) -> tuple[int, str | None]:
+        """
+        Reserve a call of an agent and choose its max_tokens.
+
+        Args:
+            agent (str): The name of the agent.
+            prompt_tokens (int): The prompt tokens of the call.
+            task (str, optional): The task of the call, e.g. its description.
+
+        Returns:
+            tuple[int, str | None]: The max_tokens of the call and, if it is
+            lower than max_tokens_per_call, what limited it.
+
+        Raises:
+            BudgetExhausted: If the run or the agent budget leaves fewer than
+            min_call_tokens for the response.
+        """
+        with self._lock:
+            max_tokens = self._max_tokens_per_call
+            limit = None
+            longest = self._longest.get((agent, task))
+            if longest is not None:
+                cap = max(self._min_call_tokens, longest * OUTPUT_HEADROOM)
+                if cap < max_tokens:
+                    max_tokens = cap
+                    limit = f"its longest response to the task was {longest} tokens"
+            for account in self._accounts(agent):
+                left = account.left(prompt_tokens, self._prices)
+                if left < self._min_call_tokens:
+                    raise BudgetExhausted(f"The {account.name} is used up")
+                if left < max_tokens:
+                    max_tokens = int(left)
+                    limit = f"the {account.name} leaves no more"
+            self._reservations[agent] = (prompt_tokens, max_tokens, task)
+            self._book(agent, prompt_tokens, max_tokens, 1)
+            return max_tokens, limit
+
+    def settle(self, agent: str, usage: typing.Mapping[str, int]) -> None:
+        """
+        Release the reservation of an agent's ended call and charge the tokens
+        its usage grew by since it was last settled.
+
+        Args:
+            agent (str): The name of the agent.
+            usage (typing.Mapping[str, int]): The usage of the agent, see
+            agent.Agent.usage.
+        """
+        with self._lock:
+            reservation = self._reservations.pop(agent, None)
+            if reservation is not None:
+                self._book(agent, *reservation[:2], -1)
+            last = self._usage.get(agent, {})
+            prompt_tokens = usage["prompt_tokens"] - last.get("prompt_tokens", 0)
+            completion_tokens = usage["completion_tokens"] - last.get(
+                "completion_tokens", 0
+            )
+            self._usage[agent] = dict(usage)
+            if reservation is not None:
+                key = (agent, reservation[2])
+                self._longest[key] = max(self._longest.get(key, 0), completion_tokens)
+            cost = self._cost(prompt_tokens, completion_tokens)
+            for account in self._accounts(agent):
+                account.tokens += prompt_tokens + completion_tokens
+                account.cost += cost
+
+    def start_phase(self) -> None:
+        """
+        Note the start of a phase, to learn its size when it ends.
+        """
+        with self._lock:
+            self._phase_start = (self._run.tokens, self._run.cost)
+
+    def end_phase(self) -> None:
+        """
+        Note the end of a phase started with start_phase.
+        """
+        with self._lock:
+            tokens, cost = self._phase_start
+            self._largest_phase = (
+                max(self._largest_phase[0], self._run.tokens - tokens),
+                max(self._largest_phase[1], self._run.cost - cost),
+            )
+
+    def affords(self, phases: int) -> bool:
+        """
+        Check whether the run budget is likely to cover further phases, judging
+        by the largest phase so far.
+
+        Args:
+            phases (int): The number of phases.
+
+        Returns:
+            bool: False if the phases would exceed the run budget.
+        """
+        with self._lock:
+            tokens, cost = self._largest_phase
+            run = self._run
+            return not (
+                run.max_tokens is not None
+                and run.tokens + phases * tokens > run.max_tokens
+                or run.max_cost is not None
+                and run.cost + phases * cost > run.max_cost
+            )
+
+    def summary(self) -> str:
+        """
+        Describe the spending of the run.
+
+        Returns:
+            str: E.g. "Budget used: 12000 of 20000 tokens, $0.52 of $1.00".
+        """
+        with self._lock:
+            run = self._run
+            tokens = f"{run.tokens}" + (
+                f" of {run.max_tokens}" if run.max_tokens is not None else ""
+            )
+            cost = f"${run.cost:.2f}" + (
+                f" of ${run.max_cost:.2f}" if run.max_cost is not None else ""
+            )
+        return f"Budget used: {tokens} tokens, {cost}"
+
+    def _accounts(self, agent: str) -> list[_Account]:
+        """
+        Return the accounts a call of the agent is charged to.
+        """
+        if agent in self._agents:
+            return [self._run, self._agents[agent]]
+        return [self._run]
+
+    def _book(self, agent: str, prompt_tokens: int, max_tokens: int, sign: int) -> None:
+        """
+        Add or remove a reservation. Must be called with the lock held.
+        """
+        cost = self._cost(prompt_tokens, max_tokens)
+        for account in self._accounts(agent):
+            account.reserved_tokens += sign * (prompt_tokens + max_tokens)
+            account.reserved_cost += sign * cost
+
+    def _cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """
+        Compute the cost of a call in USD.
+        """
+        return (
+            prompt_tokens * self._prices[0] + completion_tokens * self._prices[1]
+        ) / 1000
@@ -0,0 +1,155 @@
+"""
+This module provides a persistent, opt-in cache for chat completions.
+
+Completions are stored in SQLite, keyed on a hash of the model, the sampling
+parameters and the full message list, so re-running a configuration on the
+same story does not pay for identical calls again. The least recently used
+entries are evicted once the cache exceeds its entry or size limit.
+
+Classes:
+    CompletionCache: SQLite-backed completion cache with LRU eviction.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "completions.sqlite")
+
+
+class CompletionCache:
+    """
+    SQLite-backed completion cache with LRU eviction.
+
+    The cache can be shared by all agents of a process; access is serialized
+    with a lock.
+
+    Example:
+        >>> cache = CompletionCache("completions.sqlite", max_entries=1000)
+        >>> key = CompletionCache.make_key({"model": "gpt-4", "messages": []})
+        >>> cache.put(key, "Hello!")
+        >>> cache.get(key)
+        "Hello!"
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = 10_000,
+        max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        """
+        Open or create the cache database.
+
+        Args:
+            path (str, optional): Path to the SQLite file.
+            max_entries (int, optional): Maximum number of cached completions.
+            max_bytes (int, optional): Maximum total size of cached completions.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_access"
+            " ON completions (last_access)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(request: dict[str, typing.Any]) -> str:
+        """
+        Hash the parts of a chat completion request that determine its output.
+
+        Args:
+            request (dict[str, typing.Any]): The keyword arguments of the chat
+            completion call: model, max_tokens, sampling parameters and messages.
+
+        Returns:
+            str: The hex digest identifying the request.
+        """
+        relevant = {key: value for key, value in request.items() if key != "stream"}
+        encoded = json.dumps(relevant, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Look up a completion and mark it as recently used.
+
+        Args:
+            key (str): The key returned by make_key.
+
+        Returns:
+            str | None: The cached response, or None on a cache miss.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE completions SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self._connection.commit()
+            response: str = row[0]
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Store a completion and evict the least recently used entries if needed.
+
+        Args:
+            key (str): The key returned by make_key.
+            response (str): The full response text.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, response, size, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), time.time()),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        """
+        Delete the least recently used entries until the limits are met.
+        """
+        count, total = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()
+        if count <= self._max_entries and total <= self._max_bytes:
+            return
+        rows = self._connection.execute(
+            "SELECT key, size FROM completions ORDER BY last_access"
+        )
+        expired = []
+        for key, size in rows:
+            if count <= self._max_entries and total <= self._max_bytes:
+                break
+            expired.append((key,))
+            count -= 1
+            total -= size
+        self._connection.executemany("DELETE FROM completions WHERE key = ?", expired)
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._connection.close()
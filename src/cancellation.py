@@ -0,0 +1,245 @@
+"""
+This module contains the cancellation of running agent calls.
+
+A cancellation token is shared by a run and its agents. The agents check it on
+every streamed chunk and, once it is cancelled, close the stream, and with it
+the HTTP response, instead of reading the rest of a response nobody waits for.
+Backends wait on the token instead of sleeping, e.g. before a retry, and close
+their in-flight response from the cancelling thread, so a call blocked on a
+read ends at once.
+
+Classes:
+    Cancelled: Raised in an agent call that was cancelled.
+    CancellationToken: A flag that cancels the agent calls it is passed to.
+
+Functions:
+    sleep: Sleeps until a delay has passed or a token is cancelled.
+    sleep_async: Asynchronous counterpart of sleep.
+"""
+
+import asyncio
+import contextlib
+import functools
+import threading
+import time
+import typing
+
+# Seconds between two checks of the check function of a token while a wait or
+# a callback depends on it.
+POLL_INTERVAL = 0.1
+
+
+class Cancelled(Exception):
+    """
+    Raised in an agent call that was cancelled.
+
+    Backends raise it without an agent; the agent whose call they were making
+    raises it again with its name.
+
+    Attributes:
+        agent (str | None): The name of the agent whose call was cut off.
+        chunks (int): Number of chunks streamed before the call was cut off.
+    """
+
+    def __init__(self, agent: str | None = None, chunks: int = 0) -> None:
+        super().__init__(
+            f"{agent} was cut off after {chunks} streamed chunks"
+            if agent is not None
+            else "The call was cancelled"
+        )
+        self.agent = agent
+        self.chunks = chunks
+
+
+class CancellationToken:
+    """
+    A flag that cancels the agent calls it is passed to.
+
+    The token is cancelled by calling cancel, or by a check function returning
+    True, such as the stop flag of a run. Checking it is cheap enough to do on
+    every streamed chunk. The check function is also polled every POLL_INTERVAL
+    seconds while a thread waits on the token or a callback is registered, so
+    a stop flag set in another process wakes them too.
+
+    Example:
+        >>> token = CancellationToken(run.should_stop)
+        >>> agent.get_full_response(cancel=token)
+    """
+
+    def __init__(self, check: typing.Callable[[], bool] | None = None) -> None:
+        """
+        Args:
+            check (typing.Callable[[], bool] | None, optional): Also cancels the
+            token when it returns True.
+        """
+        self._check = check
+        self._event = threading.Event()
+        self._callbacks: list[typing.Callable[[], object]] = []
+        self._watching = False
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        """
+        Cancel the token and run its callbacks, see on_cancel.
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            # A callback closing a response that has just ended may fail; the
+            # others must still run.
+            with contextlib.suppress(Exception):
+                callback()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Whether the token is cancelled.
+        """
+        if self._event.is_set():
+            return True
+        if self._check is not None and self._check():
+            self.cancel()
+            return True
+        return False
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until the token is cancelled or the timeout has passed.
+
+        Args:
+            timeout (float): Seconds to wait at most.
+
+        Returns:
+            bool: True if the token is cancelled.
+        """
+        if self._check is None:
+            return self._event.wait(timeout)
+        deadline = time.monotonic() + timeout
+        while not self.cancelled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._event.wait(min(remaining, POLL_INTERVAL))
+        return True
+
+    async def wait_async(self, timeout: float) -> bool:
+        """
+        Asynchronous counterpart of wait; races the timeout with the token.
+
+        Args:
+            timeout (float): Seconds to wait at most.
+
+        Returns:
+            bool: True if the token is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        cancelled = loop.create_future()
+
+        def wake() -> None:
+            if not cancelled.done():
+                cancelled.set_result(None)
+
+        def wake_threadsafe() -> None:
+            with contextlib.suppress(RuntimeError):  # The loop has been closed
+                loop.call_soon_threadsafe(wake)
+
+        remove = self.on_cancel(wake_threadsafe)
+        try:
+            await asyncio.wait([cancelled], timeout=timeout)
+        finally:
+            remove()
+            cancelled.cancel()
+        return self.cancelled
+
+    def on_cancel(
+        self, callback: typing.Callable[[], object]
+    ) -> typing.Callable[[], None]:
+        """
+        Register a callback run on the cancelling thread once the token is
+        cancelled, e.g. to close a response another thread is reading. It runs
+        at once if the token is already cancelled.
+
+        Args:
+            callback (typing.Callable[[], object]): The callback; it must be
+            safe to call from any thread.
+
+        Returns:
+            typing.Callable[[], None]: Removes the callback again.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                if self._check is not None and not self._watching:
+                    self._watching = True
+                    threading.Thread(
+                        target=self._watch, name="cancellation", daemon=True
+                    ).start()
+                return functools.partial(self._remove, callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: typing.Callable[[], object]) -> None:
+        """
+        Remove a callback registered with on_cancel, if it has not run.
+        """
+        with self._lock:
+            with contextlib.suppress(ValueError):
+                self._callbacks.remove(callback)
+
+    def _watch(self) -> None:
+        """
+        Poll the check function while callbacks are registered.
+        """
+        while not self._event.wait(POLL_INTERVAL):
+            with self._lock:
+                if not self._callbacks:
+                    self._watching = False
+                    return
+            if self.cancelled:
+                return
+
+    def __call__(self) -> bool:
+        """
+        Check the token like a stop flag, see cancelled.
+
+        Returns:
+            bool: True if the token is cancelled.
+        """
+        return self.cancelled
+
+
+def sleep(delay: float, cancel: CancellationToken | None = None) -> None:
+    """
+    Sleep until the delay has passed or the token is cancelled.
+
+    Args:
+        delay (float): Seconds to sleep.
+        cancel (CancellationToken | None, optional): Ends the sleep early.
+
+    Raises:
+        Cancelled: If the token is cancelled.
+    """
+    if cancel is None:
+        time.sleep(delay)
+    elif cancel.wait(delay):
+        raise Cancelled()
+
+
+async def sleep_async(delay: float, cancel: CancellationToken | None = None) -> None:
+    """
+    Asynchronous counterpart of sleep.
+
+    Args:
+        delay (float): Seconds to sleep.
+        cancel (CancellationToken | None, optional): Ends the sleep early.
+
+    Raises:
+        Cancelled: If the token is cancelled.
+    """
+    if cancel is None:
+        await asyncio.sleep(delay)
+    elif await cancel.wait_async(delay):
+        raise Cancelled()
@@ -0,0 +1,146 @@
+"""
+This module contains the checkpoints of the phase loop, from which an
+interrupted run continues without repeating a completed agent call.
+
+The phase loop takes a checkpoint after every agent step and after the
+compaction at the end of each phase. A checkpoint holds the message state of
+every agent, the current user story and the position of the next step, so a
+resumed run starts exactly where the interrupted one stopped.
+
+Classes:
+    Checkpoint: The state of a run after a completed step.
+
+Functions:
+    save_file: Writes a checkpoint to a JSON file atomically.
+    load_file: Reads a checkpoint from a JSON file.
+    delete_file: Deletes the checkpoint file of a finished run.
+    checkpoint_path: Returns the checkpoint file of a run.
+"""
+
+import dataclasses
+import json
+import os
+import typing
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(".cache", "checkpoints")
+
+
+@dataclasses.dataclass(frozen=True)
+class Checkpoint:
+    """
+    The state of a run after a completed step.
+
+    Attributes:
+        phase (int): Zero-based iteration of the phase in progress.
+        step (int): Number of completed agent steps of the phase.
+        user_story (str): The user story the phase started with.
+        turns (list[tuple[str, str, str]]): The agent name, task description
+        and response of the completed steps of the phase, in the order they
+        completed. They are the inputs of the remaining steps and are needed
+        for the phase's compaction. A task skipped for lack of budget is
+        recorded with its input as its response.
+        agents (dict[str, dict[str, typing.Any]]): The state of every agent, see
+        agent.Agent.state.
+    """
+
+    phase: int
+    step: int
+    user_story: str
+    turns: list[tuple[str, str, str]]
+    agents: dict[str, dict[str, typing.Any]]
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        """
+        Convert the checkpoint to a JSON-serializable dictionary.
+
+        Returns:
+            dict[str, typing.Any]: The checkpoint fields.
+        """
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, typing.Any]) -> "Checkpoint":
+        """
+        Create a checkpoint from the output of to_dict.
+
+        Args:
+            data (dict[str, typing.Any]): The checkpoint fields.
+
+        Returns:
+            Checkpoint: The checkpoint.
+        """
+        return cls(
+            phase=data["phase"],
+            step=data["step"],
+            user_story=data["user_story"],
+            turns=[tuple(turn) for turn in data["turns"]],
+            agents=data["agents"],
+        )
+
+
+def checkpoint_path(run_id: str, directory: str = DEFAULT_CHECKPOINT_DIR) -> str:
+    """
+    Return the checkpoint file of a run.
+
+    Args:
+        run_id (str): The run identifier.
+        directory (str, optional): The checkpoint directory.
+
+    Returns:
+        str: The path of the JSON file.
+
+    Raises:
+        ValueError: If the run identifier is not a plain file name.
+    """
+    if not run_id or os.path.basename(run_id) != run_id or run_id.startswith("."):
+        raise ValueError(f"Invalid run ID: '{run_id}'")
+    return os.path.join(directory, f"{run_id}.json")
+
+
+def save_file(path: str, checkpoint: Checkpoint) -> None:
+    """
+    Write a checkpoint to a JSON file.
+
+    The file is replaced atomically, so a crash while writing leaves the
+    previous checkpoint intact.
+
+    Args:
+        path (str): The JSON file.
+        checkpoint (Checkpoint): The checkpoint.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(checkpoint.to_dict(), file, ensure_ascii=False)
+    os.replace(temporary, path)
+
+
+def load_file(path: str) -> Checkpoint:
+    """
+    Read a checkpoint from a JSON file.
+
+    Args:
+        path (str): The JSON file written by save_file.
+
+    Returns:
+        Checkpoint: The checkpoint.
+
+    Raises:
+        FileNotFoundError: If there is no checkpoint file.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return Checkpoint.from_dict(json.load(file))
+
+
+def delete_file(path: str) -> None:
+    """
+    Delete a checkpoint file, once its run has completed.
+
+    Args:
+        path (str): The JSON file written by save_file.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,409 @@
+"""
+This module contains the HTTP client of the OpenAI chat completions API.
+
+The client keeps a pool of keep-alive connections, so consecutive calls of all
+agents, phases and concurrent runs reuse established TLS connections instead of
+opening a new one per call. Synchronous calls use a requests session;
+asynchronous calls use an aiohttp session per event loop. Both libraries are
+imported with the first call, so importing this module, validating a
+configuration or creating agents stays fast.
+
+Classes:
+    BackendError: A failed completion, telling whether a retry may succeed.
+    OpenAIClient: Streams chat completions over pooled connections.
+
+Functions:
+    retry_after_seconds: Parses a Retry-After header.
+    shared_client: Returns the process-wide client of a set of options.
+
+Configuration:
+    The OpenAI API key is read from the OPENAI_API_KEY environment variable
+    unless it is passed explicitly.
+"""
+
+import contextlib
+import email.utils
+import functools
+import json
+import os
+import socket
+import threading
+import time
+import typing
+
+from cancellation import CancellationToken, Cancelled
+
+if typing.TYPE_CHECKING:
+    import asyncio
+
+    import aiohttp
+    import requests
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+
+# Statuses worth retrying: timeouts, conflicts, rate limits and server errors.
+RETRYABLE_STATUSES = (408, 409, 429)
+
+
+class BackendError(Exception):
+    """
+    A failed completion.
+
+    Attributes:
+        retryable (bool): Whether the same request may succeed if retried, e.g.
+        after a rate limit or a server error.
+        retry_after (float | None): Seconds the server asked to wait before
+        retrying, if it said so.
+    """
+
+    def __init__(
+        self, message: str, retryable: bool = False, retry_after: float | None = None
+    ) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def _abort(response: "requests.Response") -> None:
+    """
+    Abort a streamed response from another thread than the one reading it.
+
+    Closing the response alone does not wake a read blocked on its socket, so
+    the socket is shut down first; the reading thread then fails at once.
+    """
+    connection = getattr(response.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        with contextlib.suppress(OSError):
+            sock.shutdown(socket.SHUT_RDWR)
+
+
+def retry_after_seconds(headers: typing.Mapping[str, str] | None) -> float | None:
+    """
+    Parse a Retry-After header, given in seconds or as an HTTP date.
+
+    Args:
+        headers (typing.Mapping[str, str] | None): The response headers; lookups
+        are expected to be case-insensitive.
+
+    Returns:
+        float | None: Seconds to wait, or None if the header is missing or invalid.
+    """
+    value = (headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class OpenAIClient:
+    """
+    Streams chat completions from the OpenAI API over pooled connections.
+
+    Attributes:
+        api_key (str | None): The API key; may be replaced at any time, e.g. by
+        the web interface.
+
+    Example:
+        >>> client = OpenAIClient(pool_size=32, read_timeout=60)
+        >>> "".join(client.stream_chat({"model": "gpt-4", "messages": [...]}))
+        "Hi! How are you?"
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        api_base: str = DEFAULT_API_BASE,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ) -> None:
+        """
+        Initialize the client. The sessions are created and connections are
+        opened on first use.
+
+        Args:
+            api_key (str | None, optional): The API key. Defaults to the
+            OPENAI_API_KEY environment variable.
+            api_base (str, optional): Base URL of the API, e.g. of mock_server.
+            pool_size (int, optional): Maximum number of kept-alive connections,
+            per event loop for asynchronous calls.
+            connect_timeout (float, optional): Seconds to establish a connection.
+            read_timeout (float, optional): Seconds to wait for the next chunk.
+        """
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self._url = api_base.rstrip("/") + "/chat/completions"
+        self._pool_size = pool_size
+        self._timeout = (connect_timeout, read_timeout)
+        self._session: "requests.Session | None" = None
+        self._async_sessions: dict[
+            "asyncio.AbstractEventLoop", "aiohttp.ClientSession"
+        ] = {}
+        self._lock = threading.Lock()
+
+    def _headers(self) -> dict[str, str]:
+        """
+        Build the request headers.
+        """
+        return {"Authorization": f"Bearer {self.api_key or ''}"}
+
+    def stream_chat(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        """
+        Stream the content of a chat completion.
+
+        Args:
+            request (dict[str, typing.Any]): The chat completion arguments.
+            cancel (CancellationToken | None, optional): Once it is cancelled,
+            the response is closed from the cancelling thread, also while a
+            read blocks on it.
+
+        Yields:
+            str: The pieces of the assistant's response.
+
+        Raises:
+            BackendError: If the request fails; retryable for connection errors,
+            timeouts, rate limits and server errors.
+            Cancelled: If the token was cancelled before the response was
+            complete.
+        """
+        import requests  # pylint: disable=import-outside-toplevel
+
+        session = self._sync_session()
+        try:
+            response = session.post(
+                self._url,
+                json={**request, "stream": True},
+                headers=self._headers(),
+                stream=True,
+                timeout=self._timeout,
+            )
+        except requests.RequestException as err:
+            raise BackendError(f"{type(err).__name__}: {err}", retryable=True) from err
+        # Closing the response returns its connection to the pool.
+        with response:
+            if response.status_code != 200:
+                raise _status_error(
+                    response.status_code, response.text, response.headers
+                )
+            remove = (
+                cancel.on_cancel(functools.partial(_abort, response))
+                if cancel is not None
+                else None
+            )
+            try:
+                # The body is read to its end, even past [DONE]; a partly read
+                # response cannot return its connection to the pool.
+                for line in response.iter_lines():
+                    content = _event_content(line)
+                    if content:
+                        yield content
+            except Exception as err:
+                # An aborted read fails in whichever way the read was hit.
+                if cancel is not None and cancel.cancelled:
+                    raise Cancelled() from err
+                if isinstance(err, requests.RequestException):
+                    raise BackendError(
+                        f"{type(err).__name__}: {err}", retryable=True
+                    ) from err
+                raise
+            finally:
+                if remove is not None:
+                    remove()
+
+    async def astream_chat(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        """
+        Asynchronous counterpart of stream_chat.
+
+        Args:
+            request (dict[str, typing.Any]): The chat completion arguments.
+            cancel (CancellationToken | None, optional): Once it is cancelled,
+            the response is closed on its event loop.
+
+        Yields:
+            str: The pieces of the assistant's response.
+
+        Raises:
+            BackendError: If the request fails.
+            Cancelled: If the token was cancelled before the response was
+            complete.
+        """
+        # pylint: disable=import-outside-toplevel
+        import asyncio
+
+        import aiohttp
+
+        session = self._async_session()
+        loop = asyncio.get_running_loop()
+        remove = None
+        try:
+            async with session.post(
+                self._url, json={**request, "stream": True}, headers=self._headers()
+            ) as response:
+                if response.status != 200:
+                    raise _status_error(
+                        response.status, await response.text(), response.headers
+                    )
+                if cancel is not None:
+                    remove = cancel.on_cancel(
+                        functools.partial(loop.call_soon_threadsafe, response.close)
+                    )
+                async for line in response.content:
+                    content = _event_content(line.rstrip(b"\r\n"))
+                    if content:
+                        yield content
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            if cancel is not None and cancel.cancelled:
+                raise Cancelled() from err
+            raise BackendError(f"{type(err).__name__}: {err}", retryable=True) from err
+        finally:
+            if remove is not None:
+                remove()
+
+    def _sync_session(self) -> "requests.Session":
+        """
+        Return the requests session of synchronous calls, creating it lazily.
+        """
+        with self._lock:
+            if self._session is None:
+                # pylint: disable=import-outside-toplevel
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def _async_session(self) -> "aiohttp.ClientSession":
+        """
+        Return the aiohttp session of the running event loop, creating it lazily.
+
+        aiohttp sessions are bound to the loop they were created on, so every
+        loop gets its own pool. Sessions of closed loops are dropped.
+        """
+        # pylint: disable=import-outside-toplevel
+        import asyncio
+
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for other in [other for other in self._async_sessions if other.is_closed()]:
+                del self._async_sessions[other]
+            session = self._async_sessions.get(loop)
+            if session is None or session.closed:
+                connect_timeout, read_timeout = self._timeout
+                session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self._pool_size),
+                    timeout=aiohttp.ClientTimeout(
+                        total=None, sock_connect=connect_timeout, sock_read=read_timeout
+                    ),
+                )
+                self._async_sessions[loop] = session
+            return session
+
+    async def aclose(self) -> None:
+        """
+        Close the aiohttp session of the running event loop.
+        """
+        import asyncio  # pylint: disable=import-outside-toplevel
+
+        with self._lock:
+            session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def close(self) -> None:
+        """
+        Close the pooled connections of synchronous calls.
+        """
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+
+def _event_content(line: bytes) -> str | None:
+    """
+    Extract the content of a server-sent event line of the completion stream.
+
+    Args:
+        line (bytes): A line of the response body.
+
+    Returns:
+        str | None: The content, or None if the line carries no content, such as
+        the final "data: [DONE]".
+    """
+    if not line.startswith(b"data:"):
+        return None
+    data = line[5:].strip()
+    if data == b"[DONE]":
+        return None
+    choices = json.loads(data).get("choices") or [{}]
+    content: str | None = choices[0].get("delta", {}).get("content")
+    return content
+
+
+def _status_error(
+    status: int, body: str, headers: typing.Mapping[str, str]
+) -> BackendError:
+    """
+    Build the error of a failed API response.
+
+    Args:
+        status (int): The HTTP status.
+        body (str): The response body.
+        headers (typing.Mapping[str, str]): The response headers.
+
+    Returns:
+        BackendError: The error, retryable for rate limits and server errors.
+    """
+    try:
+        message = json.loads(body)["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        message = body[:200]
+    return BackendError(
+        f"HTTP {status}: {message}",
+        retryable=status in RETRYABLE_STATUSES or status >= 500,
+        retry_after=retry_after_seconds(headers),
+    )
+
+
+_CLIENTS: dict[tuple[tuple[str, typing.Any], ...], OpenAIClient] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def shared_client(**options: typing.Any) -> OpenAIClient:
+    """
+    Return the process-wide client of a set of options.
+
+    Backends created with the same options, e.g. from the same "backend"
+    configuration section, share one client and its connection pool.
+
+    Args:
+        **options: The keyword arguments of OpenAIClient.
+
+    Returns:
+        OpenAIClient: The shared client.
+    """
+    key = tuple(sorted(options.items()))
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = OpenAIClient(**options)
+        return _CLIENTS[key]
@@ -0,0 +1,57 @@
+"""
+This module builds the compact digests that replace an agent's earlier phase
+turns, so prompts stay roughly the same size however many iterations run.
+
+Every phase task embeds the full current user story. Instead of re-sending all
+earlier versions, each finished turn is reduced to its task description and a
+short excerpt of the agent's response.
+
+Functions:
+    excerpt: Shortens a text to a number of characters at a word boundary.
+    digest_entry: Builds the digest line of a single phase turn.
+"""
+
+DEFAULT_EXCERPT_CHARS = 600
+
+DIGEST_HEADER = "Summary of your work in the earlier phases:"
+
+
+def excerpt(text: str, max_chars: int) -> str:
+    """
+    Shorten a text to at most max_chars characters, cutting at a word boundary.
+
+    Args:
+        text (str): The text to shorten.
+        max_chars (int): The maximum number of characters to keep.
+
+    Returns:
+        str: The text, followed by "..." if it was shortened.
+    """
+    text = text.strip()
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    if " " in cut:
+        cut = cut[: cut.rindex(" ")]
+    return cut.rstrip() + " ..."
+
+
+def digest_entry(
+    phase: int, task_info: str, response: str, max_chars: int = DEFAULT_EXCERPT_CHARS
+) -> str:
+    """
+    Build the digest line of a single phase turn.
+
+    Args:
+        phase (int): The one-based phase number.
+        task_info (str): The task description the agent received.
+        response (str): The agent's response.
+        max_chars (int, optional): Length of the response excerpt.
+
+    Returns:
+        str: The digest line.
+    """
+    return (
+        f"Phase {phase} task: {task_info}\n"
+        f"Your response (excerpt): {excerpt(response, max_chars)}"
+    )
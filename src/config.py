@@ -1,17 +1,42 @@
 """
 This module provides functions for reading
-a JSON configuration file, creating ColorAgent instances,
-and parsing command line arguments for the program. 
+a JSON configuration file, compiling it into a pipeline plan,
+creating ColorAgent instances,
+and parsing command line arguments for the program.
+
+The agents, with their backends and rate limiters, are imported when the first
+agents are created, so parsing the arguments and validating a configuration
+stay fast.
 """
+
 import argparse
+import dataclasses
 import json
-from typing import Any
+import os
+import threading
+import types
+from typing import TYPE_CHECKING, Any, Mapping, TypeVar
 
-from agent import ColorAgent  
+from backends import BACKEND_TYPES, Backend, create_backend
+from budget import model_prices
+from cache import DEFAULT_CACHE_PATH, CompletionCache
+from checkpoint import DEFAULT_CHECKPOINT_DIR
+from events import EventBus
 
+if TYPE_CHECKING:
+    from agent import AsyncAgent, AsyncColorAgent, ColorAgent
 
 REQ_CONFIQ_FIELDS = ["agent_order", "agents", "max_tokens_per_call", "openai_model"]
 REQ_AGENT_FIELD = ["name", "temperature", "color", "max_history", "system", "user"]
+RATE_LIMIT_FIELDS = ["requests_per_minute", "tokens_per_minute", "max_retries"]
+INGEST_FIELDS = ["max_chars", "chunk_chars", "concurrency", "max_tokens"]
+BUDGET_FIELDS = ["max_tokens", "max_cost", "prices", "min_call_tokens"]
+AGENT_BUDGET_FIELDS = ["max_tokens", "max_cost"]
+
+TASK = """
+The user story is the following:
+{}
+"""
 
 
 def read_file(file_path: str) -> str:
@@ -61,6 +86,35 @@ def validate(config_file: dict[str, Any]) -> None:
         - "openai_model" (str): The OpenAI model to use.
     Optional field:
         - "iterations" (int): The number of repetitions.
+        - "max_context_tokens" (int): Token budget of every agent's prompt plus
+          max_tokens_per_call (default: the model's context size).
+        - "compaction" (bool): Replace earlier phase turns of every agent with a
+          digest after each phase (default: false).
+        - "compaction_excerpt_chars" (int): Length of the response excerpts kept
+          in the digest (default: 600).
+        - "backend" (dict): The LLM backend, with a "type" of "openai" (default)
+          or "mock" and the backend's options, see backends.create_backend.
+        - "rate_limits" (dict): Limits shared by all agents and runs of the
+          process: "requests_per_minute", "tokens_per_minute" and "max_retries"
+          (default: no limits, 5 retries), see ratelimit.RateLimiter.
+        - "ingest" (dict): Condensing of long user stories and MVP documents
+          before the first phase: "max_chars", "chunk_chars", "concurrency" and
+          "max_tokens", see ingest.Ingestor.
+        - "budget" (dict): Caps of the run: "max_tokens" (prompt plus completion)
+          and "max_cost" (USD), "prices" ({"prompt": ..., "completion": ...} in
+          USD per 1000 tokens; default: those of known models) and
+          "min_call_tokens", the smallest max_tokens worth a call (default: 256).
+          With a budget, the max_tokens of every call adapts to the budget left
+          and the agent's earlier responses, see budget.Budget.
+        - "convergence_threshold" (float): Word similarity between the user story
+          before and after a phase, from 0 to 1, from which the story counts as
+          stable and the remaining phases are skipped (default: disabled).
+        - "schedule" (dict): Dependencies of the agent tasks per phase, e.g.
+          {"2": {"Requirements Engineer": [], "Reviewer": ["Product Owner",
+          "Requirements Engineer"]}}. An agent receives the merged responses of
+          the agents it depends on, or the phase's user story if it depends on
+          none; tasks whose dependencies are done run concurrently. Phases without
+          a schedule run the agents one after the other in "agent_order".
 
     Each agent should have the following keys:
         - "name" (str): Name of the agent
@@ -71,6 +125,9 @@ def validate(config_file: dict[str, Any]) -> None:
         - "user" (str): User message for the agent
     Optional fields
         - "top_p" (float): Top-p value for message generation (default: 1.0)
+        - "max_context_tokens" (int): Overrides the main "max_context_tokens"
+        - "budget" (dict): Caps of the agent's calls in a run: "max_tokens" and
+          "max_cost"
 
     Args:
         config_file (dict[str, Any]): JSON file with the
@@ -84,6 +141,40 @@ def validate(config_file: dict[str, Any]) -> None:
             raise ValueError(
                 f"'{field}' is missing in the main JSON configuration file"
             )
+    _validate_positive_int(config_file, "max_context_tokens")
+    _validate_positive_int(config_file, "compaction_excerpt_chars")
+    if not isinstance(config_file.get("compaction", False), bool):
+        raise ValueError("'compaction' must be true or false")
+    threshold = config_file.get("convergence_threshold")
+    if threshold is not None and (
+        not isinstance(threshold, (int, float))
+        or isinstance(threshold, bool)
+        or not 0 < threshold <= 1
+    ):
+        raise ValueError(
+            f"'convergence_threshold' must be a number in (0, 1], got {threshold!r}"
+        )
+    backend = config_file.get("backend", {})
+    if (
+        not isinstance(backend, dict)
+        or backend.get("type", "openai") not in BACKEND_TYPES
+    ):
+        raise ValueError(f"'backend' must be an object with a type in {BACKEND_TYPES}")
+    rate_limits = config_file.get("rate_limits", {})
+    if not isinstance(rate_limits, dict) or set(rate_limits) - set(RATE_LIMIT_FIELDS):
+        raise ValueError(
+            f"'rate_limits' must be an object with keys {RATE_LIMIT_FIELDS}"
+        )
+    _validate_positive_int(rate_limits, "requests_per_minute")
+    _validate_positive_int(rate_limits, "tokens_per_minute")
+    # 0 turns retries off
+    _validate_non_negative_int(rate_limits, "max_retries")
+    ingest = config_file.get("ingest", {})
+    if not isinstance(ingest, dict) or set(ingest) - set(INGEST_FIELDS):
+        raise ValueError(f"'ingest' must be an object with keys {INGEST_FIELDS}")
+    for field in INGEST_FIELDS:
+        _validate_positive_int(ingest, field)
+    _validate_budget(config_file, config_file, BUDGET_FIELDS)
     # Validation for agents in JSON file
     for agent_config in config_file["agents"]:
         for field in REQ_AGENT_FIELD:
@@ -91,41 +182,576 @@ def validate(config_file: dict[str, Any]) -> None:
                 raise ValueError(
                     f"'{field}' is missing in the agent JSON configuration file"
                 )
+        _validate_positive_int(agent_config, "max_context_tokens")
+        _validate_budget(config_file, agent_config, AGENT_BUDGET_FIELDS)
+        _validate_tasks(agent_config)
+    _validate_schedule(config_file)
+
+
+def _validate_budget(
+    config_file: dict[str, Any], section: dict[str, Any], fields: list[str]
+) -> None:
+    """
+    Validates the optional "budget" of the configuration or an agent.
+
+    Args:
+        config_file (dict[str, Any]): The configuration.
+        section (dict[str, Any]): The configuration or the agent configuration.
+        fields (list[str]): The allowed keys of the budget.
+
+    Raises:
+        ValueError: If the budget is invalid, or caps the cost of a model with
+        unknown prices.
+    """
+    budget = section.get("budget", {})
+    if not isinstance(budget, dict) or set(budget) - set(fields):
+        raise ValueError(f"'budget' must be an object with keys {fields}")
+    _validate_positive_int(budget, "max_tokens")
+    _validate_positive_int(budget, "min_call_tokens")
+    max_cost = budget.get("max_cost")
+    if max_cost is not None and (
+        not isinstance(max_cost, (int, float))
+        or isinstance(max_cost, bool)
+        or max_cost <= 0
+    ):
+        raise ValueError(f"'max_cost' must be a positive number, got {max_cost!r}")
+    prices = budget.get("prices")
+    if prices is not None and not (
+        isinstance(prices, dict)
+        and set(prices) == {"prompt", "completion"}
+        and all(
+            isinstance(price, (int, float))
+            and not isinstance(price, bool)
+            and price >= 0
+            for price in prices.values()
+        )
+    ):
+        raise ValueError(
+            "'prices' must be an object with the non-negative 'prompt' and "
+            "'completion' prices per 1000 tokens"
+        )
+    if (
+        max_cost is not None
+        and "prices" not in config_file.get("budget", {})
+        and model_prices(config_file["openai_model"]) is None
+    ):
+        raise ValueError(
+            f"'max_cost' needs the 'prices' of the 'budget', the prices of "
+            f"'{config_file['openai_model']}' are unknown"
+        )
+
+
+def _validate_tasks(agent_config: dict[str, Any]) -> None:
+    """
+    Validates the optional "tasks" of an agent. Tasks of phases after the
+    configured "iterations" are allowed and ignored.
+
+    Args:
+        agent_config (dict[str, Any]): The agent configuration.
+
+    Raises:
+        ValueError: If a key is not a phase number or a task is not a string.
+    """
+    tasks = agent_config.get("tasks", {})
+    if not isinstance(tasks, dict):
+        raise ValueError(f"'tasks' of '{agent_config['name']}' must be an object")
+    for phase, task_info in tasks.items():
+        # One spelling per phase: "1", not "01"
+        if not (
+            phase.isascii()
+            and phase.isdigit()
+            and phase == str(int(phase))
+            and int(phase) >= 1
+        ):
+            raise ValueError(
+                f"Task '{phase}' of '{agent_config['name']}' is not a phase number"
+            )
+        if not isinstance(task_info, str):
+            raise ValueError(
+                f"Task '{phase}' of '{agent_config['name']}' must be a string"
+            )
+
+
+def _validate_schedule(config_file: dict[str, Any]) -> None:
+    """
+    Validates the optional "schedule" section.
+
+    Every scheduled agent and every dependency must be an agent of "agent_order"
+    with a task in the phase, and the dependencies must not form a cycle.
+
+    Args:
+        config_file (dict[str, Any]): The configuration.
+
+    Raises:
+        ValueError: If the schedule is invalid.
+    """
+    schedule = config_file.get("schedule", {})
+    if not isinstance(schedule, dict):
+        raise ValueError("'schedule' must be an object of phases")
+    agents = {agent["name"]: agent for agent in config_file["agents"]}
+    for phase, dependencies in schedule.items():
+        if not isinstance(dependencies, dict):
+            raise ValueError(f"'schedule' of phase {phase} must be an object")
+        tasks = {
+            name
+            for name in config_file["agent_order"]
+            if phase in agents.get(name, {}).get("tasks", {})
+        }
+        for name, required in dependencies.items():
+            if not isinstance(required, list):
+                raise ValueError(
+                    f"Dependencies of '{name}' in phase {phase} must be a list"
+                )
+            for other in [name, *required]:
+                if other not in tasks:
+                    raise ValueError(
+                        f"'{other}' has no task in phase {phase} of 'schedule'"
+                    )
+        # Remove agents whose dependencies are all removed; a cycle remains
+        remaining = {name: set(required) for name, required in dependencies.items()}
+        while remaining:
+            free = [
+                name
+                for name, required in remaining.items()
+                if not required & remaining.keys()
+            ]
+            if not free:
+                raise ValueError(f"Cyclic dependencies in phase {phase} of 'schedule'")
+            for name in free:
+                del remaining[name]
+
+
+def _validate_positive_int(section: dict[str, Any], field: str) -> None:
+    """
+    Validates an optional field that must be a positive integer.
+
+    Args:
+        section (dict[str, Any]): The configuration section holding the field.
+        field (str): The name of the field.
+
+    Raises:
+        ValueError: If the field is present but not a positive integer.
+    """
+    value = section.get(field)
+    if value is not None and (
+        not isinstance(value, int) or isinstance(value, bool) or value <= 0
+    ):
+        raise ValueError(f"'{field}' must be a positive integer, got {value!r}")
+
+
+def _validate_non_negative_int(section: dict[str, Any], field: str) -> None:
+    """
+    Validates an optional field that must be an integer of at least 0.
+
+    Args:
+        section (dict[str, Any]): The configuration section holding the field.
+        field (str): The name of the field.
+
+    Raises:
+        ValueError: If the field is present but not a non-negative integer.
+    """
+    value = section.get(field)
+    if value is not None and (
+        not isinstance(value, int) or isinstance(value, bool) or value < 0
+    ):
+        raise ValueError(f"'{field}' must be a non-negative integer, got {value!r}")
+
+
+@dataclasses.dataclass(frozen=True)
+class PhaseTask:
+    """
+    The task of an agent in a phase.
+
+    Attributes:
+        agent (str): The agent name.
+        task_info (str): The task description from the configuration.
+        prompt (str): The rendered task prompt; the user story is appended to it.
+        dependencies (tuple[str, ...]): The agents of the phase whose responses
+        the task works on; none for the user story the phase started with.
+    """
+
+    agent: str
+    task_info: str
+    prompt: str
+    dependencies: tuple[str, ...]
+
+
+@dataclasses.dataclass(frozen=True)
+class Phase:
+    """
+    A phase with at least one agent task.
+
+    Attributes:
+        iteration (int): The zero-based iteration index.
+        tasks (Mapping[str, PhaseTask]): The tasks keyed by agent, in agent order.
+    """
+
+    iteration: int
+    tasks: Mapping[str, PhaseTask]
+
+    @property
+    def number(self) -> int:
+        """
+        The one-based phase number.
+        """
+        return self.iteration + 1
+
+
+@dataclasses.dataclass(frozen=True)
+class PipelinePlan:
+    """
+    A validated configuration compiled for the phase loop.
+
+    The plan and the configuration it holds are read-only, so a cached plan can
+    be shared by all runs of a process.
+
+    Attributes:
+        config (Mapping[str, Any]): The read-only configuration; lists are
+        tuples and objects are read-only mappings.
+        agents (Mapping[str, Mapping[str, Any]]): The agent configurations keyed
+        by name.
+        phases (tuple[Phase, ...]): The phases with agent tasks; phases without
+        any task are left out.
+        iterations (int): The configured number of phases.
+    """
+
+    config: Mapping[str, Any]
+    agents: Mapping[str, Mapping[str, Any]]
+    phases: tuple[Phase, ...]
+    iterations: int
+
+    def with_backend(self, backend: Mapping[str, Any]) -> "PipelinePlan":
+        """
+        Return a copy of the plan with another "backend" section.
+
+        Args:
+            backend (Mapping[str, Any]): The new "backend" section.
+
+        Returns:
+            PipelinePlan: The new plan.
+        """
+        config = types.MappingProxyType({**self.config, "backend": _freeze(backend)})
+        return dataclasses.replace(self, config=config)
+
+
+def render_task(task_info: str, iteration: int) -> str:
+    """
+    Render the prompt of an agent task, without the user story.
+
+    Args:
+        task_info (str): The task description from the configuration.
+        iteration (int): The zero-based iteration index.
+
+    Returns:
+        str: The prompt; the user story is appended to it.
+    """
+    if iteration == 0:
+        return TASK.format(task_info) + "\n\nUser Story:\n"
+    return TASK.format(task_info)
+
+
+def compile_plan(config_file: dict[str, Any]) -> PipelinePlan:
+    """
+    Validate a configuration and compile it into a pipeline plan.
+
+    Without a "schedule" for a phase, every agent task depends on the previous
+    one in the agent order.
+
+    Args:
+        config_file (dict[str, Any]): The configuration.
+
+    Returns:
+        PipelinePlan: The plan.
+
+    Raises:
+        ValueError: If the configuration is invalid.
+    """
+    validate(config_file)
+    config = _freeze(config_file)
+    agents = types.MappingProxyType(
+        {agent["name"]: agent for agent in config["agents"]}
+    )
+    iterations = config.get("iterations", 1)
+    phases = []
+    for iteration in range(iterations):
+        phase = str(iteration + 1)
+        schedule = config.get("schedule", {}).get(phase)
+        tasks: dict[str, PhaseTask] = {}
+        for agent_name in config["agent_order"]:
+            task_info = agents.get(agent_name, {}).get("tasks", {}).get(phase)
+            if not task_info:
+                continue
+            if schedule is None:
+                dependencies = tuple(tasks)[-1:]
+            else:
+                dependencies = tuple(schedule.get(agent_name, ()))
+            tasks[agent_name] = PhaseTask(
+                agent_name, task_info, render_task(task_info, iteration), dependencies
+            )
+        if tasks:
+            phases.append(Phase(iteration, types.MappingProxyType(tasks)))
+    return PipelinePlan(config, agents, tuple(phases), iterations)
 
 
-def create_coloragents(config: dict) -> dict[str, ColorAgent]:
+def as_plan(config_file: dict[str, Any] | PipelinePlan) -> PipelinePlan:
+    """
+    Return a plan as it is, or compile a configuration into one.
+
+    Args:
+        config_file (dict[str, Any] | PipelinePlan): A configuration or a plan.
+
+    Returns:
+        PipelinePlan: The plan.
+    """
+    if isinstance(config_file, PipelinePlan):
+        return config_file
+    return compile_plan(config_file)
+
+
+_PLANS: dict[str, tuple[tuple[int, int], PipelinePlan]] = {}
+_CONFIG_DIRS: dict[str, tuple[int, list[str]]] = {}
+_PLANS_LOCK = threading.Lock()
+
+
+def load_plan(file_path: str) -> PipelinePlan:
+    """
+    Read, validate and compile a configuration file, once per version of the file.
+
+    Plans are cached in-process, keyed by path, modification time and size, so
+    every run after the first one of a file skips reading and validating it.
+
+    Args:
+        file_path (str): The path to the JSON configuration file.
+
+    Returns:
+        PipelinePlan: The plan.
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist.
+        json.JSONDecodeError: If an error occurs during JSON parsing.
+        ValueError: If the configuration is invalid.
+    """
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _PLANS_LOCK:
+        cached = _PLANS.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    plan = compile_plan(read_json(path))
+    with _PLANS_LOCK:
+        _PLANS[path] = (version, plan)
+    return plan
+
+
+def list_config_files(directory: str) -> list[str]:
+    """
+    List the JSON configuration files of a directory, cached until it changes.
+
+    Args:
+        directory (str): The configuration directory.
+
+    Returns:
+        list[str]: The file names, sorted; empty if the directory doesn't exist.
+    """
+    path = os.path.abspath(directory)
+    try:
+        version = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    with _PLANS_LOCK:
+        cached = _CONFIG_DIRS.get(path)
+        if cached is None or cached[0] != version:
+            names = sorted(name for name in os.listdir(path) if name.endswith(".json"))
+            cached = _CONFIG_DIRS[path] = (version, names)
+        return list(cached[1])
+
+
+def _freeze(value: Any) -> Any:
+    """
+    Return a read-only copy of a JSON value: objects become read-only mappings
+    and lists become tuples.
+    """
+    if isinstance(value, Mapping):
+        return types.MappingProxyType(
+            {key: _freeze(item) for key, item in value.items()}
+        )
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def create_coloragents(
+    config: Mapping[str, Any],
+    cache: CompletionCache | None = None,
+    backend: Backend | None = None,
+    events: EventBus | None = None,
+) -> dict[str, "ColorAgent"]:
     """
     Create ColorAgent instances based on the provided configuration.
 
     Parameters:
         agents_config (list[dict]): List of dictionaries
         representing agent configurations.
+        cache (CompletionCache | None): Optional completion cache shared by the agents.
+        backend (Backend | None): The backend shared by the agents. Defaults to the
+        configuration's "backend" section.
+        events (EventBus | None): The bus the agents report their calls on.
+        Defaults to a bus per agent printing to the console.
 
     Returns:
         dict[str, ColorAgent]: A dictionary mapping agent names to ColorAgent instances.
 
     Returns a dictionary containing ColorAgent instances, where keys are agent names.
     """
+    from agent import ColorAgent  # pylint: disable=import-outside-toplevel
+
+    return _create_agents(config, ColorAgent, cache, backend, events)
+
+
+def create_async_coloragents(
+    config: Mapping[str, Any],
+    cache: CompletionCache | None = None,
+    backend: Backend | None = None,
+    events: EventBus | None = None,
+) -> dict[str, "AsyncColorAgent"]:
+    """
+    Create AsyncColorAgent instances based on the provided configuration.
+
+    Parameters:
+        config (Mapping[str, Any]): The validated configuration.
+        cache (CompletionCache | None): Optional completion cache shared by the agents.
+        backend (Backend | None): The backend shared by the agents. Defaults to the
+        configuration's "backend" section.
+        events (EventBus | None): The bus the agents report their calls on.
+        Defaults to a bus per agent printing to the console.
+
+    Returns:
+        dict[str, AsyncColorAgent]: A dictionary mapping agent names to
+        AsyncColorAgent instances.
+    """
+    from agent import AsyncColorAgent  # pylint: disable=import-outside-toplevel
+
+    return _create_agents(config, AsyncColorAgent, cache, backend, events)
+
+
+def create_async_agents(
+    config: Mapping[str, Any],
+    cache: CompletionCache | None = None,
+    backend: Backend | None = None,
+    events: EventBus | None = None,
+) -> dict[str, "AsyncAgent"]:
+    """
+    Create AsyncAgent instances without console output, e.g. for batch runs
+    where the output of many concurrent pipelines would interleave.
+
+    Parameters:
+        config (Mapping[str, Any]): The validated configuration.
+        cache (CompletionCache | None): Optional completion cache shared by the agents.
+        backend (Backend | None): The backend shared by the agents. Defaults to the
+        configuration's "backend" section.
+        events (EventBus | None): The bus the agents report their calls on.
+        Defaults to a bus per agent without subscribers.
+
+    Returns:
+        dict[str, AsyncAgent]: A dictionary mapping agent names to AsyncAgent
+        instances.
+    """
+    from agent import AsyncAgent  # pylint: disable=import-outside-toplevel
+
+    return _create_agents(config, AsyncAgent, cache, backend, events)
+
+
+def create_limited_backend(config: Mapping[str, Any]) -> Backend:
+    """
+    Create the configuration's backend, limited by its "rate_limits" section.
+
+    Parameters:
+        config (Mapping[str, Any]): The validated configuration.
+
+    Returns:
+        Backend: The backend.
+    """
+    # pylint: disable=import-outside-toplevel
+    from ratelimit import RateLimitedBackend, shared_limiter
+
+    return RateLimitedBackend(
+        create_backend(config.get("backend")),
+        shared_limiter(config.get("rate_limits")),
+    )
+
+
+AgentT = TypeVar("AgentT", "ColorAgent", "AsyncColorAgent", "AsyncAgent")
+
+
+def _create_agents(
+    config: Mapping[str, Any],
+    agent_class: type[AgentT],
+    cache: CompletionCache | None,
+    backend: Backend | None,
+    events: EventBus | None = None,
+) -> dict[str, AgentT]:
+    """
+    Create agents of the given class based on the provided configuration.
+
+    Parameters:
+        config (Mapping[str, Any]): The validated configuration.
+        agent_class (type): ColorAgent, AsyncColorAgent or AsyncAgent.
+        cache (CompletionCache | None): Optional completion cache shared by the agents.
+        backend (Backend | None): The backend shared by the agents. Defaults to the
+        configuration's "backend" section, limited by its "rate_limits" section.
+        events (EventBus | None): The bus the agents report their calls on.
+
+    Returns:
+        dict: A dictionary mapping agent names to agent instances.
+    """
+    from agent import AsyncAgent  # pylint: disable=import-outside-toplevel
 
-    agents: dict[str, ColorAgent] = {}
+    if backend is None:
+        backend = create_limited_backend(config)
+    agents: dict[str, AgentT] = {}
     for agent_config in config["agents"]:
-        agent = ColorAgent(
-            name=agent_config["name"],
-            color=agent_config["color"],
+        display: dict[str, str] = {"name": agent_config["name"]}
+        if agent_class is not AsyncAgent:
+            display["color"] = agent_config["color"]
+        agent = agent_class(
+            **display,
             openai_model=config["openai_model"],
             max_tokens_per_call=config["max_tokens_per_call"],
             max_history=agent_config["max_history"],
+            cache=cache,
+            backend=backend,
+            events=events,
+            max_context_tokens=agent_config.get(
+                "max_context_tokens", config.get("max_context_tokens")
+            ),
             top_p=agent_config.get("top_p", 1.0),
             temperature=agent_config["temperature"],
         )
         if "system" in agent_config:
-            agent.append_message("system", agent_config["system"], False)
+            agent.append_message("system", agent_config["system"], False, pinned=True)
         if "user" in agent_config:
-            agent.append_message("user", agent_config["user"], False)
+            agent.append_message("user", agent_config["user"], False, pinned=True)
         agents[agent_config["name"]] = agent
     return agents
 
 
+def _positive_int(value: str) -> int:
+    """
+    Parse a command line value as a positive integer.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not a positive integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value!r}")
+    return number
+
+
 def parse_argument() -> argparse.Namespace:
     """
     Parse command line arguments for the program.
@@ -148,6 +774,56 @@ def parse_argument() -> argparse.Namespace:
         default="",
     )
     parser.add_argument("-m", "--mvp", help="The path to the MVP file.")  # New code
+    parser.add_argument(
+        "--batch",
+        help="Path to a JSONL file of user stories to process in parallel.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=_positive_int,
+        default=4,
+        help="Number of user stories processed at the same time in batch mode.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Path to the JSONL results file in batch mode "
+        "(default: <batch file>.results.jsonl).",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKEND_TYPES,
+        help="Override the LLM backend type of the configuration file, "
+        'e.g. "mock" to run offline.',
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Replay identical OpenAI requests from an on-disk completion cache.",
+    )
+    parser.add_argument(
+        "--cache-path",
+        default=DEFAULT_CACHE_PATH,
+        help=f"Path to the completion cache (default: {DEFAULT_CACHE_PATH}).",
+    )
+    parser.add_argument(
+        "--events",
+        help="Path to a JSONL file receiving the structured pipeline events.",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        help="Continue an interrupted run from its last completed agent step.",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        default=DEFAULT_CHECKPOINT_DIR,
+        help="Directory of the run checkpoints "
+        f"(default: {DEFAULT_CHECKPOINT_DIR}).",
+    )
 
-
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.resume and args.batch:
+        parser.error("--resume cannot be combined with --batch")
+    return args
@@ -0,0 +1,60 @@
+"""
+This module detects when the user story has stopped changing between phases,
+so the remaining phases can be skipped.
+
+Successive versions of the user story are compared word by word with difflib,
+locally and without any API call.
+
+Functions:
+    similarity: Measures how similar two versions of a text are.
+    has_converged: Checks whether a new version barely differs from the previous.
+"""
+
+import difflib
+
+
+def similarity(previous: str, current: str) -> float:
+    """
+    Measure how similar two versions of a text are.
+
+    The texts are compared as sequences of words, so changes in whitespace and
+    line breaks do not count.
+
+    Args:
+        previous (str): The earlier version.
+        current (str): The later version.
+
+    Returns:
+        float: 1.0 for identical word sequences down to 0.0 for texts without a
+        common word.
+    """
+    return _matcher(previous, current).ratio()
+
+
+def has_converged(previous: str, current: str, threshold: float) -> bool:
+    """
+    Check whether a new version of the user story barely differs from the previous.
+
+    Args:
+        previous (str): The user story before the phase.
+        current (str): The user story after the phase.
+        threshold (float): Similarity, see similarity, from which the story counts
+        as stable.
+
+    Returns:
+        bool: True if the similarity reaches the threshold.
+    """
+    matcher = _matcher(previous, current)
+    # The cheap upper bounds rule out most rewrites before the full comparison.
+    return (
+        matcher.real_quick_ratio() >= threshold
+        and matcher.quick_ratio() >= threshold
+        and matcher.ratio() >= threshold
+    )
+
+
+def _matcher(previous: str, current: str) -> difflib.SequenceMatcher[str]:
+    """
+    Create a matcher of the word sequences of two texts.
+    """
+    return difflib.SequenceMatcher(None, previous.split(), current.split())
@@ -0,0 +1,332 @@
+"""
+This module contains the structured events of a pipeline run and the bus that
+delivers them to pluggable subscribers.
+
+Agents and the phase loop emit typed events instead of printing. Subscribers
+render them for their audience: the console (printer.ConsoleSubscriber), the
+web stream (runs.Run), a JSONL file (FileSubscriber) or metrics
+(metrics.MetricsSubscriber).
+
+Event types:
+    run_start: A run begins; "data" holds the number of iterations.
+    phase_start, phase_end: A phase begins or ends; "phase" is one-based.
+    agent_start: An agent call begins; "data" holds the model, the prompt
+    tokens, whether the response is cached and, for colored agents, the color.
+    token: A streamed piece of the response in "text".
+    agent_end: An agent call ends; "text" holds the full response and "data"
+    the token usage of the call.
+    error: An agent call failed, or was cut off by a cancellation with the
+    "type" Cancelled in "data"; "text" holds the error message. Errors of agent
+    calls also hold the token usage of the part streamed before in "data".
+    log: A progress message in "text".
+    run_end: A run ends; "data" holds its status and "text" the final user
+    story, or the error that ended the run. For a run stopped during a phase,
+    "data" also holds the "phase" and the agents whose calls were "cut_off".
+
+Classes:
+    Event: A single pipeline event.
+    EventBus: Delivers events to subscribers.
+    TurnSerializer: Delivers the events of concurrent agent turns one turn at a
+    time.
+    FileSubscriber: Appends events to a JSONL file.
+
+Functions:
+    render_text: Renders an event as plain console text.
+"""
+
+import dataclasses
+import json
+import threading
+import time
+import typing
+
+EVENT_TYPES = (
+    "run_start",
+    "phase_start",
+    "phase_end",
+    "agent_start",
+    "token",
+    "agent_end",
+    "error",
+    "log",
+    "run_end",
+)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Event:
+    """
+    A single pipeline event.
+
+    Attributes:
+        type (str): One of EVENT_TYPES.
+        run_id (str | None): The run the event belongs to, if any.
+        phase (int | None): The one-based phase, for phase events and the
+        agent events of calls made by the phase loop.
+        agent (str | None): The agent name, for agent events.
+        text (str): Text payload: a token, a response, an error or a message.
+        data (dict[str, typing.Any]): Further fields of the event type.
+        time (float): When the event was emitted, as a Unix timestamp.
+    """
+
+    type: str
+    run_id: str | None = None
+    phase: int | None = None
+    agent: str | None = None
+    text: str = ""
+    data: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+    time: float = dataclasses.field(default_factory=time.time)
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        """
+        Convert the event to a JSON-serializable dictionary, without empty fields.
+
+        Returns:
+            dict[str, typing.Any]: The event fields.
+        """
+        return {
+            key: value
+            for key, value in dataclasses.asdict(self).items()
+            if value not in (None, "", {})
+        }
+
+
+Subscriber = typing.Callable[[Event], None]
+
+
+class EventBus:
+    """
+    Delivers the events of a run to its subscribers, synchronously and in order.
+
+    Subscribers are called on the emitting thread; they should be quick and
+    must not raise.
+
+    Example:
+        >>> bus = EventBus(subscribers=[print])
+        >>> bus.log("Reading input file...")
+        Event(type='log', ..., text='Reading input file...', ...)
+    """
+
+    def __init__(
+        self, run_id: str | None = None, subscribers: typing.Iterable[Subscriber] = ()
+    ) -> None:
+        """
+        Initialize the bus.
+
+        Args:
+            run_id (str | None, optional): Stamped on every event of the bus.
+            subscribers (typing.Iterable[Subscriber], optional): Initial
+            subscribers.
+        """
+        self.run_id = run_id
+        self._subscribers: tuple[Subscriber, ...] = tuple(subscribers)
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        """
+        Add a subscriber; it receives all events emitted from now on.
+
+        Args:
+            subscriber (Subscriber): Called with every event.
+        """
+        with self._lock:
+            self._subscribers += (subscriber,)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """
+        Remove a subscriber.
+
+        Args:
+            subscriber (Subscriber): A subscriber added before.
+        """
+        with self._lock:
+            self._subscribers = tuple(
+                other for other in self._subscribers if other is not subscriber
+            )
+
+    def emit(self, event_type: str, **fields: typing.Any) -> Event:
+        """
+        Create an event and deliver it to all subscribers.
+
+        Args:
+            event_type (str): One of EVENT_TYPES.
+            **fields: The other fields of the event.
+
+        Returns:
+            Event: The emitted event.
+        """
+        event = Event(event_type, run_id=self.run_id, **fields)
+        self.publish(event)
+        return event
+
+    def publish(self, event: Event) -> None:
+        """
+        Deliver an existing event, such as one emitted in a worker process, to
+        all subscribers.
+
+        Args:
+            event (Event): The event.
+        """
+        # The tuple is replaced, never mutated, so it can be iterated unlocked.
+        for subscriber in self._subscribers:
+            subscriber(event)
+
+    def log(self, text: str) -> Event:
+        """
+        Emit a progress message.
+
+        Args:
+            text (str): The message.
+
+        Returns:
+            Event: The emitted event.
+        """
+        return self.emit("log", text=text)
+
+
+class TurnSerializer:
+    """
+    Passes events on to a subscriber one agent turn at a time.
+
+    Agents of a phase may stream concurrently. Renderers of a single text
+    stream, like the console and the web transcript, would interleave their
+    tokens. The serializer delivers the events of one turn, from agent_start to
+    agent_end or error, without interruption, and holds back all other events
+    until the turn has ended. Held events are delivered in their order.
+
+    Example:
+        >>> bus = EventBus(subscribers=[TurnSerializer(print)])
+    """
+
+    def __init__(self, subscriber: Subscriber) -> None:
+        """
+        Args:
+            subscriber (Subscriber): Receives the serialized events.
+        """
+        self._subscriber = subscriber
+        self._current: str | None = None
+        self._held: list[Event] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        with self._lock:
+            if not self._deliverable(event):
+                self._held.append(event)
+                return
+            self._deliver(event)
+            # Deliver held events until another turn is in progress.
+            while self._held and self._current is None:
+                held, self._held = self._held, []
+                for index, other in enumerate(held):
+                    if self._deliverable(other):
+                        self._deliver(other)
+                        if self._current is None:
+                            # A turn ended; earlier held events come first again.
+                            self._held.extend(held[index + 1 :])
+                            break
+                    else:
+                        self._held.append(other)
+
+    def interrupt(self) -> None:
+        """
+        End the current turn without its end event, for example because the
+        process streaming it has died, and deliver the held events.
+        """
+        with self._lock:
+            self._current = None
+            held, self._held = self._held, []
+        for event in held:
+            self(event)
+
+    def _deliverable(self, event: Event) -> bool:
+        """
+        Check whether an event belongs to the current turn, if there is one.
+        """
+        return self._current is None or (
+            event.agent == self._current
+            and event.type in ("token", "agent_end", "error")
+        )
+
+    def _deliver(self, event: Event) -> None:
+        """
+        Pass an event on and track the current turn.
+        """
+        self._subscriber(event)
+        if event.type == "agent_start":
+            self._current = event.agent
+        elif event.type in ("agent_end", "error") and event.agent == self._current:
+            self._current = None
+
+
+def render_text(event: Event) -> str:
+    """
+    Render an event as plain console text.
+
+    Tokens are rendered as they are, so the rendering of all events of a run is
+    its console transcript.
+
+    Args:
+        event (Event): The event.
+
+    Returns:
+        str: The text, possibly empty.
+    """
+    if event.type == "token":
+        return event.text
+    if event.type == "log":
+        return event.text + "\n"
+    if event.type == "phase_start":
+        return f"--- Phase {event.phase} ---\n"
+    if event.type == "agent_start":
+        return f"### {event.agent} ###\n"
+    if event.type == "agent_end":
+        return "\n\n"
+    if event.type == "error" and event.data.get("type") == "Cancelled":
+        return f"\n*** Stopped: {event.text} ***\n"
+    if event.type == "error":
+        return f"\nError in {event.agent or 'the pipeline'}: {event.text}\n"
+    return ""
+
+
+class FileSubscriber:
+    """
+    Appends events to a JSONL file, one object per line.
+
+    Example:
+        >>> with FileSubscriber("run.events.jsonl", tokens=False) as subscriber:
+        ...     bus.subscribe(subscriber)
+        ...     ...
+    """
+
+    def __init__(self, path: str, tokens: bool = True) -> None:
+        """
+        Open the file.
+
+        Args:
+            path (str): The JSONL file; it is overwritten.
+            tokens (bool, optional): Also write token events. The responses are
+            contained in the agent_end events either way. Defaults to True.
+        """
+        self._file = open(path, "w", encoding="utf-8")  # pylint: disable=R1732
+        self._tokens = tokens
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        if event.type == "token" and not self._tokens:
+            return
+        line = json.dumps(event.to_dict(), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self) -> None:
+        """
+        Close the file.
+        """
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> "FileSubscriber":
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
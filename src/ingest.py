@@ -0,0 +1,309 @@
+"""
+This module condenses long user stories and MVP documents before the first
+phase, so a product specification of hundreds of kilobytes is not sent wholesale
+in the phase-1 prompt.
+
+Documents up to "max_chars" characters are used as they are. Longer ones are
+read in chunks of about "chunk_chars" characters; every chunk is condensed by an
+LLM call, several in parallel (map), and the condensed chunks are joined
+(reduce), once more while the result is still too long. The result is stored by
+a hash of the document and the ingestion settings, so later runs on the same
+document reuse it without any call.
+
+Classes:
+    Ingestor: Condenses long documents, with a digest cache.
+
+Functions:
+    iter_chunks: Reads a text in chunks that end at line breaks.
+"""
+
+import collections
+from concurrent import futures
+import functools
+import hashlib
+import io
+import json
+import os
+import threading
+import typing
+
+from agent import Agent
+from backends import Backend
+from cache import CompletionCache
+import config
+
+DEFAULT_MAX_CHARS = 12_000
+DEFAULT_CHUNK_CHARS = 6_000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_TOKENS = 600
+DEFAULT_DIGEST_DIR = os.path.join(".cache", "digests")
+
+# Reduce rounds before a digest that is still too long is used as it is.
+MAX_ROUNDS = 3
+
+PROMPT = (
+    "You condense part of a {kind} for a team of requirements engineers. Keep "
+    "every feature, requirement, constraint, user role, acceptance criterion and "
+    "domain term, in the words of the document where possible. Drop repetition, "
+    "boilerplate and formatting. Answer with the condensed text only."
+)
+
+Summarizer = typing.Callable[[str, str], str]
+
+# Opens the chunks of a document anew; a long document is read twice, to look up
+# its digest and to condense it, instead of being held in memory.
+ChunkSource = typing.Callable[[], typing.Iterator[str]]
+
+
+def iter_chunks(file: typing.TextIO, chunk_chars: int) -> typing.Iterator[str]:
+    """
+    Read a text in chunks of at most chunk_chars characters.
+
+    A chunk ends after the last line break in its second half, so lines are only
+    split if they are longer than half a chunk. Joined, the chunks form the text.
+
+    Args:
+        file (typing.TextIO): The open text file.
+        chunk_chars (int): The maximum length of a chunk.
+
+    Yields:
+        str: The chunks, in order.
+    """
+    pending = ""
+    while block := file.read(chunk_chars):
+        pending += block
+        while len(pending) >= chunk_chars:
+            cut = pending.rfind("\n", chunk_chars // 2, chunk_chars) + 1 or chunk_chars
+            yield pending[:cut]
+            pending = pending[cut:]
+    if pending:
+        yield pending
+
+
+class Ingestor:
+    """
+    Condenses long documents map-reduce style, with a digest cache.
+
+    Example:
+        >>> ingestor = Ingestor.from_config(plan.config)
+        >>> mvp = ingestor.read_file("mvp.txt", "MVP description")
+    """
+
+    def __init__(
+        self,
+        summarize: Summarizer,
+        max_chars: int = DEFAULT_MAX_CHARS,
+        chunk_chars: int = DEFAULT_CHUNK_CHARS,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        directory: str = DEFAULT_DIGEST_DIR,
+        fingerprint: str = "",
+        log: typing.Callable[[str], object] = print,
+    ) -> None:
+        """
+        Initialize the ingestor.
+
+        Args:
+            summarize (Summarizer): Condenses a chunk; called with the kind of
+            document and the chunk, possibly from several threads at once.
+            max_chars (int, optional): Length up to which a document is used as
+            it is, and the target length of a condensed one.
+            chunk_chars (int, optional): The maximum length of a chunk.
+            concurrency (int, optional): Maximum number of chunks condensed at
+            the same time.
+            directory (str, optional): The directory of the cached digests.
+            fingerprint (str, optional): Identifies the settings of summarize,
+            such as model and prompt; part of the cache key.
+            log (typing.Callable[[str], object], optional): Receives progress
+            messages.
+        """
+        self._summarize = summarize
+        self._max_chars = max_chars
+        self._chunk_chars = chunk_chars
+        self._concurrency = concurrency
+        self._directory = directory
+        self._fingerprint = json.dumps(
+            [fingerprint, max_chars, chunk_chars], ensure_ascii=False
+        )
+        self._log = log
+
+    @classmethod
+    def from_config(
+        cls,
+        config_file: typing.Mapping[str, typing.Any],
+        cache: CompletionCache | None = None,
+        backend: Backend | None = None,
+        directory: str = DEFAULT_DIGEST_DIR,
+        log: typing.Callable[[str], object] = print,
+    ) -> "Ingestor":
+        """
+        Create an ingestor from the "ingest" section of a configuration.
+
+        The chunks are condensed with the configuration's model and backend.
+
+        Args:
+            config_file (typing.Mapping[str, typing.Any]): The validated
+            configuration.
+            cache (CompletionCache | None, optional): Completion cache for the
+            calls.
+            backend (Backend | None, optional): The backend of the calls. Defaults
+            to the configuration's backend, limited by its "rate_limits" section.
+            directory (str, optional): The directory of the cached digests.
+            log (typing.Callable[[str], object], optional): Receives progress
+            messages.
+
+        Returns:
+            Ingestor: The ingestor.
+        """
+        options = config_file.get("ingest", {})
+        max_tokens = options.get("max_tokens", DEFAULT_MAX_TOKENS)
+        fingerprint = json.dumps(
+            [config_file["openai_model"], max_tokens, PROMPT], ensure_ascii=False
+        )
+        if backend is None:
+            backend = config.create_limited_backend(config_file)
+        return cls(
+            functools.partial(_summarize, config_file, max_tokens, cache, backend),
+            max_chars=options.get("max_chars", DEFAULT_MAX_CHARS),
+            chunk_chars=options.get("chunk_chars", DEFAULT_CHUNK_CHARS),
+            concurrency=options.get("concurrency", DEFAULT_CONCURRENCY),
+            directory=directory,
+            fingerprint=fingerprint,
+            log=log,
+        )
+
+    def read_file(self, path: str, kind: str) -> str:
+        """
+        Read a document, condensed if it is too long.
+
+        Args:
+            path (str): The UTF-8 text file.
+            kind (str): What the document is, e.g. "MVP description".
+
+        Returns:
+            str: The document, or its digest.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist.
+        """
+        return self._condense(
+            functools.partial(_read_chunks, path, self._chunk_chars), kind
+        )
+
+    def condense(self, text: str, kind: str) -> str:
+        """
+        Condense a document if it is too long.
+
+        Args:
+            text (str): The document.
+            kind (str): What the document is, e.g. "user story".
+
+        Returns:
+            str: The document, or its digest.
+        """
+        if len(text) <= self._max_chars:
+            return text
+        return self._condense(
+            lambda: iter_chunks(io.StringIO(text), self._chunk_chars), kind
+        )
+
+    def _condense(self, chunks: ChunkSource, kind: str) -> str:
+        """
+        Return the chunks joined, or the digest of the document they form.
+        """
+        size = count = 0
+        key = hashlib.sha256(f"{self._fingerprint}\0{kind}\0".encode("utf-8"))
+        for chunk in chunks():
+            size += len(chunk)
+            count += 1
+            key.update(chunk.encode("utf-8"))
+        if size <= self._max_chars:
+            return "".join(chunks())
+        path = os.path.join(self._directory, f"{key.hexdigest()}.txt")
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                digest = file.read()
+            self._log(f"Using the cached digest of the {kind}")
+            return digest
+        except FileNotFoundError:
+            pass
+        self._log(f"Condensing the {kind} ({size} characters in {count} chunks)...")
+        digest = self._reduce(chunks(), kind)
+        _write_file(path, digest)
+        self._log(f"Condensed the {kind} to {len(digest)} characters")
+        return digest
+
+    def _reduce(self, chunks: typing.Iterator[str], kind: str) -> str:
+        """
+        Condense the chunks in parallel and join them, in rounds until the
+        result fits max_chars or MAX_ROUNDS is reached.
+        """
+        for _ in range(MAX_ROUNDS):
+            text = "\n\n".join(part.strip() for part in self._map(chunks, kind))
+            if len(text) <= self._max_chars:
+                break
+            chunks = iter_chunks(io.StringIO(text), self._chunk_chars)
+        return text
+
+    def _map(self, chunks: typing.Iterator[str], kind: str) -> list[str]:
+        """
+        Condense the chunks, up to concurrency at a time, and return the parts
+        in order. Chunks are read only as calls finish, so a long document is
+        never held in memory as a whole.
+        """
+        parts: list[str] = []
+        running: collections.deque[futures.Future[str]] = collections.deque()
+        with futures.ThreadPoolExecutor(
+            max_workers=self._concurrency, thread_name_prefix="ingest"
+        ) as executor:
+            for chunk in chunks:
+                # A few chunks wait ahead, so no worker idles behind a slow call.
+                if len(running) >= 2 * self._concurrency:
+                    parts.append(running.popleft().result())
+                running.append(executor.submit(self._summarize, kind, chunk))
+            parts.extend(future.result() for future in running)
+        return parts
+
+
+def _read_chunks(path: str, chunk_chars: int) -> typing.Iterator[str]:
+    """
+    Read a UTF-8 text file in chunks, see iter_chunks.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        yield from iter_chunks(file, chunk_chars)
+
+
+def _summarize(
+    config_file: typing.Mapping[str, typing.Any],
+    max_tokens: int,
+    cache: CompletionCache | None,
+    backend: Backend,
+    kind: str,
+    chunk: str,
+) -> str:
+    """
+    Condense a chunk with a fresh agent of the configuration's model.
+    """
+    agent = Agent(
+        config_file["openai_model"],
+        max_tokens_per_call=max_tokens,
+        max_history=0,
+        cache=cache,
+        max_context_tokens=config_file.get("max_context_tokens"),
+        backend=backend,
+        name="Ingest",
+        temperature=0.0,
+    )
+    agent.append_message("system", PROMPT.format(kind=kind), False, pinned=True)
+    return agent.get_full_response(chunk)
+
+
+def _write_file(path: str, text: str) -> None:
+    """
+    Write a text file atomically, so concurrent readers never see a partial
+    digest.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temporary, path)
@@ -0,0 +1,153 @@
+"""
+This module contains the pipeline jobs of the web app, which execute in its
+worker processes, see the workers module.
+
+A job receives a workers.JobContext in place of the run: it reports on the
+context's event bus, checks its stop flag and sends its checkpoints to the
+server's run store. The module has no side effects on import, so spawned
+workers can import it without starting a second server. Settings such as
+LLM_BACKEND and COMPLETION_CACHE are read from the environment the workers
+inherit.
+
+Functions:
+    run_pipeline: Runs the pipeline, similar to main() in main.py.
+    resume_pipeline: Continues a previous run from its checkpoint.
+    fetch_task: Combines a submitted user story and MVP into the task.
+"""
+
+import functools
+import os
+import typing
+
+from cache import CompletionCache
+from checkpoint import Checkpoint
+import config
+import ingest
+import pipeline
+from workers import JobContext
+
+
+@functools.cache
+def completion_cache() -> CompletionCache | None:
+    """
+    Return the completion cache of the worker process, enabled by setting its
+    path in COMPLETION_CACHE.
+
+    Returns:
+        CompletionCache | None: The cache, or None if it is not enabled.
+    """
+    path = os.environ.get("COMPLETION_CACHE")
+    return CompletionCache(path) if path else None
+
+
+def resume_pipeline(
+    run: JobContext,
+    config_path: str,
+    previous_run_id: str,
+    checkpoint: Checkpoint,
+    api_key: str | None = None,
+) -> None:
+    """
+    Continue a previous run in a new run.
+
+    Args:
+        run (JobContext): The new run.
+        config_path (str): The configuration file of the previous run.
+        previous_run_id (str): The identifier of the previous run.
+        checkpoint (Checkpoint): The last checkpoint of the previous run.
+        api_key (str | None, optional): The OpenAI API key set in the server,
+        if any.
+    """
+    run.events.log(f"Resuming run {previous_run_id}")
+    run_pipeline(run, config_path, "", "", api_key, resume=checkpoint)
+
+
+def run_pipeline(
+    run: JobContext,
+    config_path: str,
+    user_story: str,
+    mvp_text: str,
+    api_key: str | None = None,
+    resume: Checkpoint | None = None,
+) -> None:
+    """
+    Run the pipeline, similar to main() in main.py.
+
+    Every agent step is checkpointed in the run store; with a checkpoint in
+    resume, the pipeline continues from there instead of reading the input.
+    The submitted texts are passed to the worker as they are, so no temporary
+    files are left behind by runs that are stopped while queued.
+
+    Args:
+        run (JobContext): The run.
+        config_path (str): The configuration file.
+        user_story (str): The submitted user story; ignored when resuming.
+        mvp_text (str): The submitted MVP description; ignored when resuming.
+        api_key (str | None, optional): The OpenAI API key set in the server,
+        if any.
+        resume (Checkpoint | None, optional): The checkpoint to continue from.
+    """
+    events = run.events
+
+    # Load configuration file and create agents
+    plan = config.load_plan(config_path)
+    # Allow running the web app against another backend, e.g. LLM_BACKEND=mock
+    if os.environ.get("LLM_BACKEND"):
+        plan = plan.with_backend({"type": os.environ["LLM_BACKEND"]})
+    backend = plan.config.get("backend", {})
+    if api_key and backend.get("type", "openai") == "openai":
+        # The key is one of the client options, so the run uses the client of
+        # its configured options with this key, see client.shared_client.
+        plan = plan.with_backend({**backend, "api_key": api_key})
+    events.log("Successfully read configuration file")
+
+    agents = config.create_coloragents(plan.config, completion_cache(), events=events)
+
+    # Fetch the initial user story
+    if resume is None:
+        ingestor = ingest.Ingestor.from_config(
+            plan.config, completion_cache(), log=events.log
+        )
+        task = fetch_task(user_story, mvp_text, ingestor, events.log)
+    else:
+        task = resume.user_story
+
+    # Iterate over each step for each agent
+    pipeline.run_phases(
+        plan,
+        agents,
+        task,
+        run.should_stop,
+        events,
+        checkpoint=run.save_checkpoint,
+        resume=resume,
+    )
+
+
+def fetch_task(
+    user_story: str,
+    mvp_text: str,
+    ingestor: ingest.Ingestor,
+    log: typing.Callable[[str], object] = print,
+) -> str:
+    """
+    Combine a submitted user story and MVP into the task, condensing long ones.
+
+    Args:
+        user_story (str): The user story.
+        mvp_text (str): The MVP description.
+        ingestor (ingest.Ingestor): Condenses long documents.
+        log (typing.Callable[[str], object], optional): Receives progress messages.
+
+    Returns:
+        str: The user story followed by the MVP.
+    """
+    log("Reading user story...")
+    task = ingestor.condense(user_story, "user story")
+    log("Successfully read user story")
+
+    log("Reading MVP...")
+    mvp = ingestor.condense(mvp_text, "MVP description")
+    log("Successfully read MVP")
+
+    return task + "\n\nMVP:\n" + mvp
@@ -1,25 +1,31 @@
 """
 Main module for the program.
+
+Only the modules needed to parse the arguments and validate the configuration
+are imported at startup; the pipeline, the agents and their HTTP clients are
+imported once the configuration is valid.
 """
 
+import argparse
 import json
+import os
 import sys
+from typing import TYPE_CHECKING, Any, Mapping
+import uuid
 
-import colorama
-
+from cache import CompletionCache
+import checkpoint
 import config
+from events import EventBus, FileSubscriber, Subscriber
 import readinput
 
+if TYPE_CHECKING:
+    import ingest
 
-TASK = """
-The user story is the following:
-{}
-"""
 
-
-def fetch_validated_config(config_path: str) -> dict:
+def fetch_validated_config(config_path: str) -> config.PipelinePlan:
     """
-    Load and validate the configuration from a specified file path.
+    Load, validate and compile the configuration from a specified file path.
     The function will print an error message and terminate the program if any issues
     are encountered.
 
@@ -27,12 +33,11 @@ def fetch_validated_config(config_path: str) -> dict:
         config_path (str): The path to the configuration file.
 
     Returns:
-        dict: The validated configuration dictionary.
+        config.PipelinePlan: The compiled configuration.
     """
     try:
         print("Reading configuration file...")
-        config_file = config.read_json(config_path)
-        config.validate(config_file)
+        plan = config.load_plan(config_path)
     except FileNotFoundError:
         print(f"Error: File '{config_path}' not found.")
         sys.exit(1)
@@ -46,22 +51,25 @@ def fetch_validated_config(config_path: str) -> dict:
         print(f"An error occurred while reading '{config_path}': {err}")
         sys.exit(1)
     print("Successfully read configuration file")
-    return config_file
+    return plan
 
 
 
 
 
 
-def fetch_task(input_path: str,mvp_path: str) -> str:
+def fetch_task(input_path: str,mvp_path: str,ingestor: "ingest.Ingestor") -> str:
     """
     Load a task from a given file path or, if not provided, request it from the user.
+    Long stories and MVP descriptions are condensed by the ingestor.
     The function will print an error message and terminate the program if any issues
     are encountered.
 
     Parameters:
         input_path (str): The path to the input file containing the task.
         If empty or None, the task will be requested from the user.
+        mvp_path (str): The path to the MVP file, appended to a task from the user.
+        ingestor (ingest.Ingestor): Condenses long documents.
 
     Returns:
         str: The loaded or inputted task.
@@ -69,7 +77,7 @@ def fetch_task(input_path: str,mvp_path: str) -> str:
     if input_path:
         try:
             print("Reading input file...")
-            task = config.read_file(input_path)
+            task = ingestor.read_file(input_path, "user story")
             print("Successfully read input file")
         except FileNotFoundError:
             print(f"Error: File '{input_path}' not found.")
@@ -78,56 +86,158 @@ def fetch_task(input_path: str,mvp_path: str) -> str:
             print(f"An error occurred while reading '{input_path}': {err}")
             sys.exit(1)
     else:
+        import colorama  # pylint: disable=import-outside-toplevel
+
         print(
             "Enter the User story. "
             f'When you\'re done, input "{colorama.Fore.BLUE}END{colorama.Fore.RESET}" '
             "or EOF (End Of File) to finish: "
         )
-        mvp = config.read_file(mvp_path)
-        task = readinput.read_lines()
+        mvp = ingestor.read_file(mvp_path, "MVP description")
+        task = ingestor.condense(readinput.read_lines(), "user story")
         task += "\n\nMVP:\n" + mvp
         print("Successfully read task")
     print()
     return task
 
+def override_backend(
+    config_file: Mapping[str, Any], backend_type: str
+) -> Mapping[str, Any]:
+    """
+    Return the configuration's backend section with its type replaced.
+    The backend options are kept only if the type does not change.
+
+    Parameters:
+        config_file (Mapping[str, Any]): The validated configuration.
+        backend_type (str): The backend type given on the command line.
+
+    Returns:
+        Mapping[str, Any]: The new "backend" section.
+    """
+    backend: Mapping[str, Any] = config_file.get("backend", {})
+    if backend.get("type", "openai") == backend_type:
+        return backend
+    return {"type": backend_type}
+
+
+def run_batch(
+    plan: config.PipelinePlan,
+    args: argparse.Namespace,
+    cache: CompletionCache | None,
+    subscribers: list[Subscriber],
+) -> None:
+    """
+    Process every user story of the --batch JSONL file in parallel.
+    The program exits with status 1 if any story fails.
+
+    Parameters:
+        plan (config.PipelinePlan): The compiled configuration.
+        args (argparse.Namespace): The parsed command line arguments.
+        cache (CompletionCache | None): Optional completion cache.
+        subscribers (list[Subscriber]): Receive the events of every story.
+    """
+    # pylint: disable=import-outside-toplevel
+    import asyncio
+
+    import batch
+    import ingest
+
+    output_path = args.output or os.path.splitext(args.batch)[0] + ".results.jsonl"
+    ingestor = ingest.Ingestor.from_config(plan.config, cache)
+    mvp = ingestor.read_file(args.mvp, "MVP description") if args.mvp else ""
+    failures = asyncio.run(
+        batch.run_batch(
+            plan,
+            args.batch,
+            output_path,
+            args.concurrency,
+            mvp,
+            cache,
+            subscribers,
+            ingestor,
+        )
+    )
+    if failures:
+        sys.exit(1)
+
+
+def load_checkpoint(path: str, run_id: str) -> checkpoint.Checkpoint:
+    """
+    Load the checkpoint of a run to resume.
+    The function will print an error message and terminate the program if there
+    is no valid checkpoint.
+
+    Parameters:
+        path (str): The checkpoint file of the run.
+        run_id (str): The run ID given with --resume.
+
+    Returns:
+        checkpoint.Checkpoint: The last checkpoint of the run.
+    """
+    try:
+        return checkpoint.load_file(path)
+    except FileNotFoundError:
+        print(f"Error: No checkpoint of run '{run_id}' in '{os.path.dirname(path)}'.")
+        sys.exit(1)
+    except (KeyError, TypeError, json.JSONDecodeError) as err:
+        print(f"Error: Invalid checkpoint '{path}': {err}")
+        sys.exit(1)
+
+
 def main() -> None:
     args = config.parse_argument()
 
     # Load configuration file and create agents
-    config_file = fetch_validated_config(args.config_file)
-    agents = config.create_coloragents(config_file)
-    agent_order = config_file["agent_order"]
-    iterations = config_file.get("iterations", 1)
-
-    # Fetch the initial user story
-    user_story = fetch_task(args.input,args.mvp)
-
-    # Iterate over each step for each agent
-    for iteration in range(iterations):
-        print(f"--- Phase {iteration + 1} ---")
-
-        for agent_name in agent_order:
-            # Find the agent configuration in the list
-            agent_config = next((agent for agent in config_file["agents"] if agent["name"] == agent_name), None)
-            if not agent_config:   
-                continue
-
-            task_info = agent_config["tasks"].get(str(iteration + 1))
-
-            if task_info:
-                if iteration == 0:
-                    task = TASK.format(task_info) + "\n\nUser Story:\n" + user_story
-                else:
-                    task = TASK.format(task_info) + user_story
-                print("-------------------------------")
-                print(f"Assigning task to {agent_name}: {task_info}")
-                agent = agents[agent_name]
-                agent.append_message("user", task, False)
-                response = agent.get_full_response()
-                user_story = response
-                # print(f"Response from {agent_name}: {response}")
-
-                
-main()
+    plan = fetch_validated_config(args.config_file)
+    if args.backend:
+        plan = plan.with_backend(override_backend(plan.config, args.backend))
+    cache = CompletionCache(args.cache_path) if args.cache else None
+    event_log = FileSubscriber(args.events) if args.events else None
+    subscribers: list[Subscriber] = [event_log] if event_log else []
+    try:
+        if args.batch:
+            run_batch(plan, args, cache, subscribers)
+            return
+        # Every agent step is checkpointed, so the run can be resumed
+        run_id = args.resume or uuid.uuid4().hex
+        try:
+            checkpoint_path = checkpoint.checkpoint_path(run_id, args.checkpoint_dir)
+        except ValueError as err:
+            print(f"Error: {err}")
+            sys.exit(1)
+        resume = load_checkpoint(checkpoint_path, run_id) if args.resume else None
+
+        # pylint: disable=import-outside-toplevel
+        import ingest
+        import pipeline
+        from printer import ConsoleSubscriber
+
+        events = EventBus(run_id, subscribers=[ConsoleSubscriber(), *subscribers])
+        agents = config.create_coloragents(plan.config, cache, events=events)
+
+        # Fetch the initial user story
+        if resume:
+            user_story = resume.user_story
+        else:
+            ingestor = ingest.Ingestor.from_config(plan.config, cache)
+            user_story = fetch_task(args.input,args.mvp,ingestor)
+        print(f"Run ID: {run_id} (continue an interrupted run with --resume {run_id})")
+
+        # Iterate over each step for each agent
+        pipeline.run_phases(
+            plan,
+            agents,
+            user_story,
+            events=events,
+            checkpoint=lambda state: checkpoint.save_file(checkpoint_path, state),
+            resume=resume,
+        )
+        # A completed run is not resumed
+        checkpoint.delete_file(checkpoint_path)
+    finally:
+        if event_log:
+            event_log.close()
 
 
+if __name__ == "__main__":
+    main()
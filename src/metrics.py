@@ -0,0 +1,436 @@
+"""
+This module records LLM call and pipeline metrics and renders them in the
+Prometheus text exposition format.
+
+The metrics live in a process-wide registry and are safe to update from
+several threads.
+
+Classes:
+    Counter: A monotonically increasing labelled value.
+    Histogram: Labelled observations counted into cumulative buckets.
+    Registry: A collection of metrics that renders them as text.
+    CallRecorder: Records the metrics of a single LLM call.
+    MetricsSubscriber: Records the metrics of a run from its events.
+
+Constants:
+    REGISTRY: The default registry, exposed by the web app at /metrics.
+"""
+
+import bisect
+import threading
+import typing
+
+from events import Event
+
+LabelValues = tuple[str, ...]
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 128000)
+
+
+class Counter:
+    """
+    A monotonically increasing value per label combination.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: LabelValues) -> None:
+        """
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            labels (LabelValues): The label names.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            amount (float, optional): The increment. Defaults to 1.
+            **labels (str): A value for every label name.
+        """
+        key = tuple(labels[label] for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        """
+        Render the counter in the text exposition format.
+
+        Returns:
+            list[str]: The lines of the metric.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Observations counted into cumulative buckets per label combination.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: LabelValues,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        """
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            labels (LabelValues): The label names.
+            buckets (tuple[float, ...], optional): Upper bounds of the buckets.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: bucket counts (plus +Inf), sum and count.
+        self._series: dict[LabelValues, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels (str): A value for every label name.
+        """
+        key = tuple(labels[label] for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._series.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+            )
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def render(self) -> list[str]:
+        """
+        Render the histogram in the text exposition format.
+
+        Returns:
+            list[str]: The lines of the metric.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, (counts, totals) in sorted(self._series.items()):
+                cumulative = 0
+                bounds = [*(str(bound) for bound in self.buckets), "+Inf"]
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    label_text = _labels(self.labels + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+                label_text = _labels(self.labels, key)
+                lines.append(f"{self.name}_sum{label_text} {totals[0]}")
+                lines.append(f"{self.name}_count{label_text} {int(totals[1])}")
+        return lines
+
+
+def _labels(names: LabelValues, values: LabelValues) -> str:
+    """
+    Format a label set, escaping the values.
+    """
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Registry:
+    """
+    A collection of metrics.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, documentation: str, labels: LabelValues) -> Counter:
+        """
+        Create and register a counter.
+        """
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: LabelValues,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """
+        Create and register a histogram.
+        """
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CALL_LABELS = ("agent", "model")
+
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending an LLM request to its first streamed chunk.",
+    CALL_LABELS,
+)
+CALL_DURATION = REGISTRY.histogram(
+    "llm_request_duration_seconds",
+    "Total duration of a streamed LLM call.",
+    CALL_LABELS,
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "llm_prompt_tokens", "Prompt tokens per LLM call.", CALL_LABELS, TOKEN_BUCKETS
+)
+COMPLETION_TOKENS = REGISTRY.histogram(
+    "llm_completion_tokens",
+    "Completion tokens per LLM call.",
+    CALL_LABELS,
+    TOKEN_BUCKETS,
+)
+CHUNKS = REGISTRY.counter(
+    "llm_chunks_total", "Streamed chunks received from LLM calls.", CALL_LABELS
+)
+ERRORS = REGISTRY.counter(
+    "llm_errors_total", "Failed LLM calls by error type.", CALL_LABELS + ("type",)
+)
+CACHE_HITS = REGISTRY.counter(
+    "llm_cache_hits_total", "LLM calls answered by the completion cache.", CALL_LABELS
+)
+PHASE_DURATION = REGISTRY.histogram(
+    "pipeline_phase_duration_seconds", "Duration of a pipeline phase.", ("phase",)
+)
+PHASE_TOKENS = REGISTRY.histogram(
+    "pipeline_phase_tokens",
+    "Prompt and completion tokens used by a pipeline phase.",
+    ("phase", "kind"),
+    TOKEN_BUCKETS,
+)
+RUN_DURATION = REGISTRY.histogram(
+    "pipeline_run_duration_seconds",
+    "Duration of a pipeline run by final status.",
+    ("status",),
+    LATENCY_BUCKETS + (600, 1200, 1800),
+)
+RUN_TOKENS = REGISTRY.histogram(
+    "pipeline_run_tokens",
+    "Prompt and completion tokens used by a pipeline run.",
+    ("kind",),
+    TOKEN_BUCKETS + (256000, 512000),
+)
+
+
+class CallRecorder:
+    """
+    Records the metrics of a single LLM call.
+
+    Durations are measured between the times passed in, e.g. the times of the
+    call's events, so they do not include delays in delivering the events.
+
+    Example:
+        >>> recorder = CallRecorder("PO", "gpt-4", 812, start=time.time())
+        >>> for chunk in stream:
+        ...     recorder.chunk(time.time())
+        >>> recorder.finish(420, time.time())
+    """
+
+    def __init__(
+        self, agent: str, model: str, prompt_tokens: int, start: float
+    ) -> None:
+        """
+        Start timing a call.
+
+        Args:
+            agent (str): The agent name.
+            model (str): The model name.
+            prompt_tokens (int): Tokens of the prompt sent.
+            start (float): When the call started, as a Unix timestamp.
+        """
+        self._labels = {"agent": agent, "model": model}
+        self._start = start
+        self._first_chunk = True
+        PROMPT_TOKENS.observe(prompt_tokens, **self._labels)
+
+    def chunk(self, now: float) -> None:
+        """
+        Record a streamed chunk; the first one sets the time to first token.
+
+        Args:
+            now (float): When the chunk was received, as a Unix timestamp.
+        """
+        if self._first_chunk:
+            self._first_chunk = False
+            TIME_TO_FIRST_TOKEN.observe(now - self._start, **self._labels)
+        CHUNKS.inc(1.0, **self._labels)
+
+    def finish(self, completion_tokens: int, now: float) -> None:
+        """
+        Record a successful call.
+
+        Args:
+            completion_tokens (int): Tokens of the response.
+            now (float): When the call ended, as a Unix timestamp.
+        """
+        CALL_DURATION.observe(now - self._start, **self._labels)
+        COMPLETION_TOKENS.observe(completion_tokens, **self._labels)
+
+    def error(self, error_type: str, now: float) -> None:
+        """
+        Record a failed call.
+
+        Args:
+            error_type (str): The class name of the error that ended the call.
+            now (float): When the call ended, as a Unix timestamp.
+        """
+        CALL_DURATION.observe(now - self._start, **self._labels)
+        ERRORS.inc(1.0, type=error_type, **self._labels)
+
+
+def record_cache_hit(agent: str, model: str) -> None:
+    """
+    Record a call answered by the completion cache.
+    """
+    CACHE_HITS.inc(agent=agent, model=model)
+
+
+def observe_tokens(
+    histogram: Histogram, usage: typing.Mapping[str, int], **labels: str
+) -> None:
+    """
+    Observe the prompt and completion tokens of a usage summary.
+
+    Args:
+        histogram (Histogram): PHASE_TOKENS or RUN_TOKENS.
+        usage (typing.Mapping[str, int]): Usage with "prompt_tokens" and
+        "completion_tokens".
+        **labels (str): Further label values.
+    """
+    for kind in ("prompt", "completion"):
+        histogram.observe(usage[f"{kind}_tokens"], kind=kind, **labels)
+
+
+class MetricsSubscriber:
+    """
+    Records the metrics of a run from its pipeline events: every agent call,
+    every phase and the run as a whole.
+
+    Durations are taken from the times of the events, which are stamped when
+    they are emitted. Calls are told apart by their run, phase and agent, since
+    an agent has at most one task per phase, so a subscriber can record
+    concurrent agents and the runs of a batch.
+
+    Phase and run token usage are summed from the agent_end events of API calls;
+    responses replayed from the completion cache count as cache hits only.
+
+    Example:
+        >>> bus = EventBus(subscribers=[MetricsSubscriber()])
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[tuple[str | None, int | None, str | None], CallRecorder] = {}
+        self._phase_starts: dict[tuple[str | None, int | None], float] = {}
+        self._run_starts: dict[str | None, float] = {}
+        self._phase_usage: dict[tuple[str | None, int | None], dict[str, int]] = {}
+        self._run_usage: dict[str | None, dict[str, int]] = {}
+
+    def __call__(self, event: Event) -> None:
+        # Agents of a phase may report concurrently.
+        with self._lock:
+            self._record(event)
+
+    def _record(self, event: Event) -> None:
+        """
+        Record the metrics of an event.
+        """
+        call = (event.run_id, event.phase, event.agent)
+        phase = (event.run_id, event.phase)
+        if event.type == "agent_start":
+            if event.data.get("cached"):
+                record_cache_hit(event.agent or "", event.data.get("model", ""))
+            else:
+                self._calls[call] = CallRecorder(
+                    event.agent or "",
+                    event.data.get("model", ""),
+                    event.data.get("prompt_tokens", 0),
+                    event.time,
+                )
+        elif event.type == "token" and call in self._calls:
+            self._calls[call].chunk(event.time)
+        elif event.type == "agent_end" and call in self._calls:
+            self._calls.pop(call).finish(event.data["completion_tokens"], event.time)
+            for usage in (
+                self._phase_usage.get(phase),
+                self._run_usage.get(event.run_id),
+            ):
+                if usage is not None:
+                    for kind in usage:
+                        usage[kind] += event.data[kind]
+        elif event.type == "error" and call in self._calls:
+            self._calls.pop(call).error(event.data.get("type", "Exception"), event.time)
+        elif event.type == "phase_start":
+            self._phase_starts[phase] = event.time
+            self._phase_usage[phase] = _empty_usage()
+        elif event.type == "phase_end" and phase in self._phase_starts:
+            PHASE_DURATION.observe(
+                event.time - self._phase_starts.pop(phase), phase=str(event.phase)
+            )
+            observe_tokens(
+                PHASE_TOKENS, self._phase_usage.pop(phase), phase=str(event.phase)
+            )
+        elif event.type == "run_start":
+            self._run_starts[event.run_id] = event.time
+            self._run_usage[event.run_id] = _empty_usage()
+        elif event.type == "run_end" and event.run_id in self._run_starts:
+            RUN_DURATION.observe(
+                event.time - self._run_starts.pop(event.run_id),
+                status=event.data["status"],
+            )
+            observe_tokens(RUN_TOKENS, self._run_usage.pop(event.run_id))
+            # Phases a failed or stopped run did not end
+            for key in [key for key in self._phase_starts if key[0] == event.run_id]:
+                del self._phase_starts[key]
+                self._phase_usage.pop(key, None)
+
+
+def _empty_usage() -> dict[str, int]:
+    """
+    Return the usage of a phase or run before its first call.
+    """
+    return {"prompt_tokens": 0, "completion_tokens": 0}
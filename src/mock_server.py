@@ -0,0 +1,218 @@
+"""
+A local stand-in for the OpenAI chat completions API.
+
+The server streams the responses of a MockBackend in the OpenAI wire format, so
+the real OpenAIBackend (and anything else speaking the OpenAI API) can run
+against it offline, in CI or under load tests, without API spend.
+
+Usage:
+    python src/mock_server.py --port 8001 --ttft 0.5 --tokens-per-second 40
+
+    Then point a configuration at it:
+        "backend": {"type": "openai", "api_base": "http://127.0.0.1:8001/v1",
+                    "api_key": "mock"}
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import time
+import typing
+import uuid
+
+from backends import MockBackend
+
+COMPLETIONS_PATHS = ("/v1/chat/completions", "/chat/completions")
+
+
+def make_handler(backend: MockBackend) -> type[BaseHTTPRequestHandler]:
+    """
+    Create a request handler class serving completions from a mock backend.
+
+    Args:
+        backend (MockBackend): The backend rendering the responses.
+
+    Returns:
+        type[BaseHTTPRequestHandler]: The handler class.
+    """
+
+    class CompletionHandler(BaseHTTPRequestHandler):
+        """
+        Serves POST requests to the chat completions endpoint.
+        """
+
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            """
+            Answer a chat completion request, streamed or not.
+            """
+            if self.path not in COMPLETIONS_PATHS:
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError as err:
+                self._send_json(400, {"error": {"message": str(err)}})
+                return
+            stream = request.pop("stream", False)
+            completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+            if stream:
+                self._stream(request, completion_id)
+            else:
+                content = "".join(backend.stream(request))
+                self._send_json(
+                    200,
+                    _completion(
+                        request,
+                        completion_id,
+                        "chat.completion",
+                        {"message": {"role": "assistant", "content": content}},
+                    ),
+                )
+
+        def _stream(self, request: dict[str, typing.Any], completion_id: str) -> None:
+            """
+            Stream the response as server-sent events.
+            """
+            # Chunked transfer encoding keeps the connection alive after the
+            # stream, as the OpenAI API does.
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                self._send_event(request, completion_id, {"role": "assistant"})
+                for piece in backend.stream(request):
+                    self._send_event(request, completion_id, {"content": piece})
+                self._send_event(request, completion_id, {}, finish_reason="stop")
+                self._send_chunk(b"data: [DONE]\n\n")
+                self._send_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client closed the stream, e.g. after a cancellation.
+                self.close_connection = True
+
+        def _send_event(
+            self,
+            request: dict[str, typing.Any],
+            completion_id: str,
+            delta: dict[str, str],
+            finish_reason: str | None = None,
+        ) -> None:
+            """
+            Write a single chunk event.
+            """
+            chunk = _completion(
+                request,
+                completion_id,
+                "chat.completion.chunk",
+                {"delta": delta, "finish_reason": finish_reason},
+            )
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        def _send_chunk(self, data: bytes) -> None:
+            """
+            Write a chunk of the chunked response body; an empty one ends it.
+            """
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _send_json(self, status: int, body: dict[str, typing.Any]) -> None:
+            """
+            Write a JSON response.
+            """
+            encoded = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def log_message(self, format: str, *args: typing.Any) -> None:
+            """
+            Keep the console quiet under load.
+            """
+            # pylint: disable=redefined-builtin
+
+    return CompletionHandler
+
+
+def _completion(
+    request: dict[str, typing.Any],
+    completion_id: str,
+    obj: str,
+    choice: dict[str, typing.Any],
+) -> dict[str, typing.Any]:
+    """
+    Build a completion or completion chunk object.
+    """
+    return {
+        "id": completion_id,
+        "object": obj,
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{"index": 0, **choice}],
+    }
+
+
+def create_server(
+    host: str = "127.0.0.1", port: int = 8001, backend: MockBackend | None = None
+) -> ThreadingHTTPServer:
+    """
+    Create the mock server; call serve_forever() on it to start serving.
+
+    Args:
+        host (str, optional): The interface to listen on.
+        port (int, optional): The port to listen on; 0 picks a free port.
+        backend (MockBackend | None, optional): The backend rendering the
+        responses. Defaults to a MockBackend without delays.
+
+    Returns:
+        ThreadingHTTPServer: The server.
+    """
+    handler = make_handler(backend if backend is not None else MockBackend())
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    """
+    Run the mock server from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--ttft", type=float, default=0.0, help="Seconds before the first token."
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=0.0,
+        help="Streaming rate; 0 streams without delay.",
+    )
+    parser.add_argument(
+        "--response-tokens", type=int, default=200, help="Filler words per response."
+    )
+    parser.add_argument("--template", default=MockBackend.DEFAULT_TEMPLATE)
+    args = parser.parse_args()
+
+    backend = MockBackend(
+        template=args.template,
+        response_tokens=args.response_tokens,
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+    )
+    server = create_server(args.host, args.port, backend)
+    print(f"Mock OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,698 @@
+"""
+This module contains the phase loop that drives the agents through the
+configured iterations, in a synchronous and an asyncio flavour. The loop reports
+its progress as events, see the events module, and can take a checkpoint after
+every agent step to resume an interrupted run, see the checkpoint module. Both
+flavours share one loop and differ only in how the calls of a phase are made:
+on a thread pool or as asyncio tasks.
+
+Within a phase, the agent tasks run in the order of their dependencies: by
+default each agent works on the response of the previous one, while the
+"schedule" section of the configuration lets independent tasks run concurrently
+and merges their responses for the agents that depend on them. The loop ends
+early once no agent has a task left or the user story has converged.
+
+With a budget in the configuration, see the budget module, every call gets the
+max_tokens the budget can afford. A task the budget cannot pay for is skipped
+and its input passed on, and once the run budget would not cover another phase
+and the final one, the loop skips to the final phase, so a run that runs short
+still ends with a final document.
+
+Functions:
+    merge_outputs: Merges the responses of several agents into one input.
+    compact_agents: Replaces the finished phase turns of agents with a digest.
+    restore_checkpoint: Restores the agents of a run from a checkpoint.
+    run_phases: Runs the phase loop with synchronous agents.
+    run_phases_async: Runs the phase loop with asynchronous agents.
+"""
+
+import asyncio
+from concurrent import futures
+import functools
+import typing
+
+from agent import Agent, AsyncAgent
+from budget import Budget, BudgetExhausted
+from cancellation import CancellationToken, Cancelled
+from checkpoint import Checkpoint
+import compaction
+from config import Phase, PipelinePlan, as_plan
+import convergence
+from events import EventBus
+from printer import ConsoleSubscriber
+
+TASK_SEPARATOR = "-------------------------------"
+
+CheckpointCallback = typing.Callable[[Checkpoint], None]
+
+MERGE_SECTION = "### {} ###\n{}"
+
+
+def merge_outputs(
+    agent_names: typing.Sequence[str], outputs: dict[str, str], user_story: str
+) -> str:
+    """
+    Merge the responses of several agents into the input of the next step.
+
+    Args:
+        agent_names (typing.Sequence[str]): The agents whose responses are merged.
+        outputs (dict[str, str]): The responses of the phase, keyed by agent.
+        user_story (str): The input of the phase, used if there are no agents.
+
+    Returns:
+        str: The user story, a single response or the responses under a
+        heading per agent.
+    """
+    if not agent_names:
+        return user_story
+    if len(agent_names) == 1:
+        return outputs[agent_names[0]]
+    return "\n\n".join(
+        MERGE_SECTION.format(agent_name, outputs[agent_name])
+        for agent_name in agent_names
+    )
+
+
+def compact_agents(
+    config_file: typing.Mapping[str, typing.Any],
+    agents: typing.Mapping[str, Agent | AsyncAgent],
+    turns: list[tuple[str, str, str]],
+    iteration: int,
+) -> None:
+    """
+    Replace the turns of a finished phase with a digest in each agent.
+
+    Compaction is enabled by setting "compaction" to true in the configuration;
+    "compaction_excerpt_chars" sets the length of the response excerpts. It is
+    off by default, as it changes the prompts of existing configurations.
+
+    Args:
+        config_file (typing.Mapping[str, typing.Any]): The validated configuration.
+        agents (typing.Mapping[str, Agent | AsyncAgent]): The agents, keyed by name.
+        turns (list[tuple[str, str, str]]): The agent name, task description and
+        response of every turn of the phase.
+        iteration (int): The zero-based iteration index of the phase.
+    """
+    if not config_file.get("compaction", False):
+        return
+    max_chars = config_file.get(
+        "compaction_excerpt_chars", compaction.DEFAULT_EXCERPT_CHARS
+    )
+    for agent_name, task_info, response in turns:
+        agents[agent_name].compact(
+            compaction.digest_entry(iteration + 1, task_info, response, max_chars)
+        )
+
+
+def restore_checkpoint(
+    agents: typing.Mapping[str, Agent | AsyncAgent], resume: Checkpoint
+) -> None:
+    """
+    Restore the state of every agent from a checkpoint.
+
+    Args:
+        agents (typing.Mapping[str, Agent | AsyncAgent]): The agents, keyed by name,
+        freshly created from the configuration of the interrupted run.
+        resume (Checkpoint): The checkpoint.
+
+    Raises:
+        ValueError: If the checkpoint does not match the agents.
+    """
+    if set(resume.agents) != set(agents):
+        raise ValueError(
+            "The checkpoint does not match the configured agents: "
+            f"{sorted(resume.agents)} != {sorted(agents)}"
+        )
+    for agent_name, state in resume.agents.items():
+        agents[agent_name].restore(state)
+
+
+class _Phase:
+    """
+    The scheduling state of one phase: which agent tasks are done, which may
+    start and what each of them receives.
+
+    The latest idle state of every agent is kept for checkpoints, so a
+    checkpoint taken while other agents are still streaming holds them as they
+    were before their call.
+
+    The phase only decides which calls to make and records how they end;
+    _run_phase and _run_phase_async make the calls, on threads or as asyncio
+    tasks.
+    """
+
+    def __init__(
+        self,
+        plan: Phase,
+        agents: typing.Mapping[str, Agent | AsyncAgent],
+        user_story: str,
+        turns: list[tuple[str, str, str]],
+        events: EventBus,
+        checkpoint: CheckpointCallback | None,
+        budget: Budget | None = None,
+        cancel: CancellationToken | None = None,
+    ) -> None:
+        self.plan = plan
+        self.iteration = plan.iteration
+        self.user_story = user_story
+        self.turns = list(turns)
+        self.outputs = {agent_name: response for agent_name, _, response in turns}
+        self.started: set[str] = set(self.outputs)
+        self._agents = agents
+        self._events = events
+        self._checkpoint = checkpoint
+        self._budget = budget
+        self._states = {name: agent.state() for name, agent in agents.items()}
+        self.cancel = cancel
+        # The agents whose calls the cancellation cut off
+        self.cut_off: list[str] = []
+        # The first error of a call; no further call starts after it
+        self.error: BaseException | None = None
+
+    def ready(self) -> list[str]:
+        """
+        Return the agents whose dependencies are done, in configuration order.
+        """
+        return [
+            agent_name
+            for agent_name, task in self.plan.tasks.items()
+            if agent_name not in self.started
+            and all(dependency in self.outputs for dependency in task.dependencies)
+        ]
+
+    def start(self, agent_name: str) -> tuple[Agent | AsyncAgent, int | None] | None:
+        """
+        Give an agent its task and return it, ready for its call, with the
+        max_tokens of the call. Returns None if the budget cannot pay for the
+        call; the task is skipped and recorded with its input as its output.
+        """
+        task = self.plan.tasks[agent_name]
+        self.started.add(agent_name)
+        self._events.log(TASK_SEPARATOR)
+        agent = self._agents[agent_name]
+        task_input = merge_outputs(task.dependencies, self.outputs, self.user_story)
+        max_tokens = None
+        if self._budget is not None:
+            try:
+                max_tokens, limit = self._budget.reserve(
+                    agent_name,
+                    agent.prompt_tokens(task.prompt + task_input),
+                    task.task_info,
+                )
+            except BudgetExhausted as err:
+                self._events.log(f"{err}; skipping the task of {agent_name}.")
+                # Recorded as a step, so a resumed run does not decide again
+                self.complete(agent_name, task_input)
+                return None
+            if limit is not None:
+                self._events.log(
+                    f"Limiting the response of {agent_name} to {max_tokens} "
+                    f"tokens; {limit}."
+                )
+        self._events.log(f"Assigning task to {agent_name}: {task.task_info}")
+        agent.append_message("user", task.prompt + task_input, False)
+        return agent, max_tokens
+
+    def calls(self) -> list[tuple[str, Agent | AsyncAgent, int | None]]:
+        """
+        Start the tasks that are ready and return their calls to make: the
+        agent name, the agent and the max_tokens of the call. Returns an empty
+        list once the phase is cancelled or a call has failed, or if no task is
+        ready.
+        """
+        while True:
+            ready = self.ready()
+            if not ready or self.error is not None:
+                return []
+            if self.cancel is not None and self.cancel.cancelled:
+                return []
+            calls = []
+            for agent_name in ready:
+                call = self.start(agent_name)
+                if call is not None:
+                    calls.append((agent_name, *call))
+            if calls:
+                return calls
+            # Every ready task was skipped; tasks depending on them may be
+            # ready now.
+
+    def finish(self, agent_name: str, result: typing.Callable[[], str]) -> None:
+        """
+        Record the end of an agent's call: its response, its cut-off or its
+        error, and settle it with the budget.
+
+        Args:
+            agent_name (str): The name of the agent.
+            result (typing.Callable[[], str]): Returns the response of the call
+            or raises its error.
+        """
+        try:
+            self.complete(agent_name, result())
+        except Cancelled:
+            self.cut_off.append(agent_name)
+        except Exception as err:  # pylint: disable=broad-except
+            self.error = self.error or err
+        finally:
+            if self._budget is not None:
+                self._budget.settle(agent_name, self._agents[agent_name].usage)
+
+    def complete(self, agent_name: str, response: str) -> None:
+        """
+        Record the response of an agent and take a checkpoint.
+        """
+        self.outputs[agent_name] = response
+        self.turns.append((agent_name, self.plan.tasks[agent_name].task_info, response))
+        self._states[agent_name] = self._agents[agent_name].state()
+        if self._checkpoint is not None:
+            self._checkpoint(
+                Checkpoint(
+                    phase=self.iteration,
+                    step=len(self.turns),
+                    user_story=self.user_story,
+                    turns=list(self.turns),
+                    agents=dict(self._states),
+                )
+            )
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether every agent task of the phase is done.
+        """
+        return len(self.outputs) == len(self.plan.tasks)
+
+    @property
+    def latest(self) -> str:
+        """
+        The latest response of the phase, or its input if there is none yet.
+        """
+        return self.turns[-1][2] if self.turns else self.user_story
+
+    def output(self) -> str:
+        """
+        The user story the phase passes on: the merged outputs of the agents no
+        other agent of the phase depends on.
+        """
+        required = {
+            dependency
+            for task in self.plan.tasks.values()
+            for dependency in task.dependencies
+        }
+        final = [
+            agent_name for agent_name in self.plan.tasks if agent_name not in required
+        ]
+        return merge_outputs(final, self.outputs, self.user_story)
+
+
+def _has_remaining_work(plan: PipelinePlan, phase: _Phase, events: EventBus) -> bool:
+    """
+    Check whether the phases after a finished one are worth running.
+
+    They are skipped when no agent has a task in any of them, or when the
+    phase changed the user story less than the "convergence_threshold" of the
+    configuration allows.
+    """
+    if phase.plan is plan.phases[-1]:
+        if phase.iteration + 1 < plan.iterations:
+            events.log(
+                f"No agent has a task after phase {phase.iteration + 1}; "
+                "skipping the remaining phases."
+            )
+        return False
+    threshold = plan.config.get("convergence_threshold")
+    if (
+        threshold is not None
+        and phase.turns
+        and convergence.has_converged(phase.user_story, phase.output(), threshold)
+    ):
+        events.log(
+            f"The user story converged in phase {phase.iteration + 1}; "
+            "skipping the remaining phases."
+        )
+        return False
+    return True
+
+
+def _take_checkpoint(
+    checkpoint: CheckpointCallback | None,
+    agents: typing.Mapping[str, Agent | AsyncAgent],
+    phase: int,
+    user_story: str,
+) -> None:
+    """
+    Pass the state at the start of a phase to the checkpoint callback, if any.
+    """
+    if checkpoint is None:
+        return
+    checkpoint(
+        Checkpoint(
+            phase=phase,
+            step=0,
+            user_story=user_story,
+            turns=[],
+            agents={name: agent.state() for name, agent in agents.items()},
+        )
+    )
+
+
+def _open_budget(
+    plan: PipelinePlan, agents: typing.Mapping[str, Agent | AsyncAgent]
+) -> Budget | None:
+    """
+    Create the budget of a run, if the configuration has one, charged with what
+    the agents have spent before a resumed checkpoint.
+    """
+    return Budget.from_config(
+        plan.config, {name: agent.usage for name, agent in agents.items()}
+    )
+
+
+def _close_budget(budget: Budget | None, events: EventBus) -> None:
+    """
+    Report the spending of a run, if it has a budget.
+    """
+    if budget is not None:
+        events.log(budget.summary())
+
+
+def _over_budget(
+    plan: PipelinePlan, phase: Phase, budget: Budget | None, events: EventBus
+) -> bool:
+    """
+    Check whether a phase is skipped because the run budget would not cover it
+    and the final phase. The final phase is never skipped.
+    """
+    if budget is None or phase is plan.phases[-1] or budget.affords(2):
+        return False
+    events.log(
+        f"The run budget would not cover phase {phase.number} and the final "
+        f"phase; skipping phase {phase.number}."
+    )
+    return True
+
+
+def _start(
+    agents: typing.Mapping[str, Agent | AsyncAgent],
+    user_story: str,
+    resume: Checkpoint | None,
+    events: EventBus,
+) -> tuple[int, str, list[tuple[str, str, str]]]:
+    """
+    Determine where the phase loop starts, restoring the agents when resuming.
+
+    Returns:
+        tuple[int, str, list[tuple[str, str, str]]]: The zero-based phase to
+        start at, its input user story and its completed turns.
+    """
+    if resume is None:
+        return 0, user_story, []
+    restore_checkpoint(agents, resume)
+    events.log(f"Resuming at phase {resume.phase + 1}, step {resume.step + 1}")
+    return resume.phase, resume.user_story, list(resume.turns)
+
+
+def _run_phase(phase: _Phase) -> None:
+    """
+    Make the agent calls of a phase, independent calls on concurrent threads.
+
+    A single call with nothing else running is made on the current thread, so
+    a linear phase runs exactly as a plain loop would. Once the phase is
+    cancelled or a call fails, no further call starts; running calls are
+    completed and recorded before the function returns or raises, except for
+    calls the cancellation cuts off.
+    """
+    running: dict[futures.Future[str], str] = {}
+    with futures.ThreadPoolExecutor(
+        max_workers=len(phase.plan.tasks), thread_name_prefix="agent"
+    ) as executor:
+        while True:
+            calls = typing.cast(list[tuple[str, Agent, int | None]], phase.calls())
+            if len(calls) == 1 and not running:
+                agent_name, agent, max_tokens = calls[0]
+                phase.finish(
+                    agent_name,
+                    functools.partial(
+                        agent.get_full_response,
+                        cancel=phase.cancel,
+                        max_tokens=max_tokens,
+                        phase=phase.plan.number,
+                    ),
+                )
+                continue
+            for agent_name, agent, max_tokens in calls:
+                future = executor.submit(
+                    agent.get_full_response,
+                    cancel=phase.cancel,
+                    max_tokens=max_tokens,
+                    phase=phase.plan.number,
+                )
+                running[future] = agent_name
+            if not running:
+                break
+            finished, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in finished:
+                phase.finish(running.pop(future), future.result)
+    if phase.error is not None:
+        raise phase.error
+
+
+async def _run_phase_async(phase: _Phase) -> None:
+    """
+    Asynchronous counterpart of _run_phase; independent calls run as concurrent
+    asyncio tasks.
+    """
+    running: dict[asyncio.Task[str], str] = {}
+    try:
+        while True:
+            calls = typing.cast(list[tuple[str, AsyncAgent, int | None]], phase.calls())
+            for agent_name, agent, max_tokens in calls:
+                task = asyncio.ensure_future(
+                    agent.get_full_response(
+                        cancel=phase.cancel,
+                        max_tokens=max_tokens,
+                        phase=phase.plan.number,
+                    )
+                )
+                running[task] = agent_name
+            if not running:
+                break
+            finished, _ = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in finished:
+                phase.finish(running.pop(task), task.result)
+    finally:
+        for task in running:
+            task.cancel()
+    if phase.error is not None:
+        raise phase.error
+
+
+def _cancellation(
+    should_stop: typing.Callable[[], bool] | None,
+) -> CancellationToken | None:
+    """
+    Return the token of a should_stop argument, see run_phases.
+    """
+    if should_stop is None or isinstance(should_stop, CancellationToken):
+        return should_stop
+    return CancellationToken(should_stop)
+
+
+def _phase_loop(
+    plan: PipelinePlan,
+    agents: typing.Mapping[str, Agent | AsyncAgent],
+    user_story: str,
+    cancel: CancellationToken | None,
+    events: EventBus,
+    checkpoint: CheckpointCallback | None,
+    resume: Checkpoint | None,
+) -> typing.Generator[_Phase, None, str]:
+    """
+    The phase loop shared by run_phases and run_phases_async.
+
+    Yields every phase to run; the caller makes its calls, with _run_phase or
+    _run_phase_async, and resumes the loop, or throws the error of the phase
+    into it.
+
+    Returns:
+        str: The user story produced by the last phase.
+    """
+    events.emit("run_start", data={"iterations": plan.iterations})
+    status = "error"
+    # Where a stopped run stopped, reported in its run_end event
+    stopped: dict[str, typing.Any] = {}
+    budget: Budget | None = None
+    try:
+        start_phase, user_story, turns = _start(agents, user_story, resume, events)
+        budget = _open_budget(plan, agents)
+        for phase_plan in plan.phases:
+            if phase_plan.iteration < start_phase:
+                continue
+            if cancel is not None and cancel.cancelled:
+                events.log("Processing stopped by user request.")
+                status = "stopped"
+                return user_story
+            if _over_budget(plan, phase_plan, budget, events):
+                continue
+            events.emit("phase_start", phase=phase_plan.number)
+            if budget is not None:
+                budget.start_phase()
+            phase = _Phase(
+                phase_plan,
+                agents,
+                user_story,
+                turns if phase_plan.iteration == start_phase else [],
+                events,
+                checkpoint,
+                budget,
+                cancel,
+            )
+            try:
+                yield phase
+            finally:
+                user_story = phase.latest
+            if not phase.done:
+                stopped = {"phase": phase_plan.number, "cut_off": phase.cut_off}
+                events.log(
+                    f"Processing stopped by user request in phase {phase_plan.number}"
+                    + (
+                        f"; cut off: {', '.join(phase.cut_off)}."
+                        if phase.cut_off
+                        else "."
+                    )
+                )
+                status = "stopped"
+                return user_story
+            user_story = phase.output()
+            if budget is not None:
+                budget.end_phase()
+
+            events.emit("phase_end", phase=phase_plan.number)
+            if not _has_remaining_work(plan, phase, events):
+                _take_checkpoint(checkpoint, agents, plan.iterations, user_story)
+                break
+            compact_agents(plan.config, agents, phase.turns, phase_plan.iteration)
+            _take_checkpoint(checkpoint, agents, phase_plan.number, user_story)
+        status = "complete"
+        return user_story
+    finally:
+        _close_budget(budget, events)
+        events.emit("run_end", text=user_story, data={"status": status, **stopped})
+
+
+def run_phases(
+    config_file: dict[str, typing.Any] | PipelinePlan,
+    agents: typing.Mapping[str, Agent],
+    user_story: str,
+    should_stop: typing.Callable[[], bool] | None = None,
+    events: EventBus | None = None,
+    checkpoint: CheckpointCallback | None = None,
+    resume: Checkpoint | None = None,
+) -> str:
+    """
+    Run every agent task of every phase, feeding each response to the agents
+    that depend on it.
+
+    Without a "schedule" for a phase, every agent depends on the previous one in
+    the agent order. Agent tasks whose dependencies are done run concurrently.
+    Phases in which no agent has a task are skipped.
+
+    Args:
+        config_file (dict[str, typing.Any] | PipelinePlan): The validated
+        configuration or its compiled plan, see config.compile_plan.
+        agents (typing.Mapping[str, Agent]): The agents, keyed by name.
+        user_story (str): The initial user story; ignored when resuming.
+        should_stop (typing.Callable[[], bool] | None, optional): Polled before
+        every phase and agent task and on every streamed chunk; when it returns
+        True, running calls are cut off and the loop ends early. May be a
+        CancellationToken.
+        events (EventBus | None, optional): The bus the run, phase and progress
+        events are emitted on. Defaults to a bus printing them to the console.
+        checkpoint (CheckpointCallback | None, optional): Receives a checkpoint
+        after every agent step and after every phase's compaction.
+        resume (Checkpoint | None, optional): Continue an interrupted run from
+        this checkpoint instead of starting at the first phase.
+
+    Returns:
+        str: The user story produced by the last phase.
+
+    Raises:
+        ValueError: If the resume checkpoint does not match the agents.
+    """
+    loop = _phase_loop(
+        as_plan(config_file),
+        agents,
+        user_story,
+        _cancellation(should_stop),
+        events or EventBus(subscribers=[ConsoleSubscriber()]),
+        checkpoint,
+        resume,
+    )
+    try:
+        phase = next(loop)
+        while True:
+            try:
+                _run_phase(phase)
+            except BaseException as err:  # pylint: disable=broad-except
+                phase = loop.throw(err)
+            else:
+                phase = next(loop)
+    except StopIteration as stop:
+        return typing.cast(str, stop.value)
+
+
+async def run_phases_async(
+    config_file: dict[str, typing.Any] | PipelinePlan,
+    agents: typing.Mapping[str, AsyncAgent],
+    user_story: str,
+    should_stop: typing.Callable[[], bool] | None = None,
+    events: EventBus | None = None,
+    checkpoint: CheckpointCallback | None = None,
+    resume: Checkpoint | None = None,
+) -> str:
+    """
+    Asynchronous counterpart of run_phases for use on an event loop.
+
+    Args:
+        config_file (dict[str, typing.Any] | PipelinePlan): The validated
+        configuration or its compiled plan, see config.compile_plan.
+        agents (typing.Mapping[str, AsyncAgent]): The agents, keyed by name.
+        user_story (str): The initial user story; ignored when resuming.
+        should_stop (typing.Callable[[], bool] | None, optional): Polled before
+        every phase and agent task and on every streamed chunk; when it returns
+        True, running calls are cut off and the loop ends early. May be a
+        CancellationToken.
+        events (EventBus | None, optional): The bus the run, phase and progress
+        events are emitted on. Defaults to a bus printing them to the console.
+        checkpoint (CheckpointCallback | None, optional): Receives a checkpoint
+        after every agent step and after every phase's compaction.
+        resume (Checkpoint | None, optional): Continue an interrupted run from
+        this checkpoint instead of starting at the first phase.
+
+    Returns:
+        str: The user story produced by the last phase.
+
+    Raises:
+        ValueError: If the resume checkpoint does not match the agents.
+    """
+    loop = _phase_loop(
+        as_plan(config_file),
+        agents,
+        user_story,
+        _cancellation(should_stop),
+        events or EventBus(subscribers=[ConsoleSubscriber()]),
+        checkpoint,
+        resume,
+    )
+    try:
+        phase = next(loop)
+        while True:
+            try:
+                await _run_phase_async(phase)
+            except BaseException as err:  # pylint: disable=broad-except
+                phase = loop.throw(err)
+            else:
+                phase = next(loop)
+    except StopIteration as stop:
+        return typing.cast(str, stop.value)
@@ -1,9 +1,16 @@
 """
-This module contains the ColorPrinter class, which is a callable object that
-prints text in a specified color.
+This module contains the ColorStreamWriter class, which prints streamed text in
+a specified color with few print calls, and the ConsoleSubscriber class, which
+prints pipeline events to the console.
 """
+
+import threading
+import time
+
 import colorama
 
+from events import Event, TurnSerializer, render_text
+
 colorama.just_fix_windows_console()
 
 COLORS = {
@@ -27,44 +34,165 @@ COLORS = {
 }
 
 
-class ColorPrinter:
+class ColorStreamWriter:
     """
-    A callable object that prints text in a specified color.
+    Prints a streamed agent turn in a specified color, coalescing its chunks.
 
-    Attributes:
-        name (str): The name of the printer.
-        color (str): The colorama.Fore color of the agent's output text.
+    Chunks are buffered and printed together once flush_interval seconds have
+    passed since the last print, or once the buffer holds max_buffer characters.
+    A timer prints the buffer when the stream pauses, so the last chunks before
+    a pause do not wait for the next one.
+
+    The color is set once at the start of a turn and reset once at its end,
+    instead of around every chunk. Printing goes through print, so output
+    redirection (e.g. per web run) keeps working.
 
     Examples:
-        >>> from printer import ColorPrinter
-        >>> color_printer = ColorPrinter("Agent", colorama.Fore.RED)
-        >>> color_printer("Hello, World!")
+        >>> writer = ColorStreamWriter("RED")
+        >>> writer.start("### Agent ###")
+        >>> for chunk in ["Hello", ", ", "World!"]:
+        ...     writer.write(chunk)
+        >>> writer.end()
         ### Agent ###
         Hello, World!  # <-- red color
     """
 
     def __init__(
-        self,
-        color: str,
+        self, color: str, flush_interval: float = 0.03, max_buffer: int = 4096
     ) -> None:
         """
-        Initialize the ColorPrinter object.
+        Initialize the ColorStreamWriter object.
 
         Args:
             color (str): The color of the output text.
+            flush_interval (float, optional): Seconds between two prints while
+            streaming. Defaults to 0.03.
+            max_buffer (int, optional): Buffered characters that force a print.
+            Defaults to 4096.
         """
         self.color = COLORS[color]
+        self._flush_interval = flush_interval
+        self._max_buffer = max_buffer
+        self._buffer: list[str] = []
+        self._size = 0
+        self._last_flush = 0.0
+        self._timer: threading.Timer | None = None
+        # The timer prints on its own thread.
+        self._lock = threading.Lock()
+
+    def start(self, header: str) -> None:
+        """
+        Start a turn: set the color and print the header line.
+
+        Args:
+            header (str): The header, e.g. the agent's name.
+        """
+        self._buffer = [self.color, header, "\n"]
+        self.flush()
 
-    def __call__(self, *args, **kwargs) -> None:
+    def write(self, text: str) -> None:
         """
-        Prints the content in the agent's color and returns it.
+        Buffer a chunk of the turn, printing the buffer if a threshold is reached.
 
         Args:
-            content (T): The content to be printed.
+            text (str): The chunk.
+        """
+        with self._lock:
+            self._buffer.append(text)
+            self._size += len(text)
+            wait = self._last_flush + self._flush_interval - time.monotonic()
+            if self._size >= self._max_buffer or wait <= 0:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def end(self, trailer: str = "\n\n") -> None:
+        """
+        End a turn: print the remaining buffer and the trailer, and reset the color.
+
+        Args:
+            trailer (str, optional): Text printed after the turn.
+        """
+        with self._lock:
+            self._buffer.extend([trailer, colorama.Style.RESET_ALL])
+            self._flush()
+
+    def flush(self) -> None:
+        """
+        Print the buffered text with a single print call.
+        """
+        with self._lock:
+            self._flush()
 
-        Returns:
-            T: The content.
+    def _flush(self) -> None:
+        """
+        Print the buffered text and cancel the pending timer. Must be called
+        with the lock held.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._buffer:
+            print("".join(self._buffer), end="", flush=True)
+            self._buffer = []
+            self._size = 0
+        self._last_flush = time.monotonic()
+
+
+class ConsoleSubscriber:
+    """
+    Prints pipeline events to the console.
+
+    Agent turns are printed in the color of their agent_start event (the
+    terminal's default color otherwise) through a ColorStreamWriter; all other
+    events are printed as rendered by events.render_text. Concurrent agent
+    turns are printed one after the other, see events.TurnSerializer.
+
+    Examples:
+        >>> bus = EventBus(subscribers=[ConsoleSubscriber()])
+        >>> bus.log("Reading input file...")
+        Reading input file...
+    """
+
+    def __init__(self, flush_interval: float = 0.03, max_buffer: int = 4096) -> None:
+        """
+        Initialize the ConsoleSubscriber object.
+
+        Args:
+            flush_interval (float, optional): Seconds between two prints while
+            streaming. Defaults to 0.03.
+            max_buffer (int, optional): Buffered characters that force a print.
+            Defaults to 4096.
+        """
+        self._flush_interval = flush_interval
+        self._max_buffer = max_buffer
+        self._writers: dict[str | None, ColorStreamWriter] = {}
+        self._serializer = TurnSerializer(self._print)
+
+    def __call__(self, event: Event) -> None:
+        self._serializer(event)
+
+    def _print(self, event: Event) -> None:
+        """
+        Print an event; the events of a turn arrive without interruption.
         """
-        print(f"{self.color}", end="")
-        print(*args, **kwargs)
-        print(f"{colorama.Style.RESET_ALL}", end="", flush=True)
+        if event.type == "agent_start":
+            writer = ColorStreamWriter(
+                event.data.get("color", "RESET"),
+                self._flush_interval,
+                self._max_buffer,
+            )
+            self._writers[event.agent] = writer
+            writer.start(f"### {event.agent} ###")
+        elif event.type == "token" and event.agent in self._writers:
+            self._writers[event.agent].write(event.text)
+        elif event.type == "agent_end" and event.agent in self._writers:
+            self._writers.pop(event.agent).end()
+        else:
+            if event.type == "error" and event.agent in self._writers:
+                self._writers.pop(event.agent).end("")
+            text = render_text(event)
+            if text:
+                print(text, end="", flush=True)
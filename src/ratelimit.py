@@ -0,0 +1,334 @@
+"""
+This module keeps the agents within the account's rate limits and retries
+transient backend failures.
+
+All agents of a process share a limiter per configuration, so concurrent runs
+and batch stories draw from the same request and token budget. Every call
+reserves its estimated cost (prompt tokens plus max_tokens) before it is sent;
+the unused part of the reservation is returned when the response is complete.
+Calls that fail before their first chunk with a retryable error, such as a 429
+or a 5xx, are retried with jittered exponential backoff. A Retry-After hint
+pauses all callers of the limiter, not just the one that received it. Both
+waits end at once, with Cancelled, when the token of the call is cancelled.
+
+Classes:
+    RateLimiter: Token buckets for requests and tokens per minute, plus the
+    shared backoff state.
+    RateLimitedBackend: Wraps a backend with a rate limiter and retries.
+
+Functions:
+    shared_limiter: Returns the process-wide limiter of a configuration section.
+"""
+
+import random
+import threading
+import time
+import typing
+
+from backends import Backend
+import cancellation
+from cancellation import CancellationToken, Cancelled
+from client import BackendError
+import tokens
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+
+
+class _Bucket:
+    """
+    A token bucket refilled continuously at a per-minute rate.
+
+    The level may become negative: a reservation is always granted, and the
+    caller waits until the bucket has refilled the debt. Concurrent callers are
+    therefore served in the order they reserved.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self._rate = per_minute / 60
+        self._level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._level = min(
+            self.capacity, self._level + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    def take(self, amount: float, now: float) -> float:
+        """
+        Reserve an amount and return the seconds until it is covered.
+        """
+        self._refill(now)
+        self._level -= min(amount, self.capacity)
+        return max(0.0, -self._level / self._rate)
+
+    def give(self, amount: float, now: float) -> None:
+        """
+        Return an unused part of a reservation.
+        """
+        self._refill(now)
+        self._level = min(self.capacity, self._level + amount)
+
+
+class RateLimiter:
+    """
+    Request and token budgets per minute, plus the backoff state of all callers.
+
+    The limiter is thread-safe and never sleeps while holding its lock, so it can
+    be shared by threads and event loops alike.
+
+    Example:
+        >>> limiter = RateLimiter(requests_per_minute=500, tokens_per_minute=40000)
+        >>> limiter.acquire(3500)
+        >>> ...
+        >>> limiter.release(3500, used=1200)
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ) -> None:
+        """
+        Initialize the limiter.
+
+        Args:
+            requests_per_minute (int | None, optional): Request budget. Defaults to
+            no limit.
+            tokens_per_minute (int | None, optional): Token budget. Defaults to no
+            limit.
+            max_retries (int, optional): Retries of a failed call before the error
+            is raised. Defaults to 5.
+            base_delay (float, optional): Backoff of the first retry in seconds; it
+            doubles with every further retry. Defaults to 1.
+            max_delay (float, optional): Upper bound of a single backoff in seconds.
+            Defaults to 60.
+        """
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: int) -> float:
+        """
+        Reserve a request of the given token cost.
+
+        Args:
+            cost (int): Estimated tokens of the request, prompt plus max_tokens.
+
+        Returns:
+            float: Seconds to wait before the request may be sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self._requests is not None:
+                wait = max(wait, self._requests.take(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.take(cost, now))
+            return wait
+
+    def acquire(self, cost: int, cancel: CancellationToken | None = None) -> None:
+        """
+        Reserve a request and block until it may be sent.
+
+        Args:
+            cost (int): Estimated tokens of the request.
+            cancel (CancellationToken | None, optional): Ends the wait early.
+
+        Raises:
+            Cancelled: If the token is cancelled; the tokens are returned.
+        """
+        try:
+            cancellation.sleep(self.reserve(cost), cancel)
+        except Cancelled:
+            self.release(cost, 0)
+            raise
+
+    async def acquire_async(
+        self, cost: int, cancel: CancellationToken | None = None
+    ) -> None:
+        """
+        Asynchronous counterpart of acquire.
+
+        Args:
+            cost (int): Estimated tokens of the request.
+            cancel (CancellationToken | None, optional): Ends the wait early.
+
+        Raises:
+            Cancelled: If the token is cancelled; the tokens are returned.
+        """
+        try:
+            await cancellation.sleep_async(self.reserve(cost), cancel)
+        except Cancelled:
+            self.release(cost, 0)
+            raise
+
+    def release(self, cost: int, used: int) -> None:
+        """
+        Return the unused part of a reservation.
+
+        Args:
+            cost (int): The reserved tokens.
+            used (int): The tokens the request actually used.
+        """
+        if self._tokens is None or used >= cost:
+            return
+        with self._lock:
+            self._tokens.give(cost - used, time.monotonic())
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Compute the delay before a retry and pause all callers for a Retry-After.
+
+        Args:
+            attempt (int): The zero-based number of the failed attempt.
+            retry_after (float | None, optional): The server's Retry-After hint in
+            seconds.
+
+        Returns:
+            float: Seconds to wait before retrying.
+        """
+        delay: float = min(self._max_delay, self._base_delay * 2**attempt)
+        # Equal jitter keeps retries spread out without dropping to zero.
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            with self._lock:
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + retry_after
+                )
+        return delay
+
+
+_LIMITERS: dict[tuple[tuple[str, typing.Any], ...], RateLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def shared_limiter(spec: dict[str, typing.Any] | None = None) -> RateLimiter:
+    """
+    Return the process-wide limiter of a configuration section.
+
+    Agents created from the same "rate_limits" section share one limiter, also
+    across concurrent runs.
+
+    Args:
+        spec (dict[str, typing.Any] | None, optional): The "rate_limits" section
+        of the configuration, with the keyword arguments of RateLimiter.
+
+    Returns:
+        RateLimiter: The shared limiter.
+    """
+    key = tuple(sorted((spec or {}).items()))
+    with _LIMITERS_LOCK:
+        if key not in _LIMITERS:
+            _LIMITERS[key] = RateLimiter(**dict(key))
+        return _LIMITERS[key]
+
+
+class RateLimitedBackend(Backend):
+    """
+    Wraps a backend with a rate limiter and retries of transient failures.
+
+    A call is retried only if it fails with a retryable BackendError before its
+    first chunk; once content has been streamed, the error is raised, because
+    the agent has already recorded part of the response.
+
+    Example:
+        >>> backend = RateLimitedBackend(OpenAIBackend(), shared_limiter())
+        >>> "".join(backend.stream({"model": "gpt-4", "messages": [...]}))
+    """
+
+    def __init__(self, backend: Backend, limiter: RateLimiter) -> None:
+        """
+        Initialize the wrapper.
+
+        Args:
+            backend (Backend): The wrapped backend.
+            limiter (RateLimiter): The limiter shared with other backends.
+        """
+        self._backend = backend
+        self._limiter = limiter
+
+    @staticmethod
+    def _cost(request: dict[str, typing.Any]) -> int:
+        """
+        Estimate the tokens of a request: its prompt plus max_tokens.
+        """
+        model = request.get("model", "")
+        prompt = tokens.TOKENS_PER_REPLY + sum(
+            tokens.count_message_tokens(message, model)
+            for message in request.get("messages", [])
+        )
+        max_tokens: int = request.get("max_tokens", 0)
+        return prompt + max_tokens
+
+    def _retry_delay(self, err: BackendError, attempt: int) -> float:
+        """
+        Return the delay before retrying a failed attempt, or raise the error.
+        """
+        if not err.retryable or attempt >= self._limiter.max_retries:
+            raise err
+        return self._limiter.backoff(attempt, err.retry_after)
+
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        cost = self._cost(request)
+        completion_budget = request.get("max_tokens", 0)
+        attempt = 0
+        while True:
+            self._limiter.acquire(cost, cancel)
+            chunks = 0
+            inner = self._backend.stream(request, cancel)
+            try:
+                for piece in inner:
+                    chunks += 1
+                    yield piece
+                return
+            except BackendError as err:
+                if chunks:
+                    raise
+                delay = self._retry_delay(err, attempt)
+            finally:
+                # Closes the HTTP response of a call cut off by the consumer at
+                # once, instead of when the inner stream is garbage collected.
+                inner.close()
+                # A streamed chunk is roughly one token.
+                self._limiter.release(cost, cost - completion_budget + chunks)
+            cancellation.sleep(delay, cancel)
+            attempt += 1
+
+    async def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        cost = self._cost(request)
+        completion_budget = request.get("max_tokens", 0)
+        attempt = 0
+        while True:
+            await self._limiter.acquire_async(cost, cancel)
+            chunks = 0
+            inner = self._backend.astream(request, cancel)
+            try:
+                async for piece in inner:
+                    chunks += 1
+                    yield piece
+                return
+            except BackendError as err:
+                if chunks:
+                    raise
+                delay = self._retry_delay(err, attempt)
+            finally:
+                await inner.aclose()
+                self._limiter.release(cost, cost - completion_budget + chunks)
+            await cancellation.sleep_async(delay, cancel)
+            attempt += 1
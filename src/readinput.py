@@ -14,14 +14,13 @@ def read_lines() -> str:
     Returns:
         str: The lines read from the user.
     """
-    lines = ""
+    lines = []
     try:
         while True:
             line = input()
             if line == "END":
                 break
-            lines += line
-            lines += "\n"
+            lines.append(line + "\n")
     except EOFError:
         pass
-    return lines
+    return "".join(lines)
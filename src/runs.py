@@ -0,0 +1,413 @@
+"""
+This module keeps track of pipeline runs started from the web interface.
+
+Every run gets its own event bus, numbered output log, stop flag and status.
+Its pipeline executes in a bounded pool of worker processes, see the workers
+module, so several users can share one server and long runs do not compete with
+the request handlers for the GIL; the events of the job are published on the
+run's bus in the server. The run's events are rendered into its output log,
+which readers wait on for new output instead of polling, and can resume from
+any position. With a run store, runs and their output are persisted and only a
+bounded tail of the output of each run is kept in memory.
+
+Classes:
+    Run: The state of a single pipeline run.
+    RunManager: Creates runs, queues them on the worker pool and looks them up.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+import typing
+import uuid
+
+from events import Event, EventBus, Subscriber, TurnSerializer, render_text
+from store import RunRecorder, RunStore
+from workers import DEFAULT_MAX_QUEUED, Target, WorkerPool
+
+DEFAULT_MAX_BUFFERED = 1000
+
+
+class Run:
+    """
+    The state of a single pipeline run.
+
+    The run's output is numbered by event: a reader that has seen n entries
+    resumes at entry n. Without a store the whole output is kept in memory. With
+    a store, output is appended to it in batches and only a bounded tail is
+    kept in memory; older entries are read back from the store.
+
+    Attributes:
+        run_id (str): Unique identifier of the run.
+        config_path (str): The configuration file used by the run.
+        status (str): One of "queued", "running", "complete", "stopped" or "error".
+        stop_event (threading.Event): Set when the user asks to stop the run.
+        events (EventBus): The bus the run's pipeline reports on; its events are
+        rendered into the output.
+        done_event (threading.Event): Set when the run has finished.
+    """
+
+    def __init__(
+        self,
+        config_path: str,
+        store: RunStore | None = None,
+        max_buffered: int = DEFAULT_MAX_BUFFERED,
+    ) -> None:
+        """
+        Initialize a queued run.
+
+        Args:
+            config_path (str): The configuration file used by the run.
+            store (RunStore | None, optional): Persists the run, its output, its
+            events and the outputs of its agents.
+            max_buffered (int, optional): Output entries kept in memory when the
+            run has a store; also the size of the batches written to it.
+        """
+        self.run_id = uuid.uuid4().hex
+        self.config_path = config_path
+        self.status = "queued"
+        self.created = time.time()
+        self.finished: float | None = None
+        # The phase and agents a stop cut off, from the run_end event
+        self.stopped_at: dict[str, typing.Any] | None = None
+        self.stop_event = threading.Event()
+        self.done_event = threading.Event()
+        self._store = store
+        self._max_buffered = max_buffered
+        # The in-memory tail of the output starts at entry _tail_start; entries
+        # before _flushed are in the store.
+        self._tail: list[str] = []
+        self._tail_start = 0
+        self._flushed = 0
+        self._count = 0
+        self._chars = 0
+        self._output = threading.Condition()
+        # Concurrent agent turns are rendered one after the other
+        self._turns = TurnSerializer(self.on_event)
+        self.events = EventBus(run_id=self.run_id, subscribers=[self._turns])
+        if store is not None:
+            store.create_run(self.run_id, config_path, self.status, self.created)
+            self.events.subscribe(RunRecorder(store, self.run_id))
+
+    def write(self, text: str) -> None:
+        """
+        Add output to the run's stream.
+
+        Args:
+            text (str): The output.
+        """
+        with self._output:
+            self._tail.append(text)
+            self._count += 1
+            self._chars += len(text)
+            if self._count - self._flushed >= self._max_buffered:
+                self._flush()
+            self._output.notify_all()
+
+    def on_event(self, event: Event) -> None:
+        """
+        Add the text rendering of a pipeline event to the run's output.
+
+        Output is written to the store at the end of every agent turn and phase,
+        or when a batch is full.
+
+        Args:
+            event (Event): An event of the run's bus.
+        """
+        text = render_text(event)
+        if text:
+            self.write(text)
+        if event.type == "run_end" and "cut_off" in event.data:
+            self.stopped_at = {
+                "phase": event.data["phase"],
+                "cut_off": event.data["cut_off"],
+            }
+        if event.type != "token":
+            with self._output:
+                self._flush()
+
+    def _flush(self) -> None:
+        """
+        Append the unwritten output to the store and trim the in-memory tail.
+        Must be called with the output lock held.
+        """
+        if self._store is None:
+            return
+        if self._flushed < self._count:
+            pending = self._tail[self._flushed - self._tail_start :]
+            self._store.append_transcript(self.run_id, self._flushed, pending)
+            self._flushed = self._count
+        excess = len(self._tail) - self._max_buffered
+        if excess > 0:
+            del self._tail[:excess]
+            self._tail_start += excess
+
+    def read_output(self, position: int, limit: int | None = None) -> list[str]:
+        """
+        Read output entries from a position on, without waiting.
+
+        Args:
+            position (int): Number of output entries the reader has seen.
+            limit (int | None, optional): Maximum number of entries. Reads from
+            the store are always limited to max_buffered entries.
+
+        Returns:
+            list[str]: The entries, possibly empty.
+        """
+        with self._output:
+            if position >= self._tail_start or self._store is None:
+                index = position - self._tail_start
+                end = len(self._tail) if limit is None else index + limit
+                return self._tail[index:end]
+        # Entries before the tail are in the store and never change.
+        limit = min(limit or self._max_buffered, self._max_buffered)
+        return self._store.read_transcript(self.run_id, position, limit)
+
+    def wait_for_output(
+        self, position: int, timeout: float | None = None
+    ) -> tuple[list[str], bool]:
+        """
+        Wait until the run has output beyond a position or has finished.
+
+        Args:
+            position (int): Number of output entries the reader has seen.
+            timeout (float | None, optional): Maximum seconds to wait.
+
+        Returns:
+            tuple[list[str], bool]: The new entries, possibly empty after a
+            timeout, and whether the run has finished. A finished run has no
+            further output.
+        """
+        with self._output:
+            self._output.wait_for(
+                lambda: self._count > position or self.done_event.is_set(),
+                timeout,
+            )
+            done = self.done_event.is_set()
+            count = self._count
+        messages = self.read_output(position)
+        return messages, done and position + len(messages) >= count
+
+    def iter_output(self) -> typing.Iterator[str]:
+        """
+        Read the output of the run so far, page by page.
+
+        Yields:
+            str: The text of each page.
+        """
+        position = 0
+        while True:
+            page = self.read_output(position, self._max_buffered)
+            if not page:
+                return
+            position += len(page)
+            yield "".join(page)
+
+    def should_stop(self) -> bool:
+        """
+        Check whether the user asked to stop the run.
+
+        Returns:
+            bool: True if the user asked to stop the run.
+        """
+        return self.stop_event.is_set()
+
+    def start(self) -> None:
+        """
+        Mark the run as running.
+        """
+        self.status = "running"
+        if self._store is not None:
+            self._store.set_status(self.run_id, self.status)
+
+    def finish(self, status: str) -> None:
+        """
+        Mark the run as finished and write its remaining output to the store.
+
+        Output held back for a turn that never ended, because its worker died,
+        is written as well.
+
+        Args:
+            status (str): The final status of the run.
+        """
+        self._turns.interrupt()
+        with self._output:
+            self._flush()
+            self.status = status
+            self.finished = time.time()
+            if self._store is not None:
+                self._store.set_status(self.run_id, status, self.finished)
+            self.done_event.set()
+            self._output.notify_all()
+
+    def summary(self) -> dict[str, typing.Any]:
+        """
+        Summarize the run without its output.
+
+        Returns:
+            dict[str, typing.Any]: Identifier, status, timestamps, number of output
+            events and length of the output, and for a run stopped during a
+            phase, the phase and the agents whose calls were cut off.
+        """
+        summary: dict[str, typing.Any] = {
+            "run_id": self.run_id,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "events": self._count,
+            "output_chars": self._chars,
+        }
+        if self.stopped_at is not None:
+            summary["stopped_at"] = self.stopped_at
+        return summary
+
+
+class RunManager:
+    """
+    Creates runs and executes their jobs in a bounded pool of worker processes.
+
+    A run is only accepted while a worker is idle or the queue has room; see
+    workers.QueueFull. Finished runs are kept in memory for later retrieval, up
+    to max_finished_runs; with a store, older runs remain available from it.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        max_finished_runs: int = 100,
+        store: RunStore | None = None,
+    ) -> None:
+        """
+        Initialize the manager; the worker processes start with the first run.
+
+        Args:
+            max_workers (int, optional): Number of worker processes, the maximum
+            number of concurrent runs.
+            max_queued (int, optional): Maximum number of runs waiting for a
+            worker.
+            max_finished_runs (int, optional): Finished runs kept in memory.
+            store (RunStore | None, optional): Persists all runs.
+        """
+        self._pool = WorkerPool(self._handle, max_workers, max_queued)
+        self._runs: OrderedDict[str, Run] = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_finished_runs = max_finished_runs
+        self.store = store
+
+    def submit(
+        self,
+        config_path: str,
+        target: Target,
+        arguments: tuple[typing.Any, ...] = (),
+        subscribers: typing.Iterable[Subscriber] = (),
+    ) -> Run:
+        """
+        Create a run and queue its job on the worker pool.
+
+        Args:
+            config_path (str): The configuration file used by the run.
+            target (Target): Executes the pipeline for the run; a module-level
+            function called in a worker process with a workers.JobContext and
+            the arguments.
+            arguments (tuple[typing.Any, ...], optional): Further picklable
+            arguments of target.
+            subscribers (typing.Iterable[Subscriber], optional): Added to the
+            run's bus before its first event, in this process.
+
+        Returns:
+            Run: The queued run.
+
+        Raises:
+            workers.QueueFull: If every worker is busy and the queue is full.
+        """
+        slot = self._pool.reserve()
+        try:
+            run = Run(config_path, self.store)
+        except BaseException:
+            self._pool.release(slot)
+            raise
+        for subscriber in subscribers:
+            run.events.subscribe(subscriber)
+        with self._lock:
+            self._runs[run.run_id] = run
+            self._prune()
+        self._pool.submit(slot, run.run_id, target, arguments)
+        return run
+
+    def get(self, run_id: str) -> Run | None:
+        """
+        Look up a run.
+
+        Args:
+            run_id (str): The identifier returned by submit.
+
+        Returns:
+            Run | None: The run, or None if it is unknown.
+        """
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def stop(self, run_id: str) -> Run | None:
+        """
+        Ask a run to stop. Queued runs are stopped before they start.
+
+        Args:
+            run_id (str): The identifier returned by submit.
+
+        Returns:
+            Run | None: The run, or None if it is unknown.
+        """
+        run = self.get(run_id)
+        if run is not None and not run.done_event.is_set():
+            run.stop_event.set()
+            self._pool.cancel(run_id)
+        return run
+
+    def close(self) -> None:
+        """
+        Stop the worker processes once the queued runs are done.
+        """
+        self._pool.close()
+
+    def _handle(self, kind: str, run_id: str, payload: typing.Any) -> None:
+        """
+        Apply a message of a run's job to the run, on the pool's dispatcher.
+        """
+        run = self.get(run_id)
+        if run is None or run.done_event.is_set():
+            return
+        if kind == "event":
+            run.events.publish(payload)
+        elif kind == "checkpoint":
+            if self.store is not None:
+                self.store.save_checkpoint(run_id, payload)
+        elif kind == "start":
+            run.start()
+        elif kind == "done":
+            self._finish(run, payload)
+
+    @staticmethod
+    def _finish(run: Run, error: tuple[str, str] | None) -> None:
+        """
+        Record the final status of a run whose job has ended.
+        """
+        if error is not None:
+            error_type, text = error
+            run.events.emit("error", text=text, data={"type": error_type})
+            run.finish("error")
+        elif run.should_stop():
+            run.events.log("\n*** Processing stopped by user ***")
+            run.finish("stopped")
+        else:
+            run.finish("complete")
+
+    def _prune(self) -> None:
+        """
+        Forget the oldest finished runs beyond max_finished_runs.
+        """
+        finished = [
+            run_id for run_id, run in self._runs.items() if run.done_event.is_set()
+        ]
+        for run_id in finished[: max(0, len(finished) - self._max_finished_runs)]:
+            del self._runs[run_id]
@@ -0,0 +1,411 @@
+"""
+This module persists pipeline runs of the web interface in SQLite.
+
+For every run the store keeps its status, its transcript, its structured events
+(except the individual tokens, which are part of the transcript), the output of
+every agent in every phase and its last checkpoint, from which it can be
+resumed. The transcript is appended in batches as the run
+streams and is read back in pages, so neither writers nor readers need a whole
+transcript in memory. Runs survive restarts of the server; runs that were still
+active when the server stopped are marked as interrupted.
+
+Classes:
+    RunStore: SQLite-backed store of runs, transcripts, events and artifacts.
+    RunRecorder: An event subscriber that records a run's events and artifacts.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import typing
+
+from checkpoint import Checkpoint
+from events import Event
+
+DEFAULT_RUN_STORE_PATH = os.path.join(".cache", "runs.sqlite")
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS runs ("
+    " run_id TEXT PRIMARY KEY,"
+    " config_path TEXT NOT NULL,"
+    " status TEXT NOT NULL,"
+    " created REAL NOT NULL,"
+    " finished REAL)",
+    "CREATE TABLE IF NOT EXISTS transcript ("
+    " run_id TEXT NOT NULL,"
+    " seq INTEGER NOT NULL,"
+    " text TEXT NOT NULL,"
+    " PRIMARY KEY (run_id, seq)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS events ("
+    " run_id TEXT NOT NULL,"
+    " type TEXT NOT NULL,"
+    " phase INTEGER,"
+    " agent TEXT,"
+    " text TEXT,"
+    " data TEXT,"
+    " time REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS events_run ON events (run_id)",
+    "CREATE TABLE IF NOT EXISTS artifacts ("
+    " run_id TEXT NOT NULL,"
+    " phase INTEGER NOT NULL,"
+    " agent TEXT NOT NULL,"
+    " output TEXT NOT NULL,"
+    " prompt_tokens INTEGER,"
+    " completion_tokens INTEGER,"
+    " time REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS artifacts_run ON artifacts (run_id, phase)",
+    "CREATE TABLE IF NOT EXISTS checkpoints ("
+    " run_id TEXT PRIMARY KEY,"
+    " data TEXT NOT NULL)",
+)
+
+
+class RunStore:
+    """
+    SQLite-backed store of runs, transcripts, events and artifacts.
+
+    The store is shared by all runs of a process; access is serialized with a
+    lock. Transcript entries are numbered per run, like the events of the run's
+    output stream, so a page of the transcript starts at any stream position.
+
+    Example:
+        >>> store = RunStore("runs.sqlite")
+        >>> store.create_run("1a2b", "config/testv1.json", "queued", time.time())
+        >>> store.append_transcript("1a2b", 0, ["--- Phase 1 ---\\n", "..."])
+        >>> store.read_transcript("1a2b", offset=0, limit=100)
+        ["--- Phase 1 ---\\n", "..."]
+    """
+
+    def __init__(self, path: str = DEFAULT_RUN_STORE_PATH) -> None:
+        """
+        Open or create the store and mark runs of a previous process as
+        interrupted.
+
+        Args:
+            path (str, optional): Path to the SQLite file.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._connection.execute(
+            "UPDATE runs SET status = 'interrupted'"
+            f" WHERE status IN ({', '.join('?' for _ in ACTIVE_STATUSES)})",
+            ACTIVE_STATUSES,
+        )
+        self._connection.commit()
+
+    def create_run(
+        self, run_id: str, config_path: str, status: str, created: float
+    ) -> None:
+        """
+        Record a new run.
+
+        Args:
+            run_id (str): The run identifier.
+            config_path (str): The configuration file used by the run.
+            status (str): The initial status.
+            created (float): When the run was created, as a Unix timestamp.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO runs (run_id, config_path, status, created)"
+                " VALUES (?, ?, ?, ?)",
+                (run_id, config_path, status, created),
+            )
+            self._connection.commit()
+
+    def set_status(
+        self, run_id: str, status: str, finished: float | None = None
+    ) -> None:
+        """
+        Update the status of a run.
+
+        Args:
+            run_id (str): The run identifier.
+            status (str): The new status.
+            finished (float | None, optional): When the run finished.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE runs SET status = ?, finished = ? WHERE run_id = ?",
+                (status, finished, run_id),
+            )
+            self._connection.commit()
+
+    def append_transcript(self, run_id: str, start: int, texts: list[str]) -> None:
+        """
+        Append a batch of transcript entries.
+
+        Args:
+            run_id (str): The run identifier.
+            start (int): The number of the first entry.
+            texts (list[str]): The entries, numbered consecutively from start.
+        """
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO transcript (run_id, seq, text) VALUES (?, ?, ?)",
+                [(run_id, start + index, text) for index, text in enumerate(texts)],
+            )
+            self._connection.commit()
+
+    def read_transcript(self, run_id: str, offset: int, limit: int) -> list[str]:
+        """
+        Read a page of a run's transcript.
+
+        Args:
+            run_id (str): The run identifier.
+            offset (int): The number of the first entry.
+            limit (int): The maximum number of entries.
+
+        Returns:
+            list[str]: The entries from offset on, at most limit.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT text FROM transcript WHERE run_id = ? AND seq >= ?"
+                " ORDER BY seq LIMIT ?",
+                (run_id, offset, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_transcript(
+        self, run_id: str, page_size: int = 1000
+    ) -> typing.Iterator[str]:
+        """
+        Read a run's whole transcript page by page.
+
+        Args:
+            run_id (str): The run identifier.
+            page_size (int, optional): Entries read per query.
+
+        Yields:
+            str: The text of each page.
+        """
+        offset = 0
+        while True:
+            page = self.read_transcript(run_id, offset, page_size)
+            if not page:
+                return
+            offset += len(page)
+            yield "".join(page)
+
+    def append_event(self, event: Event) -> None:
+        """
+        Record a structured event.
+
+        Args:
+            event (Event): The event; its run_id identifies the run.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO events (run_id, type, phase, agent, text, data, time)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    event.run_id,
+                    event.type,
+                    event.phase,
+                    event.agent,
+                    event.text or None,
+                    json.dumps(event.data) if event.data else None,
+                    event.time,
+                ),
+            )
+            self._connection.commit()
+
+    def append_artifact(
+        self, run_id: str, phase: int, agent: str, output: str, event: Event
+    ) -> None:
+        """
+        Record the output of an agent in a phase.
+
+        Args:
+            run_id (str): The run identifier.
+            phase (int): The one-based phase.
+            agent (str): The agent name.
+            output (str): The agent's response.
+            event (Event): The agent_end event, for the token usage and time.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO artifacts"
+                " (run_id, phase, agent, output, prompt_tokens, completion_tokens,"
+                " time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    phase,
+                    agent,
+                    output,
+                    event.data.get("prompt_tokens"),
+                    event.data.get("completion_tokens"),
+                    event.time,
+                ),
+            )
+            self._connection.commit()
+
+    def save_checkpoint(self, run_id: str, checkpoint: Checkpoint) -> None:
+        """
+        Replace the checkpoint of a run.
+
+        Args:
+            run_id (str): The run identifier.
+            checkpoint (Checkpoint): The state after the run's last completed step.
+        """
+        data = json.dumps(checkpoint.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO checkpoints (run_id, data) VALUES (?, ?)",
+                (run_id, data),
+            )
+            self._connection.commit()
+
+    def load_checkpoint(self, run_id: str) -> Checkpoint | None:
+        """
+        Look up the checkpoint of a run.
+
+        Args:
+            run_id (str): The run identifier.
+
+        Returns:
+            Checkpoint | None: The last checkpoint, or None if the run has none.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM checkpoints WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return Checkpoint.from_dict(json.loads(row[0])) if row else None
+
+    def get_run(self, run_id: str) -> dict[str, typing.Any] | None:
+        """
+        Look up a run.
+
+        Args:
+            run_id (str): The run identifier.
+
+        Returns:
+            dict[str, typing.Any] | None: The run summary, or None if unknown.
+        """
+        runs = self._select_runs("WHERE runs.run_id = ?", (run_id,))
+        return runs[0] if runs else None
+
+    def list_runs(
+        self, limit: int = 50, offset: int = 0
+    ) -> list[dict[str, typing.Any]]:
+        """
+        List runs, newest first.
+
+        Args:
+            limit (int, optional): The maximum number of runs.
+            offset (int, optional): The number of newer runs to skip.
+
+        Returns:
+            list[dict[str, typing.Any]]: The run summaries.
+        """
+        return self._select_runs(
+            "ORDER BY runs.created DESC LIMIT ? OFFSET ?", (limit, offset)
+        )
+
+    def _select_runs(
+        self, clause: str, parameters: tuple[typing.Any, ...]
+    ) -> list[dict[str, typing.Any]]:
+        """
+        Select run summaries with their transcript and artifact counts.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT run_id, config_path, status, created, finished,"
+                " (SELECT COUNT(*) FROM transcript WHERE run_id = runs.run_id),"
+                " (SELECT COUNT(*) FROM artifacts WHERE run_id = runs.run_id)"
+                f" FROM runs {clause}",
+                parameters,
+            ).fetchall()
+        keys = (
+            "run_id",
+            "config_path",
+            "status",
+            "created",
+            "finished",
+            "events",
+            "artifacts",
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+    def list_artifacts(self, run_id: str) -> list[dict[str, typing.Any]]:
+        """
+        List the outputs of all agents in all phases of a run.
+
+        Args:
+            run_id (str): The run identifier.
+
+        Returns:
+            list[dict[str, typing.Any]]: The artifacts in the order they were
+            produced.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT phase, agent, output, prompt_tokens, completion_tokens, time"
+                " FROM artifacts WHERE run_id = ? ORDER BY rowid",
+                (run_id,),
+            ).fetchall()
+        keys = (
+            "phase",
+            "agent",
+            "output",
+            "prompt_tokens",
+            "completion_tokens",
+            "time",
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+class RunRecorder:
+    """
+    Records the structured events and the per-phase agent outputs of a run.
+
+    Token events are skipped; the streamed text is stored as the run's
+    transcript instead.
+
+    Example:
+        >>> bus.subscribe(RunRecorder(store, run_id))
+    """
+
+    def __init__(self, store: RunStore, run_id: str) -> None:
+        """
+        Args:
+            store (RunStore): The store.
+            run_id (str): The run identifier.
+        """
+        self._store = store
+        self._run_id = run_id
+        self._phase = 0
+
+    def __call__(self, event: Event) -> None:
+        if event.type == "token":
+            return
+        if event.type == "phase_start" and event.phase is not None:
+            self._phase = event.phase
+        if event.type == "agent_end" and event.agent is not None:
+            self._store.append_artifact(
+                self._run_id, self._phase, event.agent, event.text, event
+            )
+            # The response is stored as an artifact; keep the event small.
+            event = Event(
+                event.type,
+                run_id=event.run_id,
+                agent=event.agent,
+                data=event.data,
+                time=event.time,
+            )
+        self._store.append_event(event)
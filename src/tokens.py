@@ -0,0 +1,101 @@
+"""
+This module counts prompt tokens locally so agents can keep their context within
+a token budget.
+
+tiktoken is used when it is installed; otherwise the count is estimated from the
+text length. tiktoken is imported with the first count. Counts are not cached
+here; the agents keep the count of every message on the message, see
+agent.Message.
+
+Functions:
+    context_window: Returns the context size of a known model.
+    count_tokens: Counts the tokens of a text.
+    count_message_tokens: Counts the tokens of a chat message.
+"""
+
+import functools
+import typing
+
+# Context sizes of the models used by the shipped configurations. Longer
+# prefixes take precedence, so "gpt-4-32k" is not matched as "gpt-4".
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16_385,
+    "gpt-3.5-turbo-16k": 16_385,
+    "gpt-4": 8_192,
+    "gpt-4-32k": 32_768,
+    "gpt-4-turbo": 128_000,
+    "gpt-4o": 128_000,
+}
+
+# Tokens added by the chat format for every message, and to prime the reply.
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Rough number of characters per token when tiktoken is unavailable.
+CHARS_PER_TOKEN = 4
+
+
+def context_window(model: str) -> int | None:
+    """
+    Return the context size of a known model.
+
+    Args:
+        model (str): The OpenAI model name.
+
+    Returns:
+        int | None: The number of tokens the model accepts, or None if unknown.
+    """
+    matches = [name for name in MODEL_CONTEXT_TOKENS if model.startswith(name)]
+    if not matches:
+        return None
+    return MODEL_CONTEXT_TOKENS[max(matches, key=len)]
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str) -> typing.Any:
+    """
+    Load the tiktoken encoding of a model, or None if it is unavailable.
+    """
+    try:
+        import tiktoken  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # pylint: disable=broad-except
+        # The encoding files are downloaded on first use; fall back to the
+        # estimate when that is not possible.
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count the tokens of a text.
+
+    Args:
+        text (str): The text to count.
+        model (str): The OpenAI model whose tokenizer is used.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: dict[str, str], model: str) -> int:
+    """
+    Count the tokens a chat message occupies in the prompt.
+
+    Args:
+        message (dict[str, str]): A message as built by agent.make_message.
+        model (str): The OpenAI model whose tokenizer is used.
+
+    Returns:
+        int: The number of tokens, including the chat format overhead.
+    """
+    return TOKENS_PER_MESSAGE + count_tokens(message["content"], model)
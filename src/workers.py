@@ -0,0 +1,444 @@
+"""
+This module executes the pipeline jobs of the web app in a pool of worker
+processes.
+
+The server process keeps a bounded number of job slots: one per worker and a
+number of queued jobs. A job takes a slot when it is submitted and releases it
+when it has finished; when no slot is free, the job is rejected instead of
+queued. Queued jobs wait in the server and are handed to idle workers in order.
+Every worker has its own pipe to the server: it receives its jobs on it and
+reports their events and checkpoints back, and a dispatcher thread of the
+server hands them to a handler, so the runs' output, store and metrics stay in
+the server process. Stop requests are passed through a shared array of flags,
+one per slot, which a job can check as often as it likes.
+
+Workers are started with "spawn" on the first submission; they do not inherit
+the server's threads, connections or open files. A worker that dies is
+replaced and the job it was running is reported as failed.
+
+Classes:
+    QueueFull: Raised when a job is submitted while all slots are taken.
+    Job: A job waiting for or running in a worker.
+    JobContext: The view of a run inside a worker process.
+    WorkerPool: The worker processes, the job queue and the dispatcher.
+"""
+
+import collections
+import dataclasses
+import multiprocessing
+import multiprocessing.connection
+import signal
+import threading
+import traceback
+import typing
+
+from checkpoint import Checkpoint
+from events import Event, EventBus
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUED = 16
+
+Target = typing.Callable[..., None]
+
+# Called in the server with the message type, the run identifier and the
+# payload: None for "start", an Event for "event", a Checkpoint for
+# "checkpoint" and, for "done", None or the type and text of the error that
+# ended the job.
+Handler = typing.Callable[[str, str, typing.Any], None]
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while every worker is busy and the queue is
+    full.
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class Job:
+    """
+    A job waiting for or running in a worker.
+
+    Attributes:
+        slot (int): The slot the job holds; indexes its stop flag.
+        run_id (str): The run the job executes.
+        target (Target): A module-level function, called with a JobContext and
+        the arguments.
+        arguments (tuple[typing.Any, ...]): Further arguments of the target; they
+        must be picklable.
+    """
+
+    slot: int
+    run_id: str
+    target: Target
+    arguments: tuple[typing.Any, ...]
+
+
+class JobContext:
+    """
+    The view of a run inside a worker process.
+
+    It offers what a pipeline job needs of a runs.Run: the run identifier, an
+    event bus and the stop flag. Events and checkpoints are sent to the server.
+
+    Attributes:
+        run_id (str): The run the job executes.
+        events (EventBus): The bus the job reports on.
+    """
+
+    def __init__(
+        self,
+        job: Job,
+        connection: multiprocessing.connection.Connection,
+        stop_flags: typing.Any,
+    ) -> None:
+        """
+        Args:
+            job (Job): The job.
+            connection (multiprocessing.connection.Connection): The worker's
+            end of its pipe to the server.
+            stop_flags (typing.Any): The shared stop flags of all slots.
+        """
+        self.run_id = job.run_id
+        self._slot = job.slot
+        self._connection = connection
+        self._stop_flags = stop_flags
+        # Agents of a phase may report concurrently.
+        self._lock = threading.Lock()
+        self.events = EventBus(run_id=job.run_id, subscribers=[self._send_event])
+
+    def should_stop(self) -> bool:
+        """
+        Check whether the user asked to stop the run.
+
+        Returns:
+            bool: True if the user asked to stop the run.
+        """
+        return bool(self._stop_flags[self._slot])
+
+    def save_checkpoint(self, checkpoint: Checkpoint) -> None:
+        """
+        Send a checkpoint of the run to the server's run store.
+
+        Args:
+            checkpoint (Checkpoint): The state after the last completed step.
+        """
+        self.send("checkpoint", checkpoint)
+
+    def send(self, kind: str, payload: typing.Any = None) -> None:
+        """
+        Send a message about the job to the server. Blocks while the server is
+        behind in reading the worker's messages.
+
+        Args:
+            kind (str): "start", "event", "checkpoint" or "done".
+            payload (typing.Any, optional): The payload of the message type.
+        """
+        with self._lock:
+            self._connection.send((kind, payload))
+
+    def _send_event(self, event: Event) -> None:
+        """
+        Forward an event of the job's bus to the server.
+        """
+        self.send("event", event)
+
+
+@dataclasses.dataclass
+class _Worker:
+    """
+    A worker process, the server's end of its pipe and the job it runs.
+    """
+
+    process: typing.Any
+    connection: multiprocessing.connection.Connection
+    job: Job | None = None
+    retired: bool = False
+
+
+class WorkerPool:
+    """
+    The worker processes, the job queue and the dispatcher of their messages.
+
+    Example:
+        >>> pool = WorkerPool(print, workers=2, max_queued=8)
+        >>> slot = pool.reserve()
+        >>> pool.submit(slot, run_id, jobs.run_pipeline, (config_path, ...))
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        workers: int = DEFAULT_WORKERS,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+    ) -> None:
+        """
+        Initialize the pool; the workers are started on the first submission.
+
+        Args:
+            handler (Handler): Receives the messages of the jobs on the
+            dispatcher thread, in the order each job sent them.
+            workers (int, optional): Number of worker processes.
+            max_queued (int, optional): Number of jobs that may wait for a
+            worker.
+        """
+        self._handler = handler
+        self._size = max(1, workers)
+        self.capacity = self._size + max(0, max_queued)
+        self._free = list(range(self.capacity - 1, -1, -1))
+        # The run holding each submitted slot
+        self._owners: dict[int, str] = {}
+        self._pending: collections.deque[Job] = collections.deque()
+        self._workers: list[_Worker] = []
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_flags: typing.Any = None
+        self._closed = False
+
+    def reserve(self) -> int:
+        """
+        Take a free slot for a job.
+
+        Returns:
+            int: The slot, to be passed to submit or release.
+
+        Raises:
+            QueueFull: If all slots are taken.
+        """
+        with self._lock:
+            if not self._free:
+                raise QueueFull(
+                    f"{self._size} jobs are running and "
+                    f"{self.capacity - self._size} are queued"
+                )
+            return self._free.pop()
+
+    def release(self, slot: int) -> None:
+        """
+        Return a reserved slot that was not submitted.
+
+        Args:
+            slot (int): The slot returned by reserve.
+        """
+        with self._lock:
+            self._free.append(slot)
+
+    def submit(
+        self,
+        slot: int,
+        run_id: str,
+        target: Target,
+        arguments: tuple[typing.Any, ...] = (),
+    ) -> None:
+        """
+        Queue a job in a reserved slot.
+
+        Args:
+            slot (int): The slot returned by reserve.
+            run_id (str): The run the job executes; messages carry it.
+            target (Target): A module-level function, called in a worker with a
+            JobContext and the arguments.
+            arguments (tuple[typing.Any, ...], optional): Further picklable
+            arguments.
+
+        Raises:
+            RuntimeError: If the pool is closed.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The worker pool is closed")
+            if not self._workers:
+                self._start()
+            self._stop_flags[slot] = 0
+            self._owners[slot] = run_id
+            self._pending.append(Job(slot, run_id, target, arguments))
+            self._assign()
+
+    def cancel(self, run_id: str) -> None:
+        """
+        Ask the job of a run to stop. A queued job is taken off the queue and
+        reported as done at once.
+
+        Args:
+            run_id (str): The run of the job; nothing happens if its job has
+            finished.
+        """
+        with self._lock:
+            queued = next((job for job in self._pending if job.run_id == run_id), None)
+            if queued is not None:
+                self._pending.remove(queued)
+                del self._owners[queued.slot]
+                self._free.append(queued.slot)
+            for slot, owner in self._owners.items():
+                if owner == run_id:
+                    self._stop_flags[slot] = 1
+        if queued is not None:
+            self._handle("done", run_id, None)
+
+    def close(self) -> None:
+        """
+        Stop the workers once the queued jobs are done, and wait for them.
+        """
+        with self._lock:
+            self._closed = True
+            self._assign()
+            processes = [worker.process for worker in self._workers]
+        for process in processes:
+            process.join()
+
+    def _start(self) -> None:
+        """
+        Start the workers and the dispatcher. Must be called with the lock held.
+        """
+        self._stop_flags = self._context.RawArray("b", self.capacity)
+        self._workers = [self._spawn(index) for index in range(self._size)]
+        threading.Thread(
+            target=self._dispatch, name="worker-dispatcher", daemon=True
+        ).start()
+
+    def _spawn(self, index: int) -> _Worker:
+        """
+        Start a worker process.
+        """
+        connection, child = self._context.Pipe()
+        process = self._context.Process(
+            target=_work,
+            args=(child, self._stop_flags),
+            name=f"pipeline-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        # Only the worker holds its end now, so the server reads EOF when the
+        # worker dies.
+        child.close()
+        return _Worker(process, connection)
+
+    def _assign(self) -> None:
+        """
+        Hand queued jobs to idle workers, and retire idle workers once the pool
+        is closed and no job is left. Must be called with the lock held.
+        """
+        for worker in self._workers:
+            if worker.job is not None or worker.retired:
+                continue
+            if self._pending:
+                worker.job = self._pending.popleft()
+            elif self._closed:
+                worker.retired = True
+            else:
+                break
+            try:
+                worker.connection.send(worker.job)
+            except OSError:
+                # The worker has died; the dispatcher reports its job.
+                pass
+
+    def _dispatch(self) -> None:
+        """
+        Hand the messages of the jobs to the handler and replace dead workers,
+        until the pool is closed and all workers have ended.
+        """
+        while True:
+            with self._lock:
+                workers = {worker.connection: worker for worker in self._workers}
+            if not workers:
+                return
+            # Only the workers' connections are waited on.
+            ready = typing.cast(
+                list[multiprocessing.connection.Connection],
+                multiprocessing.connection.wait(list(workers)),
+            )
+            for connection in ready:
+                worker = workers[connection]
+                try:
+                    message: tuple[str, typing.Any] = connection.recv()
+                except (EOFError, OSError):
+                    self._replace(worker)
+                    continue
+                kind, payload = message
+                assert worker.job is not None
+                self._handle(kind, worker.job.run_id, payload)
+                if kind == "done":
+                    with self._lock:
+                        self._release(worker)
+                        self._assign()
+
+    def _replace(self, worker: _Worker) -> None:
+        """
+        Replace a worker that has ended, unless the pool is closed, and report
+        the job it was running as failed.
+        """
+        worker.process.join()
+        worker.connection.close()
+        job = worker.job
+        if job is not None:
+            self._handle(
+                "done",
+                job.run_id,
+                (
+                    "WorkerError",
+                    f"The worker process exited with code {worker.process.exitcode}",
+                ),
+            )
+        with self._lock:
+            self._release(worker)
+            index = self._workers.index(worker)
+            if self._closed:
+                del self._workers[index]
+            else:
+                self._workers[index] = self._spawn(index)
+            self._assign()
+
+    def _release(self, worker: _Worker) -> None:
+        """
+        Release the slot of a worker's finished job. Must be called with the
+        lock held.
+        """
+        job, worker.job = worker.job, None
+        if job is not None and self._owners.get(job.slot) == job.run_id:
+            del self._owners[job.slot]
+            self._free.append(job.slot)
+
+    def _handle(self, kind: str, run_id: str, payload: typing.Any) -> None:
+        """
+        Pass a message to the handler; an error in it must not end the
+        dispatcher.
+        """
+        try:
+            self._handler(kind, run_id, payload)
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+
+
+def _work(
+    connection: multiprocessing.connection.Connection, stop_flags: typing.Any
+) -> None:
+    """
+    Execute the jobs received from the server until the pool is closed. Runs in
+    a worker process.
+    """
+    # Ctrl+C in the server's terminal reaches the workers too; the server
+    # decides when they end.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            # The server has exited
+            return
+        if job is None:
+            return
+        context = JobContext(job, connection, stop_flags)
+        if context.should_stop():
+            # Stopped while queued
+            context.send("done")
+            continue
+        context.send("start")
+        try:
+            job.target(context, *job.arguments)
+        except Exception as err:  # pylint: disable=broad-except
+            context.send(
+                "done", (type(err).__name__, f"{err}\n{traceback.format_exc()}")
+            )
+        else:
+            context.send("done")
@@ -0,0 +1,9 @@
+"""
+Shared setup of the tests: the modules in src are imported like the entry
+points import them, as top-level modules.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
@@ -0,0 +1,106 @@
+"""
+Tests of the web interface's event stream, against the mock backend.
+"""
+
+import importlib
+import json
+import pathlib
+import typing
+
+import pytest
+
+
+@pytest.fixture(name="app", scope="module")
+def fixture_app(
+    tmp_path_factory: pytest.TempPathFactory,
+) -> typing.Iterator[typing.Any]:
+    """
+    The app module with a fresh run store, running its runs on the mock backend.
+    """
+    directory: pathlib.Path = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("LLM_BACKEND", "mock")
+        monkeypatch.setenv("RUN_STORE", str(directory / "runs.sqlite"))
+        monkeypatch.setenv("COMPLETION_CACHE", str(directory / "completions.sqlite"))
+        app = importlib.import_module("app")
+        yield app
+        app.run_manager.close()
+
+
+def frames(body: str) -> list[dict[str, typing.Any]]:
+    """
+    Parse the frames of an event stream that carry data.
+    """
+    parsed = []
+    for frame in body.split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in frame.splitlines() if ": " in line
+        )
+        if "data" in fields:
+            parsed.append({"id": int(fields["id"]), **json.loads(fields["data"])})
+    return parsed
+
+
+@pytest.fixture(name="run_id", scope="module")
+def fixture_run_id(app: typing.Any) -> str:
+    """
+    A finished run of a shipped configuration.
+    """
+    response = app.app.test_client().post(
+        "/process",
+        data={"config_file": "testv1.json", "user_story": "Log in", "mvp_text": ""},
+    )
+    assert response.status_code == 200, response.get_json()
+    run_id: str = response.get_json()["run_id"]
+    assert app.run_manager.get(run_id).done_event.wait(60)
+    return run_id
+
+
+def test_stream_sends_all_output_then_summary(app: typing.Any, run_id: str) -> None:
+    output = app.run_manager.get(run_id).read_output(0)
+    received = frames(app.app.test_client().get(f"/stream/{run_id}").text)
+    assert "".join(frame.get("message", "") for frame in received) == "".join(output)
+    assert received[-1]["complete"] is True
+    assert received[-1]["id"] == len(output)
+
+
+@pytest.mark.parametrize("seen", [1, 5])
+def test_last_event_id_replays_the_rest(
+    app: typing.Any, run_id: str, seen: int
+) -> None:
+    output = app.run_manager.get(run_id).read_output(0)
+    client = app.app.test_client()
+    by_header = frames(
+        client.get(f"/stream/{run_id}", headers={"Last-Event-ID": str(seen)}).text
+    )
+    by_query = frames(client.get(f"/stream/{run_id}?last_event_id={seen}").text)
+    assert by_header == by_query
+    assert by_header[0]["message"] == "".join(output[seen:])
+    assert by_header[0]["id"] == len(output)
+    assert by_header[-1]["complete"] is True
+
+
+def test_last_event_id_at_the_end_sends_only_summary(
+    app: typing.Any, run_id: str
+) -> None:
+    output = app.run_manager.get(run_id).read_output(0)
+    received = frames(
+        app.app.test_client()
+        .get(f"/stream/{run_id}", headers={"Last-Event-ID": str(len(output))})
+        .text
+    )
+    assert len(received) == 1
+    assert received[0]["complete"] is True
+
+
+def test_invalid_last_event_id_starts_over(app: typing.Any, run_id: str) -> None:
+    client = app.app.test_client()
+    full = frames(client.get(f"/stream/{run_id}").text)
+    invalid = frames(
+        client.get(f"/stream/{run_id}", headers={"Last-Event-ID": "x"}).text
+    )
+    assert invalid == full
+
+
+def test_stream_of_unknown_run(app: typing.Any) -> None:
+    assert app.app.test_client().get("/stream/unknown").status_code == 404
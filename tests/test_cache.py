@@ -0,0 +1,78 @@
+"""
+Tests of the completion cache and its LRU eviction.
+"""
+
+import itertools
+import pathlib
+import types
+
+import pytest
+
+import cache
+from cache import CompletionCache
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Give every access its own timestamp, so the LRU order does not depend on
+    the resolution of the system clock.
+    """
+    ticks = itertools.count()
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(time=lambda: next(ticks)))
+
+
+def test_get_returns_what_put_stored(tmp_path: pathlib.Path) -> None:
+    completions = CompletionCache(str(tmp_path / "cache.sqlite"))
+    key = CompletionCache.make_key({"model": "gpt-4", "messages": []})
+    assert completions.get(key) is None
+    completions.put(key, "Hello!")
+    assert completions.get(key) == "Hello!"
+
+
+def test_make_key_ignores_stream() -> None:
+    request = {"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}]}
+    assert CompletionCache.make_key(request) == CompletionCache.make_key(
+        {**request, "stream": True}
+    )
+
+
+def test_evicts_least_recently_used_entries(tmp_path: pathlib.Path) -> None:
+    completions = CompletionCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    completions.put("a", "A")
+    completions.put("b", "B")
+    # Reading "a" makes "b" the least recently used entry
+    assert completions.get("a") == "A"
+    completions.put("c", "C")
+    assert completions.get("b") is None
+    assert completions.get("a") == "A"
+    assert completions.get("c") == "C"
+
+
+def test_evicts_until_total_size_fits(tmp_path: pathlib.Path) -> None:
+    completions = CompletionCache(str(tmp_path / "cache.sqlite"), max_bytes=10)
+    completions.put("a", "x" * 4)
+    completions.put("b", "y" * 4)
+    completions.put("c", "z" * 4)
+    assert completions.get("a") is None
+    assert completions.get("b") == "y" * 4
+    assert completions.get("c") == "z" * 4
+    # A single entry above the limit does not stay either
+    completions.put("d", "w" * 11)
+    assert [completions.get(key) for key in "bcd"] == [None, None, None]
+
+
+def test_size_counts_encoded_bytes(tmp_path: pathlib.Path) -> None:
+    completions = CompletionCache(str(tmp_path / "cache.sqlite"), max_bytes=4)
+    completions.put("a", "äö")
+    completions.put("b", "ü")
+    assert completions.get("a") is None
+    assert completions.get("b") == "ü"
+
+
+def test_persists_across_instances(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "cache.sqlite")
+    first = CompletionCache(path)
+    first.put("a", "A")
+    first.close()
+    assert CompletionCache(path).get("a") == "A"
@@ -0,0 +1,184 @@
+"""
+Tests of cancelling agent calls: the token cuts off the stream and closes it,
+also while the backend waits or blocks on a read.
+"""
+
+import asyncio
+import threading
+import time
+import typing
+
+import pytest
+
+from agent import Agent, AsyncAgent
+from backends import Backend, MockBackend, OpenAIBackend
+from cancellation import CancellationToken, Cancelled
+import mock_server
+
+
+class ClosingBackend(Backend):
+    """
+    A mock backend recording whether its streams were closed.
+    """
+
+    def __init__(self, backend: Backend) -> None:
+        self._backend = backend
+        self.closed = 0
+
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        try:
+            yield from self._backend.stream(request, cancel)
+        finally:
+            self.closed += 1
+
+    async def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        try:
+            async for piece in self._backend.astream(request, cancel):
+                yield piece
+        finally:
+            self.closed += 1
+
+
+def make_agent(backend: Backend, agent_class: typing.Any = Agent) -> typing.Any:
+    """
+    Create an agent without persona prompts streaming from the backend.
+    """
+    return agent_class(
+        name="Agent",
+        openai_model="gpt-4",
+        max_tokens_per_call=100,
+        max_history=10,
+        backend=backend,
+    )
+
+
+@pytest.fixture(name="server_url", scope="module")
+def fixture_server_url() -> typing.Iterator[str]:
+    """
+    A mock server streaming one token every five seconds.
+    """
+    server = mock_server.create_server(
+        port=0, backend=MockBackend(tokens_per_second=0.2, response_tokens=50)
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def cancel_later(token: CancellationToken, delay: float = 0.2) -> None:
+    """
+    Cancel the token from another thread after the delay.
+    """
+    threading.Timer(delay, token.cancel).start()
+
+
+def test_check_function_cancels_token() -> None:
+    stop: list[bool] = []
+    token = CancellationToken(lambda: bool(stop))
+    assert not token.cancelled
+    stop.append(True)
+    assert token.cancelled
+    assert token()
+
+
+def test_wait_returns_early_once_cancelled() -> None:
+    token = CancellationToken()
+    assert not token.wait(0.01)
+    cancel_later(token)
+    start = time.monotonic()
+    assert token.wait(30)
+    assert time.monotonic() - start < 5
+
+
+def test_wait_polls_check_function() -> None:
+    stop: list[bool] = []
+    token = CancellationToken(lambda: bool(stop))
+    threading.Timer(0.2, stop.append, [True]).start()
+    start = time.monotonic()
+    assert token.wait(30)
+    assert time.monotonic() - start < 5
+
+
+def test_callbacks_run_once_on_the_cancelling_thread() -> None:
+    token = CancellationToken()
+    threads: list[str] = []
+    remove = token.on_cancel(lambda: threads.append(threading.current_thread().name))
+    token.on_cancel(lambda: threads.append("removed"))()
+    token.cancel()
+    token.cancel()
+    remove()
+    assert threads == [threading.current_thread().name]
+    # Registered after the cancellation, a callback runs at once
+    token.on_cancel(lambda: threads.append("late"))
+    assert threads[-1] == "late"
+
+
+def test_cancel_cuts_off_and_closes_stream() -> None:
+    backend = ClosingBackend(MockBackend(response_tokens=50))
+    agent = make_agent(backend)
+    token = CancellationToken()
+    pieces = []
+    with pytest.raises(Cancelled) as raised:
+        for piece in agent.generate_response("Hi", cancel=token):
+            pieces.append(piece)
+            if len(pieces) == 3:
+                token.cancel()
+    assert raised.value.agent == "Agent"
+    assert raised.value.chunks == 3
+    assert backend.closed == 1
+
+
+def test_cancel_ends_wait_for_first_token() -> None:
+    backend = ClosingBackend(MockBackend(ttft=30))
+    agent = make_agent(backend)
+    token = CancellationToken()
+    cancel_later(token)
+    start = time.monotonic()
+    with pytest.raises(Cancelled) as raised:
+        agent.get_full_response("Hi", cancel=token)
+    assert time.monotonic() - start < 5
+    assert raised.value.agent == "Agent"
+    assert raised.value.chunks == 0
+    assert backend.closed == 1
+
+
+def test_async_cancel_ends_wait_for_first_token() -> None:
+    backend = ClosingBackend(MockBackend(ttft=30))
+    agent = make_agent(backend, AsyncAgent)
+    token = CancellationToken()
+    cancel_later(token)
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        asyncio.run(agent.get_full_response("Hi", cancel=token))
+    assert time.monotonic() - start < 5
+    assert backend.closed == 1
+
+
+def test_cancel_closes_blocked_http_response(server_url: str) -> None:
+    agent = make_agent(OpenAIBackend(api_base=server_url, api_key="mock"))
+    stop: list[bool] = []
+    # A check function, like the stop flag of a worker process
+    token = CancellationToken(lambda: bool(stop))
+    threading.Timer(0.5, stop.append, [True]).start()
+    start = time.monotonic()
+    with pytest.raises(Cancelled) as raised:
+        agent.get_full_response("Hi", cancel=token)
+    assert time.monotonic() - start < 4
+    assert raised.value.chunks == 1
+
+
+def test_async_cancel_closes_blocked_http_response(server_url: str) -> None:
+    agent = make_agent(OpenAIBackend(api_base=server_url, api_key="mock"), AsyncAgent)
+    token = CancellationToken()
+    cancel_later(token, 0.5)
+    start = time.monotonic()
+    with pytest.raises(Cancelled) as raised:
+        asyncio.run(agent.get_full_response("Hi", cancel=token))
+    assert time.monotonic() - start < 4
+    assert raised.value.chunks == 1
@@ -0,0 +1,118 @@
+"""
+Tests of the run checkpoints: the file round-trip and resuming a run from
+every checkpoint it took.
+"""
+
+import os
+import pathlib
+import typing
+
+import pytest
+
+from backends import Backend, MockBackend
+from cancellation import CancellationToken
+import checkpoint
+from checkpoint import Checkpoint
+import config
+from events import EventBus
+import pipeline
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "config", "testv1.json"
+)
+
+
+class RecordingBackend(Backend):
+    """
+    A mock backend recording its requests, failing with the crash_at-th one.
+    """
+
+    def __init__(self, crash_at: int | None = None) -> None:
+        self._backend = MockBackend(response_tokens=20)
+        self._crash_at = crash_at
+        self.requests: list[dict[str, typing.Any]] = []
+
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        if len(self.requests) + 1 == self._crash_at:
+            raise RuntimeError("crash")
+        self.requests.append(request)
+        yield from self._backend.stream(request, cancel)
+
+    def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        return self._backend.astream(request, cancel)
+
+
+def run(
+    backend: Backend,
+    saved: list[Checkpoint] | None = None,
+    resume: Checkpoint | None = None,
+) -> str:
+    """
+    Run the pipeline of CONFIG_PATH on the backend.
+    """
+    plan = config.load_plan(CONFIG_PATH)
+    events = EventBus()
+    agents = config.create_coloragents(plan.config, backend=backend, events=events)
+    return pipeline.run_phases(
+        plan,
+        agents,
+        "As a user I want to log in.",
+        events=events,
+        checkpoint=saved.append if saved is not None else None,
+        resume=resume,
+    )
+
+
+def test_file_round_trip(tmp_path: pathlib.Path) -> None:
+    saved: list[Checkpoint] = []
+    run(RecordingBackend(), saved)
+    path = checkpoint.checkpoint_path("run", str(tmp_path))
+    for state in saved:
+        checkpoint.save_file(path, state)
+        assert checkpoint.load_file(path) == state
+    checkpoint.delete_file(path)
+    assert not os.path.exists(path)
+
+
+def test_checkpoints_every_step() -> None:
+    saved: list[Checkpoint] = []
+    backend = RecordingBackend()
+    run(backend, saved)
+    # One checkpoint per call and one after each phase
+    phases = len(config.load_plan(CONFIG_PATH).phases)
+    assert len(saved) == len(backend.requests) + phases
+
+
+@pytest.mark.parametrize("crash_at", [1, 2, 3, 4])
+def test_resume_repeats_no_call(tmp_path: pathlib.Path, crash_at: int) -> None:
+    full = RecordingBackend()
+    expected = run(full)
+
+    saved: list[Checkpoint] = []
+    crashed = RecordingBackend(crash_at)
+    with pytest.raises(RuntimeError):
+        run(crashed, saved)
+    path = checkpoint.checkpoint_path("run", str(tmp_path))
+    resume = None
+    if saved:
+        checkpoint.save_file(path, saved[-1])
+        resume = checkpoint.load_file(path)
+
+    resumed = RecordingBackend()
+    assert run(resumed, resume=resume) == expected
+    assert crashed.requests + resumed.requests == full.requests
+
+
+def test_resume_rejects_other_agents() -> None:
+    saved: list[Checkpoint] = []
+    run(RecordingBackend(), saved)
+    state = saved[0]
+    other = Checkpoint(
+        state.phase, state.step, state.user_story, state.turns, {"Someone": {}}
+    )
+    with pytest.raises(ValueError, match="does not match"):
+        run(RecordingBackend(), resume=other)
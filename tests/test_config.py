@@ -0,0 +1,123 @@
+"""
+Tests of the validation and compilation of configurations.
+"""
+
+import copy
+import os
+import typing
+
+import pytest
+
+import config
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config")
+
+
+def agent(name: str, tasks: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    """
+    Build a minimal agent configuration.
+    """
+    return {
+        "name": name,
+        "color": "BLUE",
+        "max_history": 10,
+        "temperature": 1.0,
+        "system": "",
+        "user": f"You are {name}.",
+        "tasks": tasks,
+    }
+
+
+@pytest.fixture(name="valid")
+def fixture_valid() -> dict[str, typing.Any]:
+    """
+    A valid configuration of two agents over two phases.
+    """
+    return {
+        "agent_order": ["A", "B"],
+        "agents": [
+            agent("A", {"1": "Review", "2": "Improve"}),
+            agent("B", {"1": "Check", "2": "Finish"}),
+        ],
+        "iterations": 2,
+        "max_tokens_per_call": 100,
+        "openai_model": "gpt-4",
+    }
+
+
+@pytest.mark.parametrize("name", ["testv1.json", "testv2.json"])
+def test_shipped_configurations_compile(name: str) -> None:
+    plan = config.load_plan(os.path.join(CONFIG_DIR, name))
+    assert plan.phases
+
+
+def test_compiles_linear_phases(valid: dict[str, typing.Any]) -> None:
+    plan = config.compile_plan(valid)
+    assert [phase.number for phase in plan.phases] == [1, 2]
+    tasks = plan.phases[0].tasks
+    assert tasks["A"].dependencies == ()
+    assert tasks["B"].dependencies == ("A",)
+    assert tasks["A"].task_info == "Review"
+
+
+def test_compiles_schedule(valid: dict[str, typing.Any]) -> None:
+    valid["schedule"] = {"1": {"A": [], "B": []}}
+    plan = config.compile_plan(valid)
+    assert plan.phases[0].tasks["B"].dependencies == ()
+    assert plan.phases[1].tasks["B"].dependencies == ("A",)
+
+
+def test_skips_phases_without_tasks(valid: dict[str, typing.Any]) -> None:
+    valid["iterations"] = 3
+    valid["agents"][0]["tasks"]["3"] = ""
+    plan = config.compile_plan(valid)
+    assert [phase.number for phase in plan.phases] == [1, 2]
+    assert plan.iterations == 3
+
+
+@pytest.mark.parametrize("phase", ["01", "0", "-1", "1.0", "one", "１", " 1"])
+def test_rejects_task_keys_that_are_not_phase_numbers(
+    valid: dict[str, typing.Any], phase: str
+) -> None:
+    valid["agents"][0]["tasks"][phase] = "Task"
+    with pytest.raises(ValueError, match="is not a phase number"):
+        config.compile_plan(valid)
+
+
+def test_rejects_task_that_is_not_a_string(valid: dict[str, typing.Any]) -> None:
+    valid["agents"][0]["tasks"]["1"] = ["Review"]
+    with pytest.raises(ValueError, match="must be a string"):
+        config.compile_plan(valid)
+
+
+@pytest.mark.parametrize(
+    "path, value, message",
+    [
+        (["openai_model"], None, "'openai_model' is missing"),
+        (["agents", 0, "color"], None, "'color' is missing"),
+        (["max_context_tokens"], 0, "must be a positive integer"),
+        (["compaction"], "yes", "must be true or false"),
+        (["convergence_threshold"], 1.5, "must be a number in"),
+        (["backend"], {"type": "other"}, "'backend' must be an object"),
+        (["rate_limits"], {"max_retries": -1}, "must be a non-negative integer"),
+        (["rate_limits"], {"burst": 1}, "'rate_limits' must be an object"),
+        (["schedule"], {"1": {"A": ["B"], "B": ["A"]}}, "Cyclic dependencies"),
+        (["schedule"], {"1": {"A": ["C"]}}, "'C' has no task in phase 1"),
+    ],
+)
+def test_rejects_invalid_configuration(
+    valid: dict[str, typing.Any],
+    path: list[typing.Any],
+    value: typing.Any,
+    message: str,
+) -> None:
+    invalid = copy.deepcopy(valid)
+    section = invalid
+    for key in path[:-1]:
+        section = section[key]
+    if value is None:
+        del section[path[-1]]
+    else:
+        section[path[-1]] = value
+    with pytest.raises(ValueError, match=message):
+        config.compile_plan(invalid)
@@ -0,0 +1,132 @@
+"""
+Tests of the rate limiter's handling of Retry-After hints and of the retries
+of the rate-limited backend.
+"""
+
+import email.utils
+import time
+import typing
+
+import pytest
+
+from backends import Backend, MockBackend
+import cancellation
+from cancellation import CancellationToken
+from client import BackendError, retry_after_seconds
+from ratelimit import RateLimitedBackend, RateLimiter
+
+REQUEST = {
+    "model": "gpt-4",
+    "max_tokens": 10,
+    "messages": [{"role": "user", "content": "Hi"}],
+}
+
+
+class FlakyBackend(Backend):
+    """
+    Fails its first calls with the given errors, then streams a mock response.
+    """
+
+    def __init__(self, *errors: BackendError) -> None:
+        self._errors = list(errors)
+        self.calls = 0
+
+    def stream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.Generator[str, None, None]:
+        self.calls += 1
+        if self._errors:
+            raise self._errors.pop(0)
+        yield from MockBackend().render(request)
+
+    def astream(
+        self, request: dict[str, typing.Any], cancel: CancellationToken | None = None
+    ) -> typing.AsyncGenerator[str, None]:
+        raise NotImplementedError
+
+
+@pytest.fixture(name="sleeps")
+def fixture_sleeps(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    """
+    Record the waits of the rate-limited backend instead of sleeping.
+    """
+    sleeps: list[float] = []
+
+    def sleep(delay: float, cancel: CancellationToken | None = None) -> None:
+        # pylint: disable=unused-argument
+        sleeps.append(delay)
+
+    monkeypatch.setattr(cancellation, "sleep", sleep)
+    return sleeps
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"Retry-After": "7"}, 7.0),
+        ({"Retry-After": "1.5"}, 1.5),
+        ({"Retry-After": "-3"}, 0.0),
+        ({"Retry-After": "soon"}, None),
+        ({}, None),
+        (None, None),
+    ],
+)
+def test_retry_after_seconds(
+    headers: dict[str, str] | None, expected: float | None
+) -> None:
+    assert retry_after_seconds(headers) == expected
+
+
+def test_retry_after_http_date() -> None:
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    seconds = retry_after_seconds({"Retry-After": date})
+    assert seconds is not None and 25 <= seconds <= 30
+
+
+def test_backoff_waits_at_least_retry_after() -> None:
+    limiter = RateLimiter(base_delay=0.01, max_delay=0.02)
+    assert limiter.backoff(0, retry_after=5) >= 5
+
+
+def test_backoff_without_retry_after_is_jittered_exponential() -> None:
+    limiter = RateLimiter(base_delay=1, max_delay=60)
+    for attempt, cap in [(0, 1), (1, 2), (3, 8), (10, 60)]:
+        delay = limiter.backoff(attempt)
+        assert cap / 2 <= delay <= cap
+
+
+def test_retry_after_pauses_every_caller() -> None:
+    limiter = RateLimiter()
+    assert limiter.reserve(1) == 0
+    limiter.backoff(0, retry_after=30)
+    assert 29 <= limiter.reserve(1) <= 30
+
+
+def test_retries_after_the_hinted_delay(sleeps: list[float]) -> None:
+    backend = FlakyBackend(BackendError("HTTP 429", retryable=True, retry_after=3))
+    limited = RateLimitedBackend(backend, RateLimiter(base_delay=0.01))
+    assert "".join(limited.stream(REQUEST)).startswith("Mock response")
+    assert backend.calls == 2
+    # The wait before the retry, then the paused limiter before the second call
+    assert sleeps[0] == 0
+    assert sleeps[1] >= 3
+    assert sleeps[2] > 2
+
+
+@pytest.mark.usefixtures("sleeps")
+def test_raises_after_max_retries() -> None:
+    error = BackendError("HTTP 503", retryable=True)
+    backend = FlakyBackend(error, error, error)
+    limited = RateLimitedBackend(backend, RateLimiter(max_retries=2))
+    with pytest.raises(BackendError, match="503"):
+        list(limited.stream(REQUEST))
+    assert backend.calls == 3
+
+
+@pytest.mark.usefixtures("sleeps")
+def test_does_not_retry_permanent_errors() -> None:
+    backend = FlakyBackend(BackendError("HTTP 401", retryable=False))
+    limited = RateLimitedBackend(backend, RateLimiter())
+    with pytest.raises(BackendError, match="401"):
+        list(limited.stream(REQUEST))
+    assert backend.calls == 1